@@ -7,34 +7,63 @@
 @Version : Python3.10
 @comment : ···
 """
-from .hard_link import HardLink
-from .micro_msg import MicroMsg
-from .media_msg import MediaMsg
-from .misc import Misc
-from .msg import Msg
+import importlib
+import threading
+
+from .contact_cache import ContactCache
 from .msg import MsgType
+from .msg_pager import page_cache
+
+# 数据库单例在第一次被访问时才创建，只打开已有的数据库；索引、统计表、词频表和全文索引在解密合并数据库时更新。
+# import app.DataBase 本身不会碰任何数据库文件，启动时只打开用到的库
+_DATABASES = {
+    'misc_db': ('.misc', 'Misc'),
+    'msg_db': ('.msg', 'Msg'),
+    'micro_msg_db': ('.micro_msg', 'MicroMsg'),
+    'hard_link_db': ('.hard_link', 'HardLink'),
+    'media_msg_db': ('.media_msg', 'MediaMsg'),
+    'msg_stats_db': ('.msg_stats', 'MsgStats'),
+    'msg_search_db': ('.msg_search', 'MsgSearch'),
+    'msg_words_db': ('.msg_words', 'MsgWords'),
+}
+_lock = threading.RLock()
+# 每次 close_db（重新解密、合并数据库之前）加一，缓存用它区分新旧数据
+_generation = 0
+
+contact_cache = ContactCache()
+
+
+def __getattr__(name):
+    if name not in _DATABASES:
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    with _lock:
+        if name not in globals():
+            module_name, class_name = _DATABASES[name]
+            cls = getattr(importlib.import_module(module_name, __name__), class_name)
+            globals()[name] = cls()
+    return globals()[name]
+
 
-misc_db = Misc()
-msg_db = Msg()
-micro_msg_db = MicroMsg()
-hard_link_db = HardLink()
-media_msg_db = MediaMsg()
+def db_generation() -> int:
+    return _generation
 
 
 def close_db():
-    misc_db.close()
-    msg_db.close()
-    micro_msg_db.close()
-    hard_link_db.close()
-    media_msg_db.close()
+    global _generation
+    _generation += 1
+    # 没创建过的数据库不需要关闭
+    for name in _DATABASES:
+        if name in globals():
+            globals()[name].close()
+    contact_cache.invalidate()
+    page_cache.invalidate()
 
 
 def init_db():
-    misc_db.init_database()
-    msg_db.init_database()
-    micro_msg_db.init_database()
-    hard_link_db.init_database()
-    media_msg_db.init_database()
+    for name in _DATABASES:
+        __getattr__(name).init_database()
 
 
-__all__ = ['misc_db', 'micro_msg_db', 'msg_db', 'hard_link_db', 'MsgType', "media_msg_db", "close_db"]
+__all__ = ['misc_db', 'micro_msg_db', 'msg_db', 'hard_link_db', 'MsgType', "media_msg_db", "close_db", 'db_generation',
+           'contact_cache', 'msg_stats_db', 'msg_search_db',
+           'msg_words_db']
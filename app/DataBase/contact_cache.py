@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+
+class ContactCache:
+    """
+    wxid -> Contact 的 LRU 缓存
+    群聊里每个发送人的联系人信息和头像只查询、解码一次，
+    导出、聊天界面和 PackageMsg 共用同一份缓存。
+    数据库重新解密或关闭时调用 invalidate() 清空
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        # 正在加载的 wxid -> 锁，只有请求同一个 wxid 的线程才互相等待
+        self._loading = {}
+        # invalidate() 时加一，丢弃失效前开始加载的结果
+        self._generation = 0
+
+    def get(self, wxid):
+        """
+        获取联系人，不在缓存里就从数据库加载
+        @param wxid:
+        @return: Contact，数据库里没有的联系人（比如已退群）返回 ContactDefault
+        """
+        with self._lock:
+            contact = self._cache.get(wxid)
+            if contact is not None:
+                self._cache.move_to_end(wxid)
+                return contact
+            wxid_lock = self._loading.setdefault(wxid, threading.Lock())
+        # 全局锁只保护字典操作，查询数据库和解码头像时只持有这个 wxid 的锁，
+        # 保证同一个 wxid 只会被解析一次，又不会让其他联系人排队
+        with wxid_lock:
+            with self._lock:
+                contact = self._cache.get(wxid)
+                if contact is not None:
+                    return contact
+                generation = self._generation
+            try:
+                contact = self._load(wxid)
+            except Exception:
+                with self._lock:
+                    self._loading.pop(wxid, None)
+                raise
+            with self._lock:
+                if generation == self._generation:
+                    self._cache[wxid] = contact
+                    if len(self._cache) > self.maxsize:
+                        self._cache.popitem(last=False)
+                self._loading.pop(wxid, None)
+        return contact
+
+    def invalidate(self, wxid=None):
+        """
+        使缓存失效
+        @param wxid: 为 None 时清空全部
+        @return:
+        """
+        with self._lock:
+            self._generation += 1
+            if wxid is None:
+                self._cache.clear()
+            else:
+                self._cache.pop(wxid, None)
+
+    def __len__(self):
+        return len(self._cache)
+
+    @staticmethod
+    def _load(wxid):
+        from app.DataBase import micro_msg_db, misc_db
+        from app.person import Contact, ContactDefault
+        contact_info_list = micro_msg_db.get_contact_by_username(wxid)
+        if contact_info_list is None:  # 群聊中已退群的联系人不会保存在数据库里
+            return ContactDefault(wxid)
+        contact_info = {
+            'UserName': contact_info_list[0],
+            'Alias': contact_info_list[1],
+            'Type': contact_info_list[2],
+            'Remark': contact_info_list[3],
+            'NickName': contact_info_list[4],
+            'smallHeadImgUrl': contact_info_list[7]
+        }
+        contact = Contact(contact_info)
+        contact.smallHeadImgBLOG = misc_db.get_avatar_buffer(contact.wxid)
+        contact.set_avatar(contact.smallHeadImgBLOG)
+        return contact
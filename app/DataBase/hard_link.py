@@ -1,15 +1,13 @@
 import binascii
 import os.path
 import sqlite3
-import threading
 import traceback
 import xml.etree.ElementTree as ET
 
+from app.DataBase.pool import ConnectionPool
 from app.log import log, logger
-from app.util.protocbuf.msg_pb2 import MessageBytesExtra
+from app.util.message_extra import get_message_extra, parse_media_md5
 
-image_db_lock = threading.Lock()
-video_db_lock = threading.Lock()
 image_db_path = "./app/Database/Msg/HardLinkImage.db"
 video_db_path = "./app/Database/Msg/HardLinkVideo.db"
 root_path = "FileStorage/MsgAttach/"
@@ -105,29 +103,19 @@ def singleton(cls):
 @singleton
 class HardLink:
     def __init__(self):
-        self.imageDB = None
-        self.videoDB = None
-        self.image_cursor = None
-        self.video_cursor = None
+        self.image_pool: ConnectionPool = None
+        self.video_pool: ConnectionPool = None
         self.open_flag = False
         self.init_database()
 
     def init_database(self):
         if not self.open_flag:
             if os.path.exists(image_db_path):
-                self.imageDB = sqlite3.connect(image_db_path, check_same_thread=False)
-                # '''创建游标'''
-                self.image_cursor = self.imageDB.cursor()
+                self.image_pool = ConnectionPool(image_db_path)
                 self.open_flag = True
-                if image_db_lock.locked():
-                    image_db_lock.release()
             if os.path.exists(video_db_path):
-                self.videoDB = sqlite3.connect(video_db_path, check_same_thread=False)
-                # '''创建游标'''
-                self.video_cursor = self.videoDB.cursor()
+                self.video_pool = ConnectionPool(video_db_path)
                 self.open_flag = True
-                if video_db_lock.locked():
-                    video_db_lock.release()
 
     def get_image_by_md5(self, md5: bytes):
         if not md5:
@@ -141,17 +129,12 @@ class HardLink:
             join HardLinkImageID as HardLinkImageID2 on HardLinkImageAttribute.DirID2 = HardLinkImageID2.DirID
             where MD5 = ?;
             """
-        try:
-            image_db_lock.acquire(True)
-            try:
-                self.image_cursor.execute(sql, [md5])
-            except AttributeError:
-                self.init_database()
-                self.image_cursor.execute(sql, [md5])
-            result = self.image_cursor.fetchone()
-            return result
-        finally:
-            image_db_lock.release()
+        if not self.image_pool:
+            return None
+        with self.image_pool.cursor() as cursor:
+            cursor.execute(sql, [md5])
+            result = cursor.fetchone()
+        return result
 
     def get_video_by_md5(self, md5: bytes):
         if not md5:
@@ -164,71 +147,41 @@ class HardLink:
             join HardLinkVideoID as HardLinkVideoID2 on HardLinkVideoAttribute.DirID2 = HardLinkVideoID2.DirID
             where MD5 = ?;
             """
-        try:
-            video_db_lock.acquire(True)
+        if not self.video_pool:
+            return None
+        with self.video_pool.cursor() as cursor:
             try:
-                self.video_cursor.execute(sql, [md5])
+                cursor.execute(sql, [md5])
             except sqlite3.OperationalError:
                 return None
-            except AttributeError:
-                self.init_database()
-                self.video_cursor.execute(sql, [md5])
-            result = self.video_cursor.fetchone()
-            return result
-        finally:
-            video_db_lock.release()
+            result = cursor.fetchone()
+        return result
 
-    def get_image_original(self, content, bytesExtra) -> str:
-        msg_bytes = MessageBytesExtra()
-        msg_bytes.ParseFromString(bytesExtra)
-        result = ''
-        for tmp in msg_bytes.message2:
-            if tmp.field1 != 4:
-                continue
-            pathh = tmp.field2  # wxid\FileStorage\...
-            pathh = "\\".join(pathh.split("\\")[1:])
-            return pathh
-        md5 = get_md5_from_xml(content)
+    def get_image_path_by_md5(self, md5, dir0) -> str:
         if not md5:
-            pass
-        else:
-            result = self.get_image_by_md5(binascii.unhexlify(md5))
-            if result:
-                dir1 = result[3]
-                dir2 = result[4]
-                data_image = result[2]
-                dir0 = "Image"
-                dat_image = os.path.join(root_path, dir1, dir0, dir2, data_image)
-                result = dat_image
-        return result
+            return ''
+        result = self.get_image_by_md5(binascii.unhexlify(md5))
+        if not result:
+            return ''
+        dir1 = result[3]
+        dir2 = result[4]
+        data_image = result[2]
+        return os.path.join(root_path, dir1, dir0, dir2, data_image)
+
+    def get_image_original(self, content, bytesExtra) -> str:
+        extra = get_message_extra(bytesExtra)
+        if extra.original:
+            return extra.original
+        return self.get_image_path_by_md5(parse_media_md5(content)[0], "Image")
 
     def get_image_thumb(self, content, bytesExtra) -> str:
-        msg_bytes = MessageBytesExtra()
-        msg_bytes.ParseFromString(bytesExtra)
-        result = ''
-        for tmp in msg_bytes.message2:
-            if tmp.field1 != 3:
-                continue
-            pathh = tmp.field2  # wxid\FileStorage\...
-            pathh = "\\".join(pathh.split("\\")[1:])
-            return pathh
-        md5 = get_md5_from_xml(content)
-        if not md5:
-            pass
-        else:
-            result = self.get_image_by_md5(binascii.unhexlify(md5))
-            if result:
-                dir1 = result[3]
-                dir2 = result[4]
-                data_image = result[2]
-                dir0 = "Thumb"
-                dat_image = os.path.join(root_path, dir1, dir0, dir2, data_image)
-                result = dat_image
-        return result
+        extra = get_message_extra(bytesExtra)
+        if extra.thumb:
+            return extra.thumb
+        return self.get_image_path_by_md5(parse_media_md5(content)[0], "Thumb")
 
     def get_image(self, content, bytesExtra, up_dir="", thumb=False) -> str:
-        msg_bytes = MessageBytesExtra()
-        msg_bytes.ParseFromString(bytesExtra)
+        # BytesExtra 和 XML 只解析一次，原图不存在时退回缩略图也直接用解析好的结果
         if thumb:
             result = self.get_image_thumb(content, bytesExtra)
         else:
@@ -238,15 +191,11 @@ class HardLink:
         return result
 
     def get_video(self, content, bytesExtra, thumb=False):
-        msg_bytes = MessageBytesExtra()
-        msg_bytes.ParseFromString(bytesExtra)
-        for tmp in msg_bytes.message2:
-            if tmp.field1 != (3 if thumb else 4):
-                continue
-            pathh = tmp.field2  # wxid\FileStorage\...
-            pathh = "\\".join(pathh.split("\\")[1:])
-            return pathh
-        md5 = get_md5_from_xml(content, type_="video")
+        extra = get_message_extra(bytesExtra)
+        path = extra.thumb if thumb else extra.original
+        if path:
+            return path
+        md5 = parse_media_md5(content)[1]
         if not md5:
             return ''
         result = self.get_video_by_md5(binascii.unhexlify(md5))
@@ -261,15 +210,13 @@ class HardLink:
 
     def close(self):
         if self.open_flag:
-            try:
-                image_db_lock.acquire(True)
-                video_db_lock.acquire(True)
-                self.open_flag = False
-                self.imageDB.close()
-                self.videoDB.close()
-            finally:
-                image_db_lock.release()
-                video_db_lock.release()
+            self.open_flag = False
+            if self.image_pool:
+                self.image_pool.close()
+                self.image_pool = None
+            if self.video_pool:
+                self.video_pool.close()
+                self.video_pool = None
 
     def __del__(self):
         self.close()
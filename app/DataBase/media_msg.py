@@ -1,29 +1,13 @@
 import os.path
-import subprocess
-import sys
-import traceback
-from os import system
-import sqlite3
-import threading
 import xml.etree.ElementTree as ET
-from pilk import decode
 
+from app.DataBase.pool import ConnectionPool
 from app.log import logger
+from app.util.voice import transcode, transcode_all
 
-lock = threading.Lock()
 db_path = "./app/Database/Msg/MediaMSG.db"
 
 
-def get_ffmpeg_path():
-    # 获取打包后的资源目录
-    resource_dir = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
-
-    # 构建 FFmpeg 可执行文件的路径
-    ffmpeg_path = os.path.join(resource_dir, 'app', 'resources','data', 'ffmpeg.exe')
-
-    return ffmpeg_path
-
-
 def singleton(cls):
     _instance = {}
 
@@ -38,20 +22,15 @@ def singleton(cls):
 @singleton
 class MediaMsg:
     def __init__(self):
-        self.DB = None
-        self.cursor: sqlite3.Cursor = None
+        self.pool: ConnectionPool = None
         self.open_flag = False
         self.init_database()
 
     def init_database(self):
         if not self.open_flag:
             if os.path.exists(db_path):
-                self.DB = sqlite3.connect(db_path, check_same_thread=False)
-                # '''创建游标'''
-                self.cursor = self.DB.cursor()
+                self.pool = ConnectionPool(db_path)
                 self.open_flag = True
-                if lock.locked():
-                    lock.release()
 
     def get_media_buffer(self, reserved0):
         sql = '''
@@ -59,58 +38,40 @@ class MediaMsg:
             from Media
             where Reserved0 = ?
         '''
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [reserved0])
-            result = self.cursor.fetchone()
-
-        finally:
-            lock.release()
+        if not self.open_flag:
+            return None
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [reserved0])
+            result = cursor.fetchone()
         return result[0] if result else None
 
     def get_audio(self, reserved0, output_path):
-        buf = self.get_media_buffer(reserved0)
-        if not buf:
-            return ''
-        silk_path = f"{output_path}/{reserved0}.silk"
-        pcm_path = f"{output_path}/{reserved0}.pcm"
         mp3_path = f"{output_path}/{reserved0}.mp3"
         if os.path.exists(mp3_path):
             return mp3_path
-        with open(silk_path, "wb") as f:
-            f.write(buf)
-        # open(silk_path, "wb").write()
+        buf = self.get_media_buffer(reserved0)
+        if not buf:
+            return ''
         try:
-            decode(silk_path, pcm_path, 44100)
-            # 调用系统上的 ffmpeg 可执行文件
-            # 获取 FFmpeg 可执行文件的路径
-            ffmpeg_path = get_ffmpeg_path()
-            # # 调用 FFmpeg
-            if os.path.exists(ffmpeg_path):
-                cmd = f'''"{ffmpeg_path}" -loglevel quiet -y -f s16le -i "{pcm_path}" -ar 44100 -ac 1 "{mp3_path}"'''
-                # system(cmd)
-                # 使用subprocess.run()执行命令
-                subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            else:
-                # 源码运行的时候下面的有效
-                # 这里不知道怎么捕捉异常
-                cmd = f'''"{os.path.join(os.getcwd(), 'app', 'resources', 'data','ffmpeg.exe')}" -loglevel quiet -y -f s16le -i "{pcm_path}" -ar 44100 -ac 1 "{mp3_path}"'''
-                # system(cmd)
-                # 使用subprocess.run()执行命令
-                subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            os.remove(silk_path)
-            os.remove(pcm_path)
+            transcode(buf, mp3_path)
         except Exception as e:
             print(f"Error: {e}")
-            logger.error(f'语音发送错误\n{traceback.format_exc()}')
-            cmd = f'''"{os.path.join(os.getcwd(), 'app', 'resources', 'data', 'ffmpeg.exe')}" -loglevel quiet -y -f s16le -i "{pcm_path}" -ar 44100 -ac 1 "{mp3_path}"'''
-            # system(cmd)
-            # 使用subprocess.run()执行命令
-            subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        finally:
-            print(mp3_path)
+            logger.error(f'语音转换错误: {e}')
+            return ''
         return mp3_path
 
+    def export_audios(self, reserved0s, output_path, max_workers=None, callback=None, is_cancelled=None):
+        """
+        批量导出语音，解码和编码在进程池里并行执行，之前导出过的直接跳过
+        @param reserved0s: 语音消息的 MsgSvrID
+        @param output_path: 输出目录
+        @param max_workers: 进程数，默认 CPU 核数
+        @param callback: 每处理完一条调用 callback(reserved0, mp3_path)
+        @param is_cancelled: 比如 QThread.isInterruptionRequested，返回 True 时停止导出
+        @return: TranscodeStats 吞吐量统计
+        """
+        return transcode_all(reserved0s, output_path, self.get_media_buffer, max_workers, callback, is_cancelled)
+
     def get_audio_path(self, reserved0, output_path):
         mp3_path = f"{output_path}\\{reserved0}.mp3"
         mp3_path = mp3_path.replace("/", "\\")
@@ -126,12 +87,8 @@ class MediaMsg:
 
     def close(self):
         if self.open_flag:
-            try:
-                lock.acquire(True)
-                self.open_flag = False
-                self.DB.close()
-            finally:
-                lock.release()
+            self.open_flag = False
+            self.pool.close()
 
     def __del__(self):
         self.close()
@@ -1,93 +1,151 @@
 import os
+import shutil
 import sqlite3
 import traceback
 
 from app.log import logger
 
+MSG_COLUMNS = 'TalkerId,MsgsvrID,Type,SubType,IsSender,CreateTime,Sequence,StrTalker,StrContent,DisplayContent,' \
+              'BytesExtra,CompressContent'
+MEDIA_COLUMNS = 'Key,Reserved0,Buf,Reserved1,Reserved2'
 
-def merge_MediaMSG_databases(source_paths, target_path):
-    # 创建目标数据库连接
-    target_conn = sqlite3.connect(target_path)
-    target_cursor = target_conn.cursor()
-    try:
-        # 开始事务
-        target_conn.execute("BEGIN;")
-        for i, source_path in enumerate(source_paths):
-            if not os.path.exists(source_path):
-                continue
-            db = sqlite3.connect(source_path)
-            db.text_factory = str
-            cursor = db.cursor()
-            # 附加源数据库
-            try:
-                sql = '''SELECT Key,Reserved0,Buf,Reserved1,Reserved2 FROM Media;'''
-                cursor.execute(sql)
-                result = cursor.fetchall()
-                target_cursor.executemany(
-                    "INSERT INTO Media (Key,Reserved0,Buf,Reserved1,Reserved2)"
-                    "VALUES(?,?,?,?,?)",
-                    result)
-            except sqlite3.IntegrityError:
-                print("有重复key", "跳过")
-            except sqlite3.OperationalError:
-                print("no such table: Media", "跳过")
-            cursor.close()
-            db.close()
-        # 提交事务
-        target_conn.execute("COMMIT;")
-
-    except Exception as e:
-        # 发生异常时回滚事务
-        target_conn.execute("ROLLBACK;")
-        raise e
+# 每个分片已经合并到的 rowid（高水位）以及分片第一行的主键，用来识别分片是否被替换（比如换了账号）
+STATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS MergeState(
+        Source TEXT PRIMARY KEY,
+        HighWater INTEGER,
+        FirstKey TEXT
+    );
+'''
 
+
+def shard_state(conn, schema, table, key):
+    """
+    :return: (分片当前最大 rowid, 分片第一行的主键)
+    """
+    high_water = conn.execute(f'SELECT max(rowid) FROM {schema}.{table};').fetchone()[0] or 0
+    row = conn.execute(f'SELECT {key} FROM {schema}.{table} ORDER BY rowid LIMIT 1;').fetchone()
+    return high_water, str(row[0]) if row else ''
+
+
+def prepare_target(target_path, template_path, table, key):
+    """
+    目标数据库不存在、不是增量合并生成的或者模板分片被替换时，用模板重新生成目标数据库，
+    模板里已有的行记为已合并
+    """
+    source = os.path.basename(template_path)
+    if os.path.exists(target_path):
+        first_key = None
+        try:
+            conn = sqlite3.connect(target_path)
+            try:
+                row = conn.execute('SELECT FirstKey FROM MergeState WHERE Source=?;', (source,)).fetchone()
+                first_key = row[0] if row else None
+            finally:
+                conn.close()
+        except sqlite3.DatabaseError:
+            pass
+        template = sqlite3.connect(template_path)
+        try:
+            _, template_key = shard_state(template, 'main', table, key)
+        finally:
+            template.close()
+        if first_key is not None and first_key == template_key:
+            return
+        os.remove(target_path)
+    shutil.copy2(template_path, target_path)  # 使用一个数据库文件作为模板
+    conn = sqlite3.connect(target_path)
+    try:
+        conn.execute(STATE_SQL)
+        high_water, first_key = shard_state(conn, 'main', table, key)
+        conn.execute('INSERT OR REPLACE INTO MergeState (Source,HighWater,FirstKey) VALUES(?,?,?);',
+                     (source, high_water, first_key))
+        conn.commit()
     finally:
-        # 关闭目标数据库连接
-        target_conn.close()
+        conn.close()
 
 
-def merge_databases(source_paths, target_path):
-    # 创建目标数据库连接
+def merge_shards(source_paths, target_path, table, columns, key):
+    """
+    把各个分片的 table 增量合并到目标数据库
+    分片通过 ATTACH DATABASE 挂到目标库上，由 SQLite 直接 INSERT ... SELECT，内存占用和数据量无关；
+    每个分片只复制 rowid 大于上次高水位的行，并按 key 去重，重复合并不会产生重复数据
+    :param source_paths: 分片数据库路径
+    :param target_path: 目标数据库路径
+    :param table: 表名
+    :param columns: 需要复制的列
+    :param key: 去重用的列，值为 0 的行（比如本地消息的 MsgSvrID）只按高水位判断
+    :return: 新合并的行数
+    """
     target_conn = sqlite3.connect(target_path)
-    target_cursor = target_conn.cursor()
+    merged_num = 0
     try:
-        # 开始事务
-        target_conn.execute("BEGIN;")
-        for i, source_path in enumerate(source_paths):
+        target_conn.execute(STATE_SQL)
+        target_conn.execute(f'CREATE INDEX IF NOT EXISTS {table}_{key}_MERGE ON {table}({key});')
+        target_conn.commit()
+        for source_path in source_paths:
             if not os.path.exists(source_path):
                 continue
-            db = sqlite3.connect(source_path)
-            db.text_factory = str
-            cursor = db.cursor()
+            source = os.path.basename(source_path)
+            target_conn.execute('ATTACH DATABASE ? AS source;', (source_path,))
             try:
-                sql = '''
-                    SELECT TalkerId,MsgsvrID,Type,SubType,IsSender,CreateTime,Sequence,StrTalker,StrContent,DisplayContent,BytesExtra,CompressContent
-                    FROM MSG;
-                '''
-                cursor.execute(sql)
-                result = cursor.fetchall()
-                # 附加源数据库
-                target_cursor.executemany(
-                    "INSERT INTO MSG "
-                    "(TalkerId,MsgsvrID,Type,SubType,IsSender,CreateTime,Sequence,StrTalker,StrContent,DisplayContent,"
-                    "BytesExtra,CompressContent)"
-                    "VALUES(?,?,?,?,?,?,?,?,?,?,?,?)",
-                    result)
-            except:
+                with target_conn:
+                    row = target_conn.execute('SELECT HighWater,FirstKey FROM MergeState WHERE Source=?;',
+                                              (source,)).fetchone()
+                    high_water, first_key = shard_state(target_conn, 'source', table, key)
+                    last_high_water = 0
+                    if row and row[1] == first_key and row[0] <= high_water:
+                        last_high_water = row[0]
+                    cursor = target_conn.execute(
+                        f'''
+                        INSERT INTO main.{table} ({columns})
+                        SELECT {columns} FROM source.{table} AS s
+                        WHERE s.rowid > ? AND (
+                            s.{key} = 0 OR
+                            NOT EXISTS (SELECT 1 FROM main.{table} AS t WHERE t.{key} = s.{key})
+                        );
+                        ''',
+                        (last_high_water,)
+                    )
+                    merged_num += max(cursor.rowcount, 0)
+                    target_conn.execute('INSERT OR REPLACE INTO MergeState (Source,HighWater,FirstKey) VALUES(?,?,?);',
+                                        (source, high_water, first_key))
+            except sqlite3.DatabaseError:
                 logger.error(f'{source_path}数据库合并错误:\n{traceback.format_exc()}')
-            cursor.close()
-            db.close()
-        # 提交事务
-        target_conn.execute("COMMIT;")
-
-    except Exception as e:
-        # 发生异常时回滚事务
-        target_conn.execute("ROLLBACK;")
-        raise e
-
+            finally:
+                target_conn.execute('DETACH DATABASE source;')
     finally:
         # 关闭目标数据库连接
         target_conn.close()
+    return merged_num
+
+
+def merge_MediaMSG_databases(source_paths, target_path, template_path=None):
+    """
+    增量合并语音数据库，按 Key 去重
+    :param source_paths: MediaMSG1.db ... 的路径
+    :param target_path: 合并后的 MediaMSG.db
+    :param template_path: 模板数据库（MediaMSG0.db），目标库需要重建时复制它，之后也作为一个分片合并
+    :return: 新合并的行数
+    """
+    if template_path:
+        prepare_target(target_path, template_path, 'Media', 'Key')
+        source_paths = [template_path] + list(source_paths)
+    return merge_shards(source_paths, target_path, 'Media', MEDIA_COLUMNS, 'Key')
+
+
+def merge_databases(source_paths, target_path, template_path=None):
+    """
+    增量合并聊天记录数据库，按 MsgSvrID 去重
+    :param source_paths: MSG1.db ... 的路径
+    :param target_path: 合并后的 MSG.db
+    :param template_path: 模板数据库（MSG0.db），目标库需要重建时复制它，之后也作为一个分片合并
+    :return: 新合并的行数
+    """
+    if template_path:
+        prepare_target(target_path, template_path, 'MSG', 'MsgSvrID')
+        source_paths = [template_path] + list(source_paths)
+    return merge_shards(source_paths, target_path, 'MSG', MSG_COLUMNS, 'MsgSvrID')
 
 
 if __name__ == "__main__":
@@ -96,8 +154,5 @@ if __name__ == "__main__":
 
     # 目标数据库文件
     target_database = "Msg/MSG.db"
-    import shutil
-
-    shutil.copy('Msg/MSG0.db', target_database)  # 使用一个数据库文件作为模板
-    # 合并数据库
-    merge_databases(source_databases, target_database)
+    # 合并数据库，再次运行只会合并新增的消息
+    merge_databases(source_databases, target_database, template_path='Msg/MSG0.db')
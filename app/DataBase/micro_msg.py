@@ -2,7 +2,8 @@ import os.path
 import sqlite3
 import threading
 
-lock = threading.Lock()
+from app.DataBase.pool import ConnectionPool
+
 db_path = "./app/Database/Msg/MicroMsg.db"
 
 
@@ -23,114 +24,141 @@ def is_database_exist():
 
 class MicroMsg:
     def __init__(self):
-        self.DB = None
-        self.cursor = None
+        self.pool: ConnectionPool = None
         self.open_flag = False
+        self.contact_index = None
+        self.index_lock = threading.Lock()
         self.init_database()
 
     def init_database(self):
         if not self.open_flag:
             if os.path.exists(db_path):
-                self.DB = sqlite3.connect(db_path, check_same_thread=False)
-                # '''创建游标'''
-                self.cursor = self.DB.cursor()
+                self.pool = ConnectionPool(db_path)
                 self.open_flag = True
-                if lock.locked():
-                    lock.release()
 
     def get_contact(self):
         if not self.open_flag:
             return []
-        try:
-            lock.acquire(True)
-            sql = '''SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,COALESCE(ContactLabel.LabelName, 'None') AS labelName
-                    FROM Contact
-                    INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
-                    LEFT JOIN ContactLabel ON Contact.LabelIDList = ContactLabel.LabelId
-                    WHERE (Type!=4 AND VerifyFlag=0)
-                        AND NickName != ''
-                    ORDER BY 
-                        CASE
-                            WHEN RemarkPYInitial = '' THEN PYInitial
-                            ELSE RemarkPYInitial
-                        END ASC
-                  '''
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
-        except sqlite3.OperationalError:
-            # lock.acquire(True)
-            sql = '''
-                   SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,"None"
-                   FROM Contact
-                   INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
-                   WHERE (Type!=4 AND VerifyFlag=0)
-                        AND NickName != ''
-                    ORDER BY 
-                        CASE
-                            WHEN RemarkPYInitial = '' THEN PYInitial
-                            ELSE RemarkPYInitial
-                        END ASC
-            '''
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            try:
+                sql = '''SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,COALESCE(ContactLabel.LabelName, 'None') AS labelName
+                        FROM Contact
+                        INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                        LEFT JOIN ContactLabel ON Contact.LabelIDList = ContactLabel.LabelId
+                        WHERE (Type!=4 AND VerifyFlag=0)
+                            AND NickName != ''
+                        ORDER BY 
+                            CASE
+                                WHEN RemarkPYInitial = '' THEN PYInitial
+                                ELSE RemarkPYInitial
+                            END ASC
+                      '''
+                cursor.execute(sql)
+                result = cursor.fetchall()
+            except sqlite3.OperationalError:
+                sql = '''
+                       SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,"None"
+                       FROM Contact
+                       INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                       WHERE (Type!=4 AND VerifyFlag=0)
+                            AND NickName != ''
+                        ORDER BY 
+                            CASE
+                                WHEN RemarkPYInitial = '' THEN PYInitial
+                                ELSE RemarkPYInitial
+                            END ASC
+                '''
+                cursor.execute(sql)
+                result = cursor.fetchall()
         from app.DataBase import msg_db
         return msg_db.get_contact(result)
 
     def get_contact_by_username(self, username):
         if not self.open_flag:
             return None
-        try:
-            lock.acquire(True)
-            sql = '''
-                   SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,ContactLabel.LabelName
-                   FROM Contact
-                   INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
-                   LEFT JOIN ContactLabel ON Contact.LabelIDList = ContactLabel.LabelId
-                   WHERE UserName = ?
+        with self.pool.cursor() as cursor:
+            try:
+                sql = '''
+                       SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,ContactLabel.LabelName
+                       FROM Contact
+                       INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                       LEFT JOIN ContactLabel ON Contact.LabelIDList = ContactLabel.LabelId
+                       WHERE UserName = ?
+                    '''
+                cursor.execute(sql, [username])
+                result = cursor.fetchone()
+            except sqlite3.OperationalError:
+                # 解决ContactLabel表不存在的问题
+                sql = '''
+                       SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,"None"
+                       FROM Contact
+                       INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                       WHERE UserName = ?
                 '''
-            self.cursor.execute(sql, [username])
-            result = self.cursor.fetchone()
-        except sqlite3.OperationalError:
-            # 解决ContactLabel表不存在的问题
-            # lock.acquire(True)
-            sql = '''
-                   SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,"None"
-                   FROM Contact
-                   INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
-                   WHERE UserName = ?
-            '''
-            self.cursor.execute(sql, [username])
-            result = self.cursor.fetchone()
-        finally:
-            lock.release()
+                cursor.execute(sql, [username])
+                result = cursor.fetchone()
 
         return result
 
+    def get_contact_index(self) -> dict:
+        """
+        一次性读取 Contact、ContactHeadImgUrl、ContactLabel，建立 UserName -> 联系人 的内存索引
+        字段与 get_contact_by_username 的返回值一致，结果会缓存到数据库关闭为止
+        @return: dict {UserName: row}
+        """
+        if not self.open_flag:
+            return {}
+        with self.index_lock:
+            if self.contact_index is not None:
+                return self.contact_index
+            with self.pool.cursor() as cursor:
+                try:
+                    sql = '''
+                           SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,ContactLabel.LabelName
+                           FROM Contact
+                           INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                           LEFT JOIN ContactLabel ON Contact.LabelIDList = ContactLabel.LabelId
+                        '''
+                    cursor.execute(sql)
+                    result = cursor.fetchall()
+                except sqlite3.OperationalError:
+                    # 解决ContactLabel表不存在的问题
+                    sql = '''
+                           SELECT UserName, Alias, Type, Remark, NickName, PYInitial, RemarkPYInitial, ContactHeadImgUrl.smallHeadImgUrl, ContactHeadImgUrl.bigHeadImgUrl,ExTraBuf,"None"
+                           FROM Contact
+                           INNER JOIN ContactHeadImgUrl ON Contact.UserName = ContactHeadImgUrl.usrName
+                    '''
+                    cursor.execute(sql)
+                    result = cursor.fetchall()
+            self.contact_index = {row[0]: row for row in result}
+            return self.contact_index
+
+    def resolve_contacts(self, usernames) -> dict:
+        """
+        批量解析联系人，只做字典查找
+        @param usernames: 可迭代的 UserName
+        @return: dict {UserName: row}，数据库里没有的 UserName 不在结果里
+        """
+        index = self.get_contact_index()
+        return {username: index[username] for username in set(usernames) if username in index}
+
     def get_chatroom_info(self, chatroomname):
         '''
         获取群聊信息
         '''
         if not self.open_flag:
             return None
-        try:
-            lock.acquire(True)
+        with self.pool.cursor() as cursor:
             sql = '''SELECT ChatRoomName, RoomData FROM ChatRoom WHERE ChatRoomName = ?'''
-            self.cursor.execute(sql, [chatroomname])
-            result = self.cursor.fetchone()
-        finally:
-            lock.release()
+            cursor.execute(sql, [chatroomname])
+            result = cursor.fetchone()
         return result
 
     def close(self):
         if self.open_flag:
-            try:
-                lock.acquire(True)
-                self.open_flag = False
-                self.DB.close()
-            finally:
-                lock.release()
+            self.open_flag = False
+            self.contact_index = None
+            self.pool.close()
 
     def __del__(self):
         self.close()
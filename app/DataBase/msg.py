@@ -1,18 +1,16 @@
 import os.path
 import random
 import sqlite3
-import threading
 import traceback
 from collections import defaultdict
 from datetime import datetime, date
 from typing import Tuple
 
+from app.DataBase.pool import ConnectionPool
 from app.log import logger
-from app.util.compress_content import parser_reply
-from app.util.protocbuf.msg_pb2 import MessageBytesExtra
+from app.util.message_extra import get_message_extra
 
 db_path = "./app/Database/Msg/MSG.db"
-lock = threading.Lock()
 
 
 def is_database_exist():
@@ -54,9 +52,8 @@ def convert_to_timestamp(time_range) -> Tuple[int, int]:
 
 
 def parser_chatroom_message(messages):
-    from app.DataBase import micro_msg_db, misc_db
-    from app.util.protocbuf.msg_pb2 import MessageBytesExtra
-    from app.person import Contact, Me, ContactDefault
+    from app.DataBase import contact_cache
+    from app.person import Me, ContactDefault
     '''
     获取一个群聊的聊天记录
     return list
@@ -86,13 +83,8 @@ def parser_chatroom_message(messages):
             message.append(ContactDefault(wxid))
             updated_messages.append(tuple(message))
             continue
-        msgbytes = MessageBytesExtra()
-        msgbytes.ParseFromString(message[10])
-        wxid = ''
-        for tmp in msgbytes.message2:
-            if tmp.field1 != 1:
-                continue
-            wxid = tmp.field2
+        # 解析结果会被缓存，之后导出图片、视频时不再重复解析
+        wxid = get_message_extra(message[10]).sender
         if wxid == "":  # 系统消息里面 wxid 不存在
             message.append(ContactDefault(wxid))
             updated_messages.append(tuple(message))
@@ -100,23 +92,7 @@ def parser_chatroom_message(messages):
         # todo 解析还是有问题，会出现这种带:的东西
         if ':' in wxid:  # wxid_ewi8gfgpp0eu22:25319:1
             wxid = wxid.split(':')[0]
-        contact_info_list = micro_msg_db.get_contact_by_username(wxid)
-        if contact_info_list is None:  # 群聊中已退群的联系人不会保存在数据库里
-            message.append(ContactDefault(wxid))
-            updated_messages.append(tuple(message))
-            continue
-        contact_info = {
-            'UserName': contact_info_list[0],
-            'Alias': contact_info_list[1],
-            'Type': contact_info_list[2],
-            'Remark': contact_info_list[3],
-            'NickName': contact_info_list[4],
-            'smallHeadImgUrl': contact_info_list[7]
-        }
-        contact = Contact(contact_info)
-        contact.smallHeadImgBLOG = misc_db.get_avatar_buffer(contact.wxid)
-        contact.set_avatar(contact.smallHeadImgBLOG)
-        message.append(contact)
+        message.append(contact_cache.get(wxid))
         updated_messages.append(tuple(message))
     return updated_messages
 
@@ -140,8 +116,7 @@ class MsgType:
 
 class Msg:
     def __init__(self):
-        self.DB = None
-        self.cursor = None
+        self.pool: ConnectionPool = None
         self.open_flag = False
         self.init_database()
 
@@ -151,12 +126,9 @@ class Msg:
             if path:
                 db_path = path
             if os.path.exists(db_path):
-                self.DB = sqlite3.connect(db_path, check_same_thread=False)
-                # '''创建游标'''
-                self.cursor = self.DB.cursor()
+                # 只读连接，索引在解密合并数据库时建立
+                self.pool = ConnectionPool(db_path)
                 self.open_flag = True
-                if lock.locked():
-                    lock.release()
 
     def add_sender(self, messages):
         """
@@ -170,12 +142,7 @@ class Msg:
             if is_sender:
                 pass
             else:
-                msgbytes = MessageBytesExtra()
-                msgbytes.ParseFromString(message[10])
-                for tmp in msgbytes.message2:
-                    if tmp.field1 != 1:
-                        continue
-                    wxid = tmp.field2
+                wxid = get_message_extra(message[10]).sender
             new_message = (*message, wxid)
             new_messages.append(new_message)
         return new_messages
@@ -213,12 +180,9 @@ class Msg:
             {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
             order by CreateTime
         '''
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_])
+            result = cursor.fetchall()
         return parser_chatroom_message(result) if username_.__contains__('@chatroom') else result
         # result.sort(key=lambda x: x[5])
         # return self.add_sender(result)
@@ -234,15 +198,109 @@ class Msg:
         '''
         if not self.open_flag:
             return None
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql)
+            result = cursor.fetchall()
         result.sort(key=lambda x: x[5])
         return result
 
+    def fetch_batches(self, sql, params=(), batch_size=1000):
+        """
+        用 fetchmany 分批读取查询结果，每次产出一个列表
+        遍历期间当前线程独占一个连接，遍历结束或生成器被关闭时归还
+        @param sql:
+        @param params:
+        @param batch_size: 每批的行数
+        @return: 生成器
+        """
+        if not self.open_flag:
+            return
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+
+    def iter_message_batches(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+    ):
+        """
+        get_messages 的流式版本，按 batch_size 分批产出消息，字段与 get_messages 一致
+        群聊按批解析发送人，内存占用不随聊天记录长度增长
+        """
+        if time_range:
+            start_time, end_time = convert_to_timestamp(time_range)
+        sql = f'''
+            select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+            from MSG
+            where StrTalker=?
+            {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
+            order by CreateTime
+        '''
+        is_chatroom = username_.__contains__('@chatroom')
+        for rows in self.fetch_batches(sql, [username_], batch_size):
+            yield parser_chatroom_message(rows) if is_chatroom else rows
+
+    def iter_messages(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+    ):
+        """
+        逐条产出消息，字段与 get_messages 一致
+        """
+        for rows in self.iter_message_batches(username_, time_range, batch_size):
+            yield from rows
+
+    def iter_messages_all_batches(self, time_range=None, batch_size=1000):
+        """
+        get_messages_all 的流式版本，按 batch_size 分批产出全部联系人的消息
+        """
+        if time_range:
+            start_time, end_time = convert_to_timestamp(time_range)
+        sql = f'''
+            select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,StrTalker,Reserved1,CompressContent
+            from MSG
+            {'WHERE CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
+            order by CreateTime
+        '''
+        yield from self.fetch_batches(sql, (), batch_size)
+
+    def iter_messages_all(self, time_range=None, batch_size=1000):
+        """
+        逐条产出全部联系人的消息，字段与 get_messages_all 一致
+        """
+        for rows in self.iter_messages_all_batches(time_range, batch_size):
+            yield from rows
+
+    def iter_messages_by_type(
+            self,
+            username_,
+            type_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            batch_size=1000,
+    ):
+        """
+        get_messages_by_type 的流式版本，逐条产出某一类型的消息
+        """
+        if time_range:
+            start_time, end_time = convert_to_timestamp(time_range)
+        sql = f'''
+            select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+            from MSG
+            where StrTalker=? and Type=?
+            {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
+            order by CreateTime
+        '''
+        for rows in self.fetch_batches(sql, [username_, type_], batch_size):
+            yield from rows
+
     def get_messages_group_by_day(
             self,
             username_: str,
@@ -265,12 +323,9 @@ class Msg:
             {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
             order by CreateTime;
         '''
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_])
+            result = cursor.fetchall()
         result = parser_chatroom_message(result) if username_.__contains__('@chatroom') else result
 
         # 按天分组存储聊天记录
@@ -291,13 +346,11 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchone()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql)
+                result = cursor.fetchone()
         except Exception as e:
             result = None
-        finally:
-            lock.release()
         return result[0]
 
     def get_message_by_num(self, username_, local_id):
@@ -312,16 +365,49 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_, local_id])
-            result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_, local_id])
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         # result.sort(key=lambda x: x[5])
         return parser_chatroom_message(result) if username_.__contains__('@chatroom') else result
 
+    def get_messages_before(self, username_, cursor_key=None, page_size=20, types=(1, 3)):
+        """
+        键集分页，读取 (CreateTime, localId) 小于 cursor_key 的 page_size 条消息，按时间倒序
+        合并后的数据库里 localId 和 CreateTime 的顺序不一致，只用 localId 翻页会漏消息或重复
+        @param username_:
+        @param cursor_key: 上一页最后一条消息的 (CreateTime, localId)，None 表示从最新的消息开始
+        @param page_size: 每页条数
+        @param types: 消息类型
+        @return: 字段与 get_messages 一致
+        """
+        sql = f'''
+            select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
+            from MSG
+            where StrTalker = ? and Type in ({','.join(str(int(type_)) for type_ in types)})
+            {'and (CreateTime < ? or (CreateTime = ? and localId < ?))' if cursor_key else ''}
+            order by CreateTime desc, localId desc
+            limit ?
+        '''
+        params = [username_]
+        if cursor_key:
+            create_time, local_id = cursor_key
+            params += [create_time, create_time, local_id]
+        params.append(page_size)
+        result = None
+        if not self.open_flag:
+            return None
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params)
+                result = cursor.fetchall()
+        except sqlite3.DatabaseError:
+            logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
+            return []
+        return parser_chatroom_message(result) if username_.__contains__('@chatroom') else result
+
     def get_messages_by_type(
             self,
             username_,
@@ -348,12 +434,9 @@ class Msg:
                         {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
                         order by CreateTime
                     '''
-            try:
-                lock.acquire(True)
-                self.cursor.execute(sql, [username_, type_])
-                result = self.cursor.fetchall()
-            finally:
-                lock.release()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_, type_])
+                result = cursor.fetchall()
         else:
             sql = '''
                 select localId,TalkerId,Type,SubType,IsSender,CreateTime,Status,StrContent,strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,MsgSvrID,BytesExtra,CompressContent,DisplayContent
@@ -361,12 +444,9 @@ class Msg:
                 where StrTalker=? and Type=? and strftime('%Y', CreateTime, 'unixepoch', 'localtime') = ?
                 order by CreateTime
              '''
-            try:
-                lock.acquire(True)
-                self.cursor.execute(sql, [username_, type_, year_])
-            finally:
-                lock.release()
-                result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_, type_, year_])
+                result = cursor.fetchall()
         return result
 
     def get_messages_by_keyword(self, username_, keyword, num=5, max_len=10, time_range=None, year_='all'):
@@ -382,18 +462,14 @@ class Msg:
             order by CreateTime desc
         '''
         temp = []
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_, max_len, f'%{keyword}%'] if year_ == "all" else [username_, max_len,
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_, max_len, f'%{keyword}%'] if year_ == "all" else [username_, max_len,
                                                                                                   f'%{keyword}%',
                                                                                                   year_])
-            messages = self.cursor.fetchall()
-        finally:
-            lock.release()
+            messages = cursor.fetchall()
         if len(messages) > 5:
             messages = random.sample(messages, num)
-        try:
-            lock.acquire(True)
+        with self.pool.cursor() as cursor:
             for msg in messages:
                 local_id = msg[0]
                 is_send = msg[4]
@@ -403,10 +479,8 @@ class Msg:
                     where localId > ? and StrTalker=? and Type=1 and IsSender=?
                     limit 1
                 '''
-                self.cursor.execute(sql, [local_id, username_, 1 - is_send])
-                temp.append((msg, self.cursor.fetchone()))
-        finally:
-            lock.release()
+                cursor.execute(sql, [local_id, username_, 1 - is_send])
+                temp.append((msg, cursor.fetchone()))
         res = []
         for dialog in temp:
             msg1 = dialog[0]
@@ -431,14 +505,17 @@ class Msg:
     def get_contact(self, contacts):
         if not self.open_flag:
             return None
-        try:
-            lock.acquire(True)
-            sql = '''select StrTalker, MAX(CreateTime) from MSG group by StrTalker'''
-            self.cursor.execute(sql)
-            res = self.cursor.fetchall()
-        finally:
-            lock.release()
-        res = {StrTalker: CreateTime for StrTalker, CreateTime in res}
+        from app.DataBase import msg_stats_db
+        # 只打开已有的统计库，不在这里聚合；统计库是最新的才读它维护的每个会话的最后时间，不用再对整个 MSG 表 group by
+        msg_stats_db.init_database()
+        if msg_stats_db.stats_ready:
+            res = msg_stats_db.get_last_activity()
+        else:
+            with self.pool.cursor() as cursor:
+                sql = '''select StrTalker, MAX(CreateTime) from MSG group by StrTalker'''
+                cursor.execute(sql)
+                res = cursor.fetchall()
+            res = {StrTalker: CreateTime for StrTalker, CreateTime in res}
         contacts = [list(cur_contact) for cur_contact in contacts]
         for i, cur_contact in enumerate(contacts):
             if cur_contact[0] in res:
@@ -462,12 +539,9 @@ class Msg:
         if not self.open_flag:
             print('数据库未就绪')
             return None
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_])
+            result = cursor.fetchall()
         return [date[0] for date in result]
 
     def get_messages_by_days(
@@ -493,12 +567,9 @@ class Msg:
         result = None
         if not self.open_flag:
             return None
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchall()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_])
+            result = cursor.fetchall()
         return result
 
     def get_messages_by_month(
@@ -522,13 +593,11 @@ class Msg:
             group by days
         '''
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_])
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result
 
     def get_messages_by_hour(self, username_, time_range=None, year_='all'):
@@ -548,13 +617,11 @@ class Msg:
             group by hours
         '''
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_])
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
-            result = self.cursor.fetchall()
         return result
 
     def get_first_time_of_message(self, username_=''):
@@ -567,12 +634,9 @@ class Msg:
             order by CreateTime
             limit 1
         '''
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_] if username_ else [])
-            result = self.cursor.fetchone()
-        finally:
-            lock.release()
+        with self.pool.cursor() as cursor:
+            cursor.execute(sql, [username_] if username_ else [])
+            result = cursor.fetchone()
         return result
 
     def get_latest_time_of_message(self, username_='', time_range=None, year_='all'):
@@ -591,14 +655,13 @@ class Msg:
                 ORDER BY hour DESC
                 LIMIT 20;
             '''
+        result = []
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_, year_] if year_ != "all" else [username_])
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_, year_] if year_ != "all" else [username_])
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
-            result = self.cursor.fetchall()
         if not result:
             return []
         res = []
@@ -633,24 +696,24 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql)
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result
 
     def get_messages_number(
             self,
             username_,
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            type_=None,
     ) -> int:
         """
         统计好友聊天消息的数量
         @param username_:
         @param time_range:
+        @param type_: 只统计某一类型的消息，None 表示全部
         @return:
         """
         if time_range:
@@ -659,19 +722,18 @@ class Msg:
             SELECT Count(MsgSvrID)
             from MSG
             where StrTalker = ?
+            {'AND Type=' + str(int(type_)) if type_ is not None else ''}
             {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
         """
         result = 0
         if not self.open_flag:
             return 0
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql, [username_])
-            result = self.cursor.fetchone()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, [username_])
+                result = cursor.fetchone()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result[0] if result else 0
 
     def get_chatted_top_contacts(
@@ -700,13 +762,11 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql)
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result
 
     def get_send_messages_length(
@@ -715,44 +775,10 @@ class Msg:
     ) -> int:
         """
         统计自己总共发消息的字数，包含type=1的文本和type=49,subtype=57里面自己发的文本
+        引用消息的字数在合并数据库时已经存进统计表，不再逐条解压（时间范围按天计算）
         """
-        if time_range:
-            start_time, end_time = convert_to_timestamp(time_range)
-        sql_type_1 = f"""
-            SELECT sum(length(strContent))
-            from MSG
-            where isSender = 1 and type = 1
-            {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
-        """
-        sql_type_49 = f"""
-            SELECT CompressContent
-            from MSG
-            where isSender = 1 and type = 49 and subtype = 57
-            {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
-        """
-        sum_type_1 = None
-        result_type_49 = None
-        sum_type_49 = 0
-
-        if not self.open_flag:
-            return None
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql_type_1)
-            sum_type_1 = self.cursor.fetchall()[0][0]
-            self.cursor.execute(sql_type_49)
-            result_type_49 = self.cursor.fetchall()
-            for message in result_type_49:
-                message = message[0]
-                content = parser_reply(message)
-                if content["is_error"]:
-                    continue
-                sum_type_49 += len(content["title"])
-        except sqlite3.DatabaseError:
-            logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
-        return sum_type_1 + sum_type_49
+        from app.DataBase import msg_stats_db
+        return msg_stats_db.get_send_messages_length(time_range)
 
     def get_send_messages_number_sum(
             self,
@@ -771,13 +797,11 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()[0][0]
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql)
+                result = cursor.fetchall()[0][0]
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result
 
     def get_send_messages_number_by_hour(
@@ -805,13 +829,11 @@ class Msg:
         if not self.open_flag:
             return None
         try:
-            lock.acquire(True)
-            self.cursor.execute(sql)
-            result = self.cursor.fetchall()
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql)
+                result = cursor.fetchall()
         except sqlite3.DatabaseError:
             logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
         return result
 
     def get_message_length(
@@ -820,58 +842,16 @@ class Msg:
             time_range: Tuple[int | float | str | date, int | float | str | date] = None,
     ) -> int:
         """
-                统计自己总共发消息的字数，包含type=1的文本和type=49,subtype=57里面自己发的文本
-                """
-        if time_range:
-            start_time, end_time = convert_to_timestamp(time_range)
-        sql_type_1 = f"""
-                    SELECT sum(length(strContent))
-                    from MSG
-                    where  StrTalker = ? and
-                    type = 1
-                    {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
-                """
-        sql_type_49 = f"""
-                    SELECT CompressContent
-                    from MSG
-                    where  StrTalker = ? and
-                    type = 49 and subtype = 57
-                    {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
-                """
-        sum_type_1 = 0
-        result_type_1 = 0
-        result_type_49 = 0
-        sum_type_49 = 0
-
-        if not self.open_flag:
-            return None
-        try:
-            lock.acquire(True)
-            self.cursor.execute(sql_type_1, [username_])
-            result_type_1 = self.cursor.fetchall()[0][0]
-            self.cursor.execute(sql_type_49, [username_])
-            result_type_49 = self.cursor.fetchall()
-        except sqlite3.DatabaseError:
-            logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
-        finally:
-            lock.release()
-        for message in result_type_49:
-            message = message[0]
-            content = parser_reply(message)
-            if content["is_error"]:
-                continue
-            sum_type_49 += len(content["title"])
-        sum_type_1 = result_type_1 if result_type_1 else 0
-        return sum_type_1 + sum_type_49
+        统计和好友聊天的字数，包含type=1的文本和type=49,subtype=57的引用消息
+        同 get_send_messages_length，直接查统计表
+        """
+        from app.DataBase import msg_stats_db
+        return msg_stats_db.get_message_length(username_, time_range)
 
     def close(self):
         if self.open_flag:
-            try:
-                lock.acquire(True)
-                self.open_flag = False
-                self.DB.close()
-            finally:
-                lock.release()
+            self.open_flag = False
+            self.pool.close()
 
     def __del__(self):
         self.close()
@@ -0,0 +1,72 @@
+import os
+import sqlite3
+import traceback
+
+from app.log import logger
+
+# 索引有改动时加一，已有的数据库会在下次解密合并时重建索引
+INDEX_VERSION = 2
+INDEX_PREFIX = 'MSG_IDX_'
+INDEXES = {
+    # 单个联系人的聊天记录、按时间统计
+    f'{INDEX_PREFIX}TALKER_TIME': 'MSG(StrTalker, CreateTime)',
+    # 单个联系人某种类型的消息（图片、语音、文本统计等）
+    f'{INDEX_PREFIX}TALKER_TYPE_TIME': 'MSG(StrTalker, Type, CreateTime)',
+    # 年度报告里自己发送的消息统计
+    f'{INDEX_PREFIX}SENDER_TYPE_TIME': 'MSG(IsSender, Type, CreateTime)',
+    # 统计时间范围首尾不满一天的部分
+    f'{INDEX_PREFIX}TIME': 'MSG(CreateTime)',
+}
+STATE_SQL = '''
+    CREATE TABLE IF NOT EXISTS IndexState(
+        Name TEXT PRIMARY KEY,
+        Version INTEGER
+    );
+'''
+
+
+def get_index_version(conn):
+    try:
+        row = conn.execute("SELECT Version FROM IndexState WHERE Name='MSG';").fetchone()
+    except sqlite3.OperationalError:
+        return 0
+    return row[0] if row else 0
+
+
+def build_indexes(db_path, force=False):
+    """
+    给合并后的 MSG.db 建立查询用的索引
+    索引必须和 MSG 表在同一个数据库里，所以直接建在合并后的数据库上，合并时新插入的行由 SQLite 自动维护
+    @param db_path: MSG.db 路径
+    @param force: 为 True 时即使版本一致也补齐索引并重新 ANALYZE，合并数据库之后调用
+    @return: 是否重建了索引
+    """
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        version = get_index_version(conn)
+        if version == INDEX_VERSION and not force:
+            return False
+        if version != INDEX_VERSION:
+            # 删除旧版本的索引
+            names = conn.execute(
+                "SELECT name FROM sqlite_master WHERE type='index' AND name LIKE ?;", (INDEX_PREFIX + '%',)
+            ).fetchall()
+            for (name,) in names:
+                conn.execute(f'DROP INDEX IF EXISTS {name};')
+        for name, columns in INDEXES.items():
+            conn.execute(f'CREATE INDEX IF NOT EXISTS {name} ON {columns};')
+        conn.execute(STATE_SQL)
+        conn.execute("INSERT OR REPLACE INTO IndexState (Name,Version) VALUES('MSG',?);", (INDEX_VERSION,))
+        conn.commit()
+        # 更新统计信息，让查询规划器选用新索引
+        conn.execute('PRAGMA analysis_limit=1000;')
+        conn.execute('ANALYZE;')
+        conn.commit()
+        return True
+    except sqlite3.DatabaseError:
+        logger.error(f'{db_path}建立索引失败:\n{traceback.format_exc()}')
+        return False
+    finally:
+        conn.close()
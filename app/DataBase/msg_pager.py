@@ -0,0 +1,97 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class PageCache:
+    """
+    聊天记录分页的 LRU 缓存，键为 (wxid, 消息类型, 每页条数, 页码)
+    同一个联系人的聊天界面重新打开或者重复滚动时直接取缓存，不再查询数据库。
+    数据库重新解密或关闭时调用 invalidate() 清空
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._cache.get(key)
+            if page is not None:
+                self._cache.move_to_end(key)
+            return page
+
+    def put(self, key, page):
+        with self._lock:
+            self._cache[key] = page
+            self._cache.move_to_end(key)
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+page_cache = PageCache()
+# 所有聊天界面共用的预取线程
+prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch')
+
+
+class MessagePager:
+    """
+    按 (CreateTime, localId) 键集分页，从最新的消息开始往前读取聊天记录
+    每读完一页就在后台预取下一页（群聊发送人也在后台解析），读过的页放进 page_cache
+    """
+
+    def __init__(self, wxid, page_size=20, types=(1, 3), prefetch=True):
+        self.wxid = wxid
+        self.page_size = page_size
+        self.types = tuple(types)
+        self.prefetch = prefetch
+        self.page_index = 0
+        self.cursor_key = None
+        self._future = None
+
+    def _load(self, page_index, cursor_key):
+        """
+        :return: (本页消息, 下一页的游标)
+        """
+        from app.DataBase import msg_db
+        key = (self.wxid, self.types, self.page_size, page_index)
+        page = page_cache.get(key)
+        if page is not None:
+            return page
+        messages = msg_db.get_messages_before(self.wxid, cursor_key, self.page_size, self.types) or []
+        next_key = (messages[-1][5], messages[-1][0]) if messages else cursor_key
+        page = (messages, next_key)
+        if messages:
+            page_cache.put(key, page)
+        return page
+
+    def next_page(self) -> list:
+        """
+        读取下一页（更早的）消息，按时间倒序
+        :return: 没有更早的消息时返回空列表
+        """
+        if self._future is not None:
+            messages, next_key = self._future.result()
+            self._future = None
+        else:
+            messages, next_key = self._load(self.page_index, self.cursor_key)
+        self.page_index += 1
+        self.cursor_key = next_key
+        if self.prefetch and len(messages) == self.page_size:
+            self._future = prefetch_executor.submit(self._load, self.page_index, self.cursor_key)
+        return messages
+
+    def reset(self):
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
+        self.page_index = 0
+        self.cursor_key = None
@@ -0,0 +1,302 @@
+import os.path
+import pathlib
+import re
+import sqlite3
+import threading
+import traceback
+import xml.etree.ElementTree as ET
+from datetime import date
+from typing import Tuple
+
+from app.DataBase import msg
+from app.DataBase.pool import ConnectionPool
+from app.log import logger
+from app.util.compress_content import parser_reply
+
+# 索引结构或分词方式有改动时加一，已有的索引会全部重建
+SEARCH_VERSION = 1
+SEARCH_NAME = 'MSGSearch.db'
+
+# 解密合并数据库之后在后台线程里更新索引，更新期间搜索返回“索引未就绪”
+build_lock = threading.Lock()
+
+# 中日韩文字按二元组切分，英文和数字按单词切分
+CJK_RE = r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+'
+TOKEN_RE = re.compile(rf'({CJK_RE})|([0-9A-Za-z_]+)')
+
+INIT_SQL = '''
+    CREATE VIRTUAL TABLE IF NOT EXISTS MsgSearch USING fts5(
+        Tokens,
+        Content UNINDEXED,
+        StrTalker UNINDEXED,
+        Type UNINDEXED,
+        IsSender UNINDEXED,
+        CreateTime UNINDEXED,
+        tokenize='unicode61'
+    );
+    CREATE TABLE IF NOT EXISTS SearchState(
+        Name TEXT PRIMARY KEY,
+        Value INTEGER
+    );
+'''
+
+# 文本、语音转文字和引用消息
+SOURCE_SQL = '''
+    SELECT localId,StrTalker,Type,SubType,IsSender,CreateTime,StrContent,CompressContent
+    FROM msg.MSG
+    WHERE localId > ? AND localId <= ? AND (Type=1 OR Type=34 OR (Type=49 AND SubType=57))
+'''
+
+
+def tokenize(text) -> str:
+    """
+    把文本切分成以空格分隔的词，交给 unicode61 分词器建立索引
+    连续的中文按重叠二元组切分，最后一个字单独保留，这样任意子串都能查到
+    """
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(text or ''):
+        if word:
+            tokens.append(word.lower())
+            continue
+        tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        tokens.append(cjk[-1])
+    return ' '.join(tokens)
+
+
+def build_query(keyword) -> str:
+    """
+    把搜索词转换成 FTS5 查询语句，多个词之间是“与”的关系
+    """
+    terms = []
+    for cjk, word in TOKEN_RE.findall(keyword or ''):
+        if word:
+            terms.append(f'"{word.lower()}"*')
+        elif len(cjk) == 1:
+            terms.append(f'"{cjk}"*')
+        else:
+            terms.append('"' + ' '.join(cjk[i:i + 2] for i in range(len(cjk) - 1)) + '"')
+    return ' AND '.join(terms)
+
+
+def get_voice_text(content):
+    try:
+        root = ET.fromstring(content)
+        return root.find(".//voicetrans").get("transtext")
+    except:
+        return ""
+
+
+def get_search_text(type_, str_content, compress_content):
+    if type_ == 1:
+        return str_content
+    if type_ == 34:
+        return get_voice_text(str_content)
+    content = parser_reply(compress_content)
+    return '' if content["is_error"] else content["title"]
+
+
+def get_search_path(msg_path):
+    return os.path.join(os.path.dirname(msg_path), SEARCH_NAME)
+
+
+def is_index_ready(search_path) -> bool:
+    """
+    索引数据库存在且版本一致才能用于搜索
+    """
+    if not os.path.exists(search_path):
+        return False
+    try:
+        conn = sqlite3.connect(pathlib.Path(os.path.abspath(search_path)).as_uri() + '?mode=ro', uri=True)
+        try:
+            return get_state(conn, 'Version') == SEARCH_VERSION
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+
+
+def get_state(conn, name):
+    row = conn.execute('SELECT Value FROM SearchState WHERE Name=?;', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def update_search_index(msg_path, search_path=None, batch_size=1000):
+    """
+    增量更新全文索引
+    和统计表一样以 MSG 的 localId 作为水位，只索引上次之后合并进来的消息
+    @param msg_path: 合并后的 MSG.db
+    @param search_path: 索引数据库路径，默认和 MSG.db 放在一起
+    @param batch_size: 每批写入的行数
+    @return: 新索引的消息条数
+    """
+    if not os.path.exists(msg_path):
+        return 0
+    search_path = search_path or get_search_path(msg_path)
+    with build_lock:
+        conn = sqlite3.connect(search_path)
+        try:
+            conn.executescript(INIT_SQL)
+            msg_uri = pathlib.Path(os.path.abspath(msg_path)).as_uri() + '?mode=ro'
+            conn.execute('ATTACH DATABASE ? AS msg;', (msg_uri,))
+            with conn:
+                high_water = get_state(conn, 'HighWater')
+                row_num = get_state(conn, 'RowNum')
+                if get_state(conn, 'Version') != SEARCH_VERSION or conn.execute(
+                        'SELECT count(*) FROM msg.MSG WHERE localId <= ?;', (high_water,)
+                ).fetchone()[0] != row_num:
+                    conn.execute('DELETE FROM MsgSearch;')
+                    high_water, row_num = 0, 0
+                new_high_water = conn.execute('SELECT max(localId) FROM msg.MSG;').fetchone()[0] or 0
+                if new_high_water <= high_water:
+                    return 0
+                new_num = 0
+                cursor = conn.cursor()
+                cursor.execute(SOURCE_SQL, (high_water, new_high_water))
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    values = []
+                    for row in rows:
+                        local_id, str_talker, type_, sub_type, is_sender, create_time, str_content, compress_content = row
+                        text = get_search_text(type_, str_content, compress_content)
+                        if text:
+                            values.append((local_id, tokenize(text), text, str_talker, type_, is_sender, create_time))
+                    conn.executemany(
+                        'INSERT INTO MsgSearch (rowid,Tokens,Content,StrTalker,Type,IsSender,CreateTime) '
+                        'VALUES(?,?,?,?,?,?,?);',
+                        values
+                    )
+                    new_num += len(values)
+                cursor.close()
+                row_num += conn.execute(
+                    'SELECT count(*) FROM msg.MSG WHERE localId > ? AND localId <= ?;', (high_water, new_high_water)
+                ).fetchone()[0]
+                conn.executemany(
+                    'INSERT OR REPLACE INTO SearchState (Name,Value) VALUES(?,?);',
+                    [('Version', SEARCH_VERSION), ('HighWater', new_high_water), ('RowNum', row_num)]
+                )
+            return new_num
+        except sqlite3.DatabaseError:
+            logger.error(f'{search_path}全文索引更新失败:\n{traceback.format_exc()}')
+            return 0
+        finally:
+            conn.close()
+
+
+class MsgSearch:
+    """
+    聊天记录全文搜索
+    索引文本消息、语音转文字和引用消息，结果按相关度（bm25）排序并分页。
+    索引在解密合并数据库之后建立和增量更新，这里只打开已经建好的索引；
+    索引不存在或正在更新时 is_ready 返回 False，搜索结果为空
+    """
+
+    def __init__(self):
+        self.pool: ConnectionPool = None
+        self.open_flag = False
+        self.msg_path = None
+        self.lock = threading.Lock()
+        self.init_database()
+
+    def init_database(self, path=None):
+        if not self.open_flag:
+            self.msg_path = path or msg.db_path
+            search_path = get_search_path(self.msg_path)
+            if not build_lock.locked() and is_index_ready(search_path):
+                # 解密合并之后索引会在后台线程里增量更新，不能用 immutable 连接，否则一直读到打开时的旧数据
+                self.pool = ConnectionPool(search_path, immutable=False)
+                self.open_flag = True
+
+    def is_ready(self) -> bool:
+        """
+        全文索引是否可以搜索，不会建立索引
+        """
+        if build_lock.locked():
+            return False
+        with self.lock:
+            self.init_database()
+            return self.open_flag
+
+    def _where(self, keyword, username_, time_range, types):
+        query = build_query(keyword)
+        if not query:
+            return None, None
+        if time_range:
+            start_time, end_time = msg.convert_to_timestamp(time_range)
+        where = f'''
+            MsgSearch MATCH ?
+            {'AND StrTalker=?' if username_ else ''}
+            {'AND Type IN (' + ','.join(str(int(type_)) for type_ in types) + ')' if types else ''}
+            {'AND CreateTime>' + str(start_time) + ' AND CreateTime<' + str(end_time) if time_range else ''}
+        '''
+        return where, [query] + ([username_] if username_ else [])
+
+    def search(
+            self,
+            keyword,
+            username_='',
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            types=None,
+            page=0,
+            page_size=20,
+    ) -> list:
+        """
+        搜索聊天记录
+        @param keyword: 搜索词，空格分隔的多个词需要同时出现
+        @param username_: 只搜索某个联系人或群聊，为空时搜索全部
+        @param time_range:
+        @param types: 只搜索这些类型的消息，比如 (1,) 只搜文本
+        @param page: 页码，从 0 开始
+        @param page_size: 每页条数
+        @return: [(localId, StrTalker, Type, IsSender, CreateTime, StrTime, Content), ...]，索引未就绪时为空
+        """
+        where, params = self._where(keyword, username_, time_range, types)
+        if not where or not self.is_ready():
+            return []
+        sql = f'''
+            SELECT rowid,StrTalker,Type,IsSender,CreateTime,
+                strftime('%Y-%m-%d %H:%M:%S',CreateTime,'unixepoch','localtime') as StrTime,Content
+            FROM MsgSearch
+            WHERE {where}
+            ORDER BY rank
+            LIMIT ? OFFSET ?
+        '''
+        result = []
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params + [page_size, page * page_size])
+                result = cursor.fetchall()
+        except sqlite3.DatabaseError:
+            logger.error(f'{traceback.format_exc()}\n全文搜索失败')
+        return result
+
+    def count(
+            self,
+            keyword,
+            username_='',
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            types=None,
+    ) -> int:
+        """
+        搜索结果总条数，用于分页
+        """
+        where, params = self._where(keyword, username_, time_range, types)
+        if not where or not self.is_ready():
+            return 0
+        result = None
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(f'SELECT count(*) FROM MsgSearch WHERE {where}', params)
+                result = cursor.fetchone()
+        except sqlite3.DatabaseError:
+            logger.error(f'{traceback.format_exc()}\n全文搜索失败')
+        return result[0] if result else 0
+
+    def close(self):
+        if self.open_flag:
+            self.open_flag = False
+            self.pool.close()
+
+    def __del__(self):
+        self.close()
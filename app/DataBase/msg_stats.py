@@ -0,0 +1,514 @@
+import os.path
+import pathlib
+import sqlite3
+import traceback
+from collections import defaultdict
+from datetime import datetime, date, timedelta
+from typing import Tuple
+
+from app.DataBase import msg
+from app.DataBase.pool import ConnectionPool, readonly_uri
+from app.log import logger
+from app.util.compress_content import parser_reply
+
+# 统计表结构有改动时加一，已有的统计会全部重建
+STATS_VERSION = 2
+STATS_NAME = 'MSGStats.db'
+
+INIT_SQL = '''
+    CREATE TABLE IF NOT EXISTS MsgStats(
+        StrTalker TEXT,
+        Day TEXT,
+        Hour INTEGER,
+        Type INTEGER,
+        SubType INTEGER,
+        IsSender INTEGER,
+        MsgNum INTEGER,
+        TextLength INTEGER,
+        PRIMARY KEY (StrTalker, Day, Hour, Type, SubType, IsSender)
+    ) WITHOUT ROWID;
+    CREATE INDEX IF NOT EXISTS MsgStats_Day ON MsgStats(Day);
+    CREATE TABLE IF NOT EXISTS LastActivity(
+        StrTalker TEXT PRIMARY KEY,
+        CreateTime INTEGER
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS StatsState(
+        Name TEXT PRIMARY KEY,
+        Value INTEGER
+    );
+'''
+
+# 按 (联系人, 天, 小时, 类型, 子类型, 是否自己发送) 聚合消息条数和文本字数
+AGGREGATE_SQL = '''
+    INSERT INTO MsgStats (StrTalker,Day,Hour,Type,SubType,IsSender,MsgNum,TextLength)
+    SELECT StrTalker,
+        strftime('%Y-%m-%d',CreateTime,'unixepoch','localtime') as Day,
+        CAST(strftime('%H',CreateTime,'unixepoch','localtime') AS INTEGER) as Hour,
+        Type,SubType,IsSender,Count(MsgSvrID),
+        sum(CASE WHEN Type=1 THEN length(StrContent) ELSE 0 END)
+    FROM msg.MSG
+    WHERE localId > ? AND localId <= ?
+    GROUP BY StrTalker,Day,Hour,Type,SubType,IsSender
+    ON CONFLICT(StrTalker,Day,Hour,Type,SubType,IsSender) DO UPDATE SET
+        MsgNum=MsgNum+excluded.MsgNum,
+        TextLength=TextLength+excluded.TextLength;
+'''
+
+# 每个会话最后一条消息的时间，联系人列表按它排序
+LAST_ACTIVITY_SQL = '''
+    INSERT INTO LastActivity (StrTalker,CreateTime)
+    SELECT StrTalker,MAX(CreateTime)
+    FROM msg.MSG
+    WHERE localId > ? AND localId <= ?
+    GROUP BY StrTalker
+    ON CONFLICT(StrTalker) DO UPDATE SET
+        CreateTime=max(CreateTime,excluded.CreateTime);
+'''
+
+# 引用消息（type=49,subtype=57）里的文本在 CompressContent 里，需要解析后再累加字数
+REPLY_SQL = '''
+    SELECT StrTalker,
+        strftime('%Y-%m-%d',CreateTime,'unixepoch','localtime') as Day,
+        CAST(strftime('%H',CreateTime,'unixepoch','localtime') AS INTEGER) as Hour,
+        Type,SubType,IsSender,CompressContent
+    FROM msg.MSG
+    WHERE localId > ? AND localId <= ? AND Type=49 AND SubType=57
+'''
+
+# 统计文本字数时计入的消息：文本和引用消息
+TEXT_CONDITION = '(Type=1 OR (Type=49 AND SubType=57))'
+
+
+def get_stats_path(msg_path):
+    return os.path.join(os.path.dirname(msg_path), STATS_NAME)
+
+
+def get_state(conn, name):
+    row = conn.execute('SELECT Value FROM StatsState WHERE Name=?;', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def is_up_to_date(sidecar_path, msg_path, state_table, version) -> bool:
+    """
+    统计表、词频表这类附属数据库是否已经包含 MSG 里的全部消息，只读检查，不会更新
+    版本一致、水位等于 MSG 最大的 localId 并且行数一致才算最新
+    @param sidecar_path: 附属数据库路径
+    @param msg_path: 合并后的 MSG.db
+    @param state_table: 保存 Version、HighWater、RowNum 的表
+    @param version: 当前的表结构版本
+    """
+    if not os.path.exists(sidecar_path) or not os.path.exists(msg_path):
+        return False
+    try:
+        conn = sqlite3.connect(readonly_uri(sidecar_path), uri=True)
+        try:
+            conn.execute('ATTACH DATABASE ? AS msg;', (readonly_uri(msg_path),))
+            state = dict(conn.execute(f'SELECT Name, Value FROM {state_table};').fetchall())
+            if state.get('Version') != version:
+                return False
+            high_water = conn.execute('SELECT max(localId) FROM msg.MSG;').fetchone()[0] or 0
+            # 水位等于最大的 localId 时，水位以下的行数就是总行数，count(*) 可以只扫最小的索引
+            row_num = conn.execute('SELECT count(*) FROM msg.MSG;').fetchone()[0]
+            return state.get('HighWater') == high_water and state.get('RowNum') == row_num
+        finally:
+            conn.close()
+    except sqlite3.DatabaseError:
+        return False
+
+
+def update_stats(msg_path, stats_path=None):
+    """
+    增量更新统计表
+    以 MSG 的 localId 作为水位，只聚合上次之后合并进来的消息；
+    MSG.db 被重新生成（水位以下的行数对不上）或统计表版本变化时全部重建
+    @param msg_path: 合并后的 MSG.db
+    @param stats_path: 统计数据库路径，默认和 MSG.db 放在一起
+    @return: 新聚合的消息条数
+    """
+    if not os.path.exists(msg_path):
+        return 0
+    stats_path = stats_path or get_stats_path(msg_path)
+    conn = sqlite3.connect(stats_path)
+    try:
+        conn.executescript(INIT_SQL)
+        msg_uri = pathlib.Path(os.path.abspath(msg_path)).as_uri() + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS msg;', (msg_uri,))
+        with conn:
+            high_water = get_state(conn, 'HighWater')
+            row_num = get_state(conn, 'RowNum')
+            if get_state(conn, 'Version') != STATS_VERSION or conn.execute(
+                    'SELECT count(*) FROM msg.MSG WHERE localId <= ?;', (high_water,)
+            ).fetchone()[0] != row_num:
+                conn.execute('DELETE FROM MsgStats;')
+                conn.execute('DELETE FROM LastActivity;')
+                high_water, row_num = 0, 0
+            new_high_water = conn.execute('SELECT max(localId) FROM msg.MSG;').fetchone()[0] or 0
+            if new_high_water <= high_water:
+                return 0
+            conn.execute(AGGREGATE_SQL, (high_water, new_high_water))
+            conn.execute(LAST_ACTIVITY_SQL, (high_water, new_high_water))
+            reply_length = defaultdict(int)
+            for *key, compress_content in conn.execute(REPLY_SQL, (high_water, new_high_water)):
+                content = parser_reply(compress_content)
+                if content["is_error"]:
+                    continue
+                reply_length[tuple(key)] += len(content["title"])
+            conn.executemany(
+                'UPDATE MsgStats SET TextLength=TextLength+? '
+                'WHERE StrTalker=? AND Day=? AND Hour=? AND Type=? AND SubType=? AND IsSender=?;',
+                [(length, *key) for key, length in reply_length.items()]
+            )
+            new_num = conn.execute(
+                'SELECT count(*) FROM msg.MSG WHERE localId > ? AND localId <= ?;', (high_water, new_high_water)
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT OR REPLACE INTO StatsState (Name,Value) VALUES(?,?);',
+                [('Version', STATS_VERSION), ('HighWater', new_high_water), ('RowNum', row_num + new_num)]
+            )
+        return new_num
+    except sqlite3.DatabaseError:
+        logger.error(f'{stats_path}统计数据更新失败:\n{traceback.format_exc()}')
+        return 0
+    finally:
+        conn.close()
+
+
+# 统计表的列，直接查 MSG 的部分也要整理成同样的列
+STATS_COLUMNS = 'StrTalker,Day,Hour,Type,SubType,IsSender,MsgNum,TextLength'
+
+# 直接查 MSG 时每条消息一行，整理成统计表的列，sign 为 -1 时表示要减掉的消息
+MSG_ROWS_SQL = '''
+    SELECT StrTalker,
+        strftime('%Y-%m-%d',CreateTime,'unixepoch','localtime') as Day,
+        CAST(strftime('%H',CreateTime,'unixepoch','localtime') AS INTEGER) as Hour,
+        Type,SubType,IsSender,
+        {sign}*(MsgSvrID IS NOT NULL) as MsgNum,
+        {sign}*(CASE WHEN Type=1 THEN length(StrContent)
+            WHEN Type=49 AND SubType=57 THEN reply_length(CompressContent)
+            ELSE 0 END) as TextLength
+    FROM msg.MSG
+'''
+
+# 时间范围首尾不满一天的部分
+EDGE_SQL = MSG_ROWS_SQL + '    WHERE CreateTime>? AND CreateTime<?\n'
+
+
+def reply_length(compress_content) -> int:
+    content = parser_reply(compress_content)
+    return 0 if content["is_error"] else len(content["title"])
+
+
+def local_midnight(timestamp, days=0) -> int:
+    """
+    timestamp 所在那一天（往后 days 天）本地时间零点的时间戳
+    """
+    day = datetime.fromtimestamp(timestamp).date() + timedelta(days=days)
+    return int(datetime.combine(day, datetime.min.time()).timestamp())
+
+
+def to_day(timestamp) -> str:
+    return datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d')
+
+
+def split_range(time_range):
+    """
+    和 MSG 上的查询一样，时间范围是开区间 CreateTime>start AND CreateTime<end。
+    统计表按天聚合，只有完整落在范围内的天用统计表，首尾不满一天的部分直接查 MSG：
+        * 起点正好是零点时这一天整天用统计表，再减掉正好在起点那一秒的消息
+        * 终点正好是零点时终点那一天不计入
+    @return: (first_day, end_day, edges)
+        first_day, end_day: 用统计表的天，first_day <= Day < end_day，没有完整的天时为 None
+        edges: [(start, end, sign), ...] 要直接查 MSG 的时间段（开区间），sign 为 -1 时要减掉
+    """
+    start, end = msg.convert_to_timestamp(time_range)
+    aligned = local_midnight(start) == start
+    first = start if aligned else local_midnight(start, 1)
+    last = local_midnight(end)
+    if first >= last:
+        # 不够一整天
+        return None, None, [(start, end, 1)] if start < end else []
+    edges = [(start - 1, start + 1, -1) if aligned else (start, first, 1)]
+    if last < end:
+        edges.append((last - 1, end, 1))
+    return to_day(first), to_day(last), edges
+
+
+def range_source(time_range, use_stats=True):
+    """
+    时间范围内的统计数据，用来代替 FROM 后面的 MsgStats
+    @param time_range:
+    @param use_stats: 为 False 时统计表不可用，全部直接查 MSG
+    @return: (sql, params)，params 要放在整个查询参数的最前面
+    """
+    if not use_stats:
+        if not time_range:
+            return '(' + MSG_ROWS_SQL.format(sign=1) + ')', []
+        return '(' + EDGE_SQL.format(sign=1) + ')', list(msg.convert_to_timestamp(time_range))
+    if not time_range:
+        return 'MsgStats', []
+    first_day, end_day, edges = split_range(time_range)
+    parts, params = [], []
+    if first_day:
+        parts.append(f'SELECT {STATS_COLUMNS} FROM MsgStats WHERE Day>=? AND Day<?')
+        params += [first_day, end_day]
+    for start, end, sign in edges:
+        parts.append(EDGE_SQL.format(sign=int(sign)))
+        params += [start, end]
+    if not parts:
+        return f'(SELECT {STATS_COLUMNS} FROM MsgStats WHERE 0)', []
+    return '(' + ' UNION ALL '.join(parts) + ')', params
+
+
+class MsgStats:
+    """
+    聊天记录统计数据
+    年度报告和图表只需要按天、小时、类型汇总的条数和字数，直接查预先聚合好的统计表，不再扫描 MSG 表。
+    时间范围和 MSG 上的查询结果一致，首尾不满一天的部分直接查 MSG（见 split_range）。
+    统计表在解密合并数据库之后由后台线程更新（update_stats），这里只打开；
+    统计表不存在或者落后于 MSG 时，所有查询直接在 MSG 上按同样的列聚合，结果一样只是慢一些
+    """
+
+    def __init__(self):
+        self.pool: ConnectionPool = None
+        self.open_flag = False
+        self.stats_ready = False
+        self.init_database()
+
+    def init_database(self, path=None):
+        if not self.open_flag:
+            msg_path = path or msg.db_path
+            if os.path.exists(msg_path):
+                stats_path = get_stats_path(msg_path)
+                self.stats_ready = is_up_to_date(stats_path, msg_path, 'StatsState', STATS_VERSION)
+                self.pool = ConnectionPool(stats_path if self.stats_ready else msg_path,
+                                           init=self.attach_msg(msg_path))
+                self.open_flag = True
+
+    @staticmethod
+    def attach_msg(msg_path):
+        def init(conn):
+            conn.execute('ATTACH DATABASE ? AS msg;', (readonly_uri(msg_path),))
+            conn.create_function('reply_length', 1, reply_length)
+
+        return init
+
+    def range_source(self, time_range):
+        return range_source(time_range, self.stats_ready)
+
+    def query(self, sql, params=()):
+        result = []
+        if not self.open_flag:
+            return result
+        try:
+            with self.pool.cursor() as cursor:
+                cursor.execute(sql, params)
+                result = cursor.fetchall()
+        except sqlite3.DatabaseError:
+            logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
+        return result
+
+    def get_chatted_top_contacts(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            contain_chatroom=False,
+            top_n=10
+    ) -> list:
+        """
+        统计聊天最多的 n 个联系人（默认不包含群组），按条数降序\n
+        return [(wxid_1, number_1), (wxid_2, number_2), ...]
+        """
+        source, params = self.range_source(time_range)
+        sql = f"""
+            SELECT StrTalker, sum(MsgNum) as num
+            from {source}
+            where StrTalker != 'filehelper' and StrTalker != 'notifymessage' and StrTalker not like 'gh_%'
+            {"and StrTalker not like '%@chatroom'" if not contain_chatroom else ""}
+            group by StrTalker
+            having sum(MsgNum) > 0
+            order by num desc
+            limit {int(top_n)}
+        """
+        return self.query(sql, params)
+
+    def get_last_activity(self) -> dict:
+        """
+        每个会话最后一条消息的时间
+        @return: {StrTalker: CreateTime}
+        """
+        if not self.stats_ready:
+            return dict(self.query('SELECT StrTalker, MAX(CreateTime) FROM msg.MSG GROUP BY StrTalker'))
+        return dict(self.query('SELECT StrTalker, CreateTime FROM LastActivity'))
+
+    def get_messages_by_days(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ):
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT Day, sum(MsgNum)
+            from {source}
+            where StrTalker = ?
+            group by Day
+            having sum(MsgNum) > 0
+            order by Day
+        '''
+        return self.query(sql, params + [username_])
+
+    def get_messages_by_month(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ):
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT substr(Day, 1, 7) as month, sum(MsgNum)
+            from {source}
+            where StrTalker = ?
+            group by month
+            having sum(MsgNum) > 0
+            order by month
+        '''
+        return self.query(sql, params + [username_])
+
+    def get_messages_by_hour(self, username_, time_range=None):
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT printf('%02d:00', Hour) as hours, sum(MsgNum)
+            from {source}
+            where StrTalker = ?
+            group by Hour
+            having sum(MsgNum) > 0
+            order by Hour
+        '''
+        return self.query(sql, params + [username_])
+
+    def get_messages_number(
+            self,
+            username_,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT sum(MsgNum)
+            from {source}
+            where StrTalker = ?
+        '''
+        result = self.query(sql, params + [username_])
+        return (result[0][0] or 0) if result else 0
+
+    def get_messages_type_number(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            is_sender=None,
+    ) -> list:
+        """
+        统计各类型消息条数，按条数降序，精确到subtype\n
+        return [(type_1, subtype_1, number_1), (type_2, subtype_2, number_2), ...]
+        @param time_range:
+        @param is_sender: 1 只统计自己发的，0 只统计收到的，None 全部
+        """
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT Type, SubType, sum(MsgNum) as num
+            from {source}
+            where 1=1
+            {'AND IsSender=' + str(int(is_sender)) if is_sender is not None else ''}
+            group by Type, SubType
+            having sum(MsgNum) > 0
+            order by num desc
+        '''
+        return self.query(sql, params)
+
+    def get_send_messages_type_number(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> list:
+        return self.get_messages_type_number(time_range, is_sender=1)
+
+    def get_send_messages_number_sum(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        """统计自己总共发了多少条消息"""
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT sum(MsgNum)
+            from {source}
+            where IsSender = 1
+        '''
+        result = self.query(sql, params)
+        return (result[0][0] or 0) if result else 0
+
+    def get_send_messages_number_by_hour(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> list:
+        """
+        统计每个（小时）时段自己总共发了多少消息，从最多到最少排序\n
+        return be like [('23', 9526), ('00', 7890), ('22', 7600),  ..., ('05', 29)]
+        """
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT printf('%02d', Hour) as hour, sum(MsgNum) as num
+            from {source}
+            where IsSender = 1
+            group by Hour
+            having sum(MsgNum) > 0
+            order by num desc
+        '''
+        return self.query(sql, params)
+
+    def get_text_length(
+            self,
+            username_='',
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            is_sender=None,
+            contain_reply=True,
+    ) -> int:
+        """
+        统计文本字数
+        @param username_: 为空时统计全部联系人
+        @param time_range:
+        @param is_sender: 1 只统计自己发的，0 只统计收到的，None 全部
+        @param contain_reply: 是否包含引用消息（type=49,subtype=57）里的文本
+        @return:
+        """
+        source, params = self.range_source(time_range)
+        sql = f'''
+            SELECT sum(TextLength)
+            from {source}
+            where {TEXT_CONDITION if contain_reply else 'Type=1'}
+            {'AND StrTalker=?' if username_ else ''}
+            {'AND IsSender=' + str(int(is_sender)) if is_sender is not None else ''}
+        '''
+        result = self.query(sql, params + ([username_] if username_ else []))
+        return (result[0][0] or 0) if result else 0
+
+    def get_message_length(
+            self,
+            username_='',
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        """
+        统计和好友聊天的字数，包含type=1的文本和type=49,subtype=57的引用消息
+        """
+        return self.get_text_length(username_, time_range)
+
+    def get_send_messages_length(
+            self,
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+    ) -> int:
+        """
+        统计自己总共发消息的字数，包含type=1的文本和type=49,subtype=57里面自己发的文本
+        """
+        return self.get_text_length(time_range=time_range, is_sender=1)
+
+    def close(self):
+        if self.open_flag:
+            self.open_flag = False
+            self.stats_ready = False
+            self.pool.close()
+
+    def __del__(self):
+        self.close()
@@ -0,0 +1,334 @@
+import os.path
+import pathlib
+import sqlite3
+import sys
+import traceback
+from collections import Counter, defaultdict
+from concurrent.futures import wait, FIRST_COMPLETED
+from datetime import date
+from functools import lru_cache
+from typing import Tuple
+
+from app.DataBase import msg
+from app.DataBase.msg_stats import split_range, is_up_to_date
+from app.DataBase.pool import ConnectionPool, readonly_uri
+from app.log import logger
+from app.util import process_pool
+
+# 分词方式或词典有改动时加一，已有的词频会全部重建
+WORDS_VERSION = 1
+WORDS_NAME = 'MSGWords.db'
+USER_DICT_PATH = './app/data/new_words.txt'
+STOPWORDS_PATHS = ['./app/data/stopwords.txt', './app/resources/data/stopwords.txt']
+
+# 每个进程处理的消息条数，新消息少于一批时直接在当前进程分词
+BATCH_SIZE = 5000
+
+INIT_SQL = '''
+    CREATE TABLE IF NOT EXISTS WordCount(
+        StrTalker TEXT,
+        Day TEXT,
+        IsSender INTEGER,
+        Word TEXT,
+        Num INTEGER,
+        PRIMARY KEY (StrTalker, Day, IsSender, Word)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS WordsState(
+        Name TEXT PRIMARY KEY,
+        Value INTEGER
+    );
+'''
+
+SOURCE_SQL = '''
+    SELECT StrTalker,
+        strftime('%Y-%m-%d',CreateTime,'unixepoch','localtime') as Day,
+        IsSender,StrContent
+    FROM msg.MSG
+    WHERE localId > ? AND localId <= ? AND Type=1
+'''
+
+UPSERT_SQL = '''
+    INSERT INTO WordCount (StrTalker,Day,IsSender,Word,Num) VALUES(?,?,?,?,?)
+    ON CONFLICT(StrTalker,Day,IsSender,Word) DO UPDATE SET Num=Num+excluded.Num;
+'''
+
+_tokenizer = None
+
+
+def get_tokenizer():
+    """
+    每个进程只初始化一次 jieba 并加载自定义词典
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        import jieba
+        tokenizer = jieba.Tokenizer()
+        if os.path.exists(USER_DICT_PATH):
+            tokenizer.load_userdict(USER_DICT_PATH)
+        _tokenizer = tokenizer
+    return _tokenizer
+
+
+@lru_cache(maxsize=1)
+def load_stopwords() -> frozenset:
+    stopwords = set()
+    for path in STOPWORDS_PATHS:
+        if not os.path.exists(path):
+            # 打包后资源文件在 _MEIPASS 下
+            resource_dir = getattr(sys, '_MEIPASS', os.path.abspath('.'))
+            path = os.path.join(resource_dir, path)
+            if not os.path.exists(path):
+                continue
+        with open(path, "r", encoding="utf-8") as f:
+            stopwords.update(f.read().splitlines())
+    return frozenset(stopwords)
+
+
+def count_words(rows) -> dict:
+    """
+    对一批消息分词并按 (联系人, 天, 是否自己发送) 统计词频，在进程池里执行
+    单字不计入词频，和词云的过滤规则一致
+    @param rows: [(StrTalker, Day, IsSender, StrContent), ...]
+    @return: {(StrTalker, Day, IsSender): Counter}
+    """
+    tokenizer = get_tokenizer()
+    counters = defaultdict(Counter)
+    for str_talker, day, is_sender, content in rows:
+        if not content:
+            continue
+        counters[(str_talker, day, is_sender)].update(
+            word for word in tokenizer.cut(content) if len(word.strip()) > 1
+        )
+    return counters
+
+
+def get_words_path(msg_path):
+    return os.path.join(os.path.dirname(msg_path), WORDS_NAME)
+
+
+def get_state(conn, name):
+    row = conn.execute('SELECT Value FROM WordsState WHERE Name=?;', (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def save_counters(conn, counters):
+    conn.executemany(
+        UPSERT_SQL,
+        ((*key, word, num) for key, counter in counters.items() for word, num in counter.items())
+    )
+
+
+def update_word_counts(msg_path, words_path=None, max_workers=None):
+    """
+    增量更新词频表
+    和统计表一样以 MSG 的 localId 作为水位，只对上次之后合并进来的文本消息分词；
+    新消息较多时分批交给共用的进程池，jieba 在每个进程里只初始化一次，同时在途的批数有上限
+    @param msg_path: 合并后的 MSG.db
+    @param words_path: 词频数据库路径，默认和 MSG.db 放在一起
+    @param max_workers: 同时分词的批数，默认等于进程池的进程数
+    @return: 新分词的消息条数
+    """
+    if not os.path.exists(msg_path):
+        return 0
+    words_path = words_path or get_words_path(msg_path)
+    conn = sqlite3.connect(words_path)
+    try:
+        conn.executescript(INIT_SQL)
+        msg_uri = pathlib.Path(os.path.abspath(msg_path)).as_uri() + '?mode=ro'
+        conn.execute('ATTACH DATABASE ? AS msg;', (msg_uri,))
+        with conn:
+            high_water = get_state(conn, 'HighWater')
+            row_num = get_state(conn, 'RowNum')
+            if get_state(conn, 'Version') != WORDS_VERSION or conn.execute(
+                    'SELECT count(*) FROM msg.MSG WHERE localId <= ?;', (high_water,)
+            ).fetchone()[0] != row_num:
+                conn.execute('DELETE FROM WordCount;')
+                high_water, row_num = 0, 0
+            new_high_water = conn.execute('SELECT max(localId) FROM msg.MSG;').fetchone()[0] or 0
+            if new_high_water <= high_water:
+                return 0
+            cursor = conn.cursor()
+            cursor.execute(SOURCE_SQL, (high_water, new_high_water))
+            rows = cursor.fetchmany(BATCH_SIZE)
+            new_num = len(rows)
+            if len(rows) < BATCH_SIZE:
+                save_counters(conn, count_words(rows))
+            else:
+                max_workers = max_workers or process_pool.MAX_WORKERS
+                executor = process_pool.get_executor()
+                pending = set()
+                try:
+                    while rows:
+                        pending.add(executor.submit(count_words, rows))
+                        if len(pending) >= max_workers * 2:
+                            # 在途的批数有上限，完成一批保存一批，聊天记录再多内存占用也不会一直增长
+                            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                save_counters(conn, future.result())
+                        rows = cursor.fetchmany(BATCH_SIZE)
+                        new_num += len(rows)
+                    while pending:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            save_counters(conn, future.result())
+                finally:
+                    # 进程池是共用的，出错退出时不会随着关闭，还没开始的批要自己取消
+                    for future in pending:
+                        future.cancel()
+            cursor.close()
+            row_num += conn.execute(
+                'SELECT count(*) FROM msg.MSG WHERE localId > ? AND localId <= ?;', (high_water, new_high_water)
+            ).fetchone()[0]
+            conn.executemany(
+                'INSERT OR REPLACE INTO WordsState (Name,Value) VALUES(?,?);',
+                [('Version', WORDS_VERSION), ('HighWater', new_high_water), ('RowNum', row_num)]
+            )
+        return new_num
+    except sqlite3.DatabaseError:
+        logger.error(f'{words_path}词频更新失败:\n{traceback.format_exc()}')
+        return 0
+    finally:
+        conn.close()
+
+
+class MsgWords:
+    """
+    文本消息的词频
+    按 (联系人, 天, 是否自己发送) 保存分词后的词频，词云只需要把时间范围内的词频加起来，
+    不用每次都读取全部聊天记录重新分词。时间范围首尾不满一天的部分直接读取 MSG 分词。
+    词频表在解密合并数据库之后由后台线程更新（update_word_counts），这里只打开；
+    词频表不存在或者落后于 MSG 时和原来一样直接读取 MSG 分词，结果一样只是慢一些
+    """
+
+    def __init__(self):
+        self.pool: ConnectionPool = None
+        self.open_flag = False
+        self.words_ready = False
+        self.init_database()
+
+    def init_database(self, path=None):
+        if not self.open_flag:
+            msg_path = path or msg.db_path
+            if os.path.exists(msg_path):
+                words_path = get_words_path(msg_path)
+                self.words_ready = is_up_to_date(words_path, msg_path, 'WordsState', WORDS_VERSION)
+                self.pool = ConnectionPool(words_path if self.words_ready else msg_path,
+                                           init=self.attach_msg(msg_path))
+                self.open_flag = True
+
+    @staticmethod
+    def attach_msg(msg_path):
+        def init(conn):
+            conn.execute('ATTACH DATABASE ? AS msg;', (readonly_uri(msg_path),))
+
+        return init
+
+    def get_edge_counter(self, edges, conditions, params) -> Counter:
+        """
+        没有现成词频的部分直接读取 MSG 里的文本分词：时间范围首尾不满一天的部分，或者词频表不可用时的整个范围
+        @param edges: [(start, end, sign), ...]，start 为 None 时不限时间
+        """
+        counter = Counter()
+        tokenizer = None
+        with self.pool.cursor() as cursor:
+            for start, end, sign in edges:
+                time_conditions, time_params = [], []
+                if start is not None:
+                    time_conditions, time_params = ['CreateTime>? AND CreateTime<?'], [start, end]
+                sql = f'''
+                    SELECT StrContent
+                    FROM msg.MSG
+                    WHERE Type=1
+                    {''.join(' AND ' + condition for condition in time_conditions + conditions)}
+                '''
+                cursor.execute(sql, time_params + params)
+                for (content,) in cursor:
+                    if not content:
+                        continue
+                    tokenizer = tokenizer or get_tokenizer()
+                    for word in tokenizer.cut(content):
+                        if len(word.strip()) > 1:
+                            counter[word] += sign
+        return counter
+
+    def get_top_words(
+            self,
+            username_='',
+            time_range: Tuple[int | float | str | date, int | float | str | date] = None,
+            is_sender=None,
+            top_n=100,
+    ) -> list:
+        """
+        出现次数最多的词，已去掉停用词
+        @param username_: 为空时统计全部联系人
+        @param time_range: 和 MSG 上的查询一样是开区间，首尾不满一天的部分直接读取 MSG 分词
+        @param is_sender: 1 只统计自己发的，0 只统计收到的，None 全部
+        @param top_n:
+        @return: [(word, num), ...] 按次数降序
+        """
+        if not self.open_flag:
+            return []
+        conditions, params = [], []
+        if username_:
+            conditions.append('StrTalker=?')
+            params.append(username_)
+        if is_sender is not None:
+            conditions.append(f'IsSender={int(is_sender)}')
+        if self.words_ready:
+            first_day, end_day, edges = split_range(time_range) if time_range else (None, None, [])
+            use_table = bool(first_day) or not time_range
+        else:
+            # 词频表不可用，整个时间范围都直接读取 MSG 分词
+            first_day, end_day = None, None
+            edges = [(*msg.convert_to_timestamp(time_range), 1)] if time_range else [(None, None, 1)]
+            use_table = False
+        day_conditions, day_params = list(conditions), list(params)
+        if time_range:
+            day_conditions.append('Day>=? AND Day<?')
+            day_params += [first_day, end_day]
+        sql = f'''
+            SELECT Word, sum(Num) as num
+            from WordCount
+            {'WHERE ' + ' AND '.join(day_conditions) if day_conditions else ''}
+            group by Word
+            order by num desc
+        '''
+        stopwords = load_stopwords()
+        result = []
+        try:
+            edge_counter = self.get_edge_counter(edges, conditions, params) if edges else Counter()
+            if not edge_counter:
+                # 首尾没有需要单独统计的消息，按词频顺序读到 top_n 个就停
+                if not use_table:
+                    return []
+                with self.pool.cursor() as cursor:
+                    cursor.execute(sql, day_params)
+                    for word, num in cursor:
+                        if word in stopwords:
+                            continue
+                        result.append((word, num))
+                        if len(result) >= top_n:
+                            break
+                return result
+            if use_table:
+                with self.pool.cursor() as cursor:
+                    cursor.execute(sql, day_params)
+                    edge_counter.update(dict(cursor.fetchall()))
+            for word, num in edge_counter.most_common():
+                if num <= 0 or word in stopwords:
+                    continue
+                result.append((word, num))
+                if len(result) >= top_n:
+                    break
+        except sqlite3.DatabaseError:
+            logger.error(f'{traceback.format_exc()}\n数据库损坏请删除msg文件夹重试')
+        return result
+
+    def close(self):
+        if self.open_flag:
+            self.open_flag = False
+            self.words_ready = False
+            self.pool.close()
+
+    def __del__(self):
+        self.close()
@@ -1,9 +1,9 @@
 import threading
 
-from app.DataBase import msg_db, micro_msg_db, misc_db
-from app.util.protocbuf.msg_pb2 import MessageBytesExtra
+from app.DataBase import msg_db, micro_msg_db, contact_cache
+from app.util.message_extra import get_message_extra
 from app.util.protocbuf.roomdata_pb2 import ChatRoomData
-from app.person import Contact, Me, ContactDefault
+from app.person import Me, ContactDefault
 
 lock = threading.Lock()
 
@@ -28,68 +28,64 @@ class PackageMsg:
         '''
         获取完整的聊天记录
         '''
-        updated_messages = []  # 用于存储修改后的消息列表
+        return list(self.iter_package_message_all())
 
-        messages = msg_db.get_messages_all()
-        for row in messages:
-            row_list = list(row)
-            # 删除不使用的几个字段
-            del row_list[13]
-            del row_list[12]
-            del row_list[11]
-            del row_list[10]
-            del row_list[9]
+    def iter_package_message_all(self, batch_size=1000):
+        '''
+        流式获取完整的聊天记录
+        联系人信息来自 MicroMsg 的内存索引，每批消息只做字典查找，不再逐条查询数据库
+        '''
+        contact_index = micro_msg_db.get_contact_index()
+        for messages in msg_db.iter_messages_all_batches(batch_size=batch_size):
+            talkers = micro_msg_db.resolve_contacts(row[11] for row in messages)
+            for row in messages:
+                row_list = list(row)
+                # 删除不使用的几个字段
+                del row_list[9:14]
 
-            strtalker = row[11]
-            info = micro_msg_db.get_contact_by_username(strtalker)
-            if info is not None:
-                row_list.append(info[3])
-                row_list.append(info[4])
-            else:
-                row_list.append('')
-                row_list.append('')
-            # 判断是否是群聊
-            if strtalker.__contains__('@chatroom'):
-                # 自己发送
-                if row[4] == 1:
-                    row_list.append('我')
+                strtalker = row[11]
+                info = talkers.get(strtalker)
+                if info is not None:
+                    row_list.append(info[3])
+                    row_list.append(info[4])
                 else:
-                    # 存在BytesExtra为空的情况，此时消息类型应该为提示性消息。跳过不处理
-                    if row[10] is None:
-                        continue
-                    # 解析BytesExtra
-                    msgbytes = MessageBytesExtra()
-                    msgbytes.ParseFromString(row[10])
-                    wxid = ''
-                    for tmp in msgbytes.message2:
-                        if tmp.field1 != 1:
+                    row_list.append('')
+                    row_list.append('')
+                # 判断是否是群聊
+                if strtalker.__contains__('@chatroom'):
+                    # 自己发送
+                    if row[4] == 1:
+                        row_list.append('我')
+                    else:
+                        # 存在BytesExtra为空的情况，此时消息类型应该为提示性消息。跳过不处理
+                        if row[10] is None:
                             continue
-                        wxid = tmp.field2
-                    sender = ''
-                    # 获取群聊成员列表
-                    membersMap = self.get_chatroom_member_list(strtalker)
-                    if membersMap is not None:
-                        if wxid in membersMap:
-                            sender = membersMap.get(wxid)
-                        else:
-                            senderinfo = micro_msg_db.get_contact_by_username(wxid)
-                            if senderinfo is not None:
-                                sender = senderinfo[4]
-                                membersMap[wxid] = senderinfo[4]
-                                if len(senderinfo[3]) > 0:
-                                    sender = senderinfo[3]
-                                    membersMap[wxid] = senderinfo[3]
-                    row_list.append(sender)
-            else:
-                if row[4] == 1:
-                    row_list.append('我')
+                        # 解析BytesExtra
+                        wxid = get_message_extra(row[10]).sender
+                        sender = ''
+                        # 获取群聊成员列表
+                        membersMap = self.get_chatroom_member_list(strtalker)
+                        if membersMap is not None:
+                            if wxid in membersMap:
+                                sender = membersMap.get(wxid)
+                            else:
+                                senderinfo = contact_index.get(wxid)
+                                if senderinfo is not None:
+                                    sender = senderinfo[4]
+                                    membersMap[wxid] = senderinfo[4]
+                                    if len(senderinfo[3]) > 0:
+                                        sender = senderinfo[3]
+                                        membersMap[wxid] = senderinfo[3]
+                        row_list.append(sender)
                 else:
-                    if info is not None:
-                        row_list.append(info[4])
+                    if row[4] == 1:
+                        row_list.append('我')
                     else:
-                        row_list.append('')
-            updated_messages.append(tuple(row_list))
-        return updated_messages
+                        if info is not None:
+                            row_list.append(info[4])
+                        else:
+                            row_list.append('')
+                yield tuple(row_list)
 
     def get_package_message_by_wxid(self, chatroom_wxid):
         '''
@@ -122,34 +118,12 @@ class PackageMsg:
                 message.append(ContactDefault(wxid))
                 updated_messages.append(message)
                 continue
-            msgbytes = MessageBytesExtra()
-            msgbytes.ParseFromString(message[10])
-            wxid = ''
-            for tmp in msgbytes.message2:
-                if tmp.field1 != 1:
-                    continue
-                wxid = tmp.field2
+            wxid = get_message_extra(message[10]).sender
             if wxid == "":  # 系统消息里面 wxid 不存在
                 message.append(ContactDefault(wxid))
                 updated_messages.append(message)
                 continue
-            contact_info_list = micro_msg_db.get_contact_by_username(wxid)
-            if contact_info_list is None:  # 群聊中已退群的联系人不会保存在数据库里
-                message.append(ContactDefault(wxid))
-                updated_messages.append(message)
-                continue
-            contact_info = {
-                'UserName': contact_info_list[0],
-                'Alias': contact_info_list[1],
-                'Type': contact_info_list[2],
-                'Remark': contact_info_list[3],
-                'NickName': contact_info_list[4],
-                'smallHeadImgUrl': contact_info_list[7]
-            }
-            contact = Contact(contact_info)
-            contact.smallHeadImgBLOG = misc_db.get_avatar_buffer(contact.wxid)
-            contact.set_avatar(contact.smallHeadImgBLOG)
-            message.append(contact)
+            message.append(contact_cache.get(wxid))
             updated_messages.append(tuple(message))
         return updated_messages
 
@@ -0,0 +1,105 @@
+import os.path
+import pathlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 只读连接的调优参数
+PRAGMAS = [
+    'PRAGMA mmap_size=268435456;',  # 256MB 内存映射
+    'PRAGMA cache_size=-65536;',  # 64MB 页缓存
+    'PRAGMA temp_store=MEMORY;',
+    'PRAGMA query_only=1;',
+]
+
+
+def readonly_uri(db_path, immutable=True) -> str:
+    return pathlib.Path(os.path.abspath(db_path)).as_uri() + ('?mode=ro&immutable=1' if immutable else '?mode=ro')
+
+
+class ConnectionPool:
+    """
+    只读 SQLite 连接池
+    每个线程在使用期间独占一个 mode=ro&immutable=1 的连接，互不加锁，
+    用完后归还到空闲列表供后续线程复用。
+    同一线程内嵌套使用（比如遍历游标时再查询）会复用同一个连接，所有使用者都结束后才归还。
+    数据库文件被重新解密/合并前必须调用 close()，否则 immutable 连接读到的是旧页
+    """
+
+    def __init__(self, db_path, max_idle=8, init=None, immutable=True):
+        """
+        @param db_path:
+        @param max_idle: 最多保留的空闲连接数
+        @param init: 新建连接后调用 init(conn)，比如附加其它数据库、注册自定义函数
+        @param immutable: 为 False 时按普通只读方式打开，读取时加共享锁，能看到其它连接之后提交的数据，
+            用于打开期间会被后台线程更新的数据库（比如全文索引）
+        """
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.init = init
+        self.immutable = immutable
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = readonly_uri(self.db_path, self.immutable)
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        if self.init:
+            self.init(conn)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        with self._lock:
+            generation = self._generation
+            if self._idle:
+                return self._idle.pop(), generation
+        return self._connect(), generation
+
+    def _release(self, conn, generation):
+        with self._lock:
+            if generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        if not getattr(local, 'depth', 0):
+            local.conn, local.generation = self._acquire()
+            local.depth = 0
+        conn = local.conn
+        local.depth += 1
+        try:
+            yield conn
+        finally:
+            # 引用计数而不是嵌套层数：fetch_batches 之类的生成器跨 yield 持有连接，
+            # 关闭顺序不一定和打开顺序相反，最后一个使用者结束时才归还
+            local.depth -= 1
+            if not local.depth:
+                generation = local.generation
+                local.conn, local.generation = None, None
+                self._release(conn, generation)
+
+    @contextmanager
+    def cursor(self):
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            try:
+                yield cursor
+            finally:
+                cursor.close()
+
+    def close(self):
+        """
+        关闭所有空闲连接，正在使用的连接归还时关闭
+        """
+        with self._lock:
+            self._generation += 1
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
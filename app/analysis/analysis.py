@@ -1,12 +1,9 @@
 import os
 from collections import Counter
-import sys
 from datetime import datetime
 from typing import List
 
-import jieba
-
-from app.DataBase import msg_db, MsgType
+from app.DataBase import msg_db, msg_stats_db, msg_words_db, MsgType
 from pyecharts import options as opts
 from pyecharts.charts import WordCloud, Calendar, Bar, Line, Pie, Map
 
@@ -17,44 +14,15 @@ os.makedirs('./data/聊天统计/', exist_ok=True)
 
 
 def wordcloud_(wxid, time_range=None):
-    import jieba
-    txt_messages = msg_db.get_messages_by_type(wxid, MsgType.TEXT, time_range=time_range)
-    if not txt_messages:
+    # 词频在合并数据库时已经按天统计好，这里只需要按时间范围加起来
+    text_data = msg_words_db.get_top_words(wxid, time_range=time_range, top_n=100)
+    if not text_data:
         return {
             'chart_data': None,
             'keyword': "没有聊天你想分析啥",
             'max_num': "0",
             'dialogs': []
         }
-    # text = ''.join(map(lambda x: x[7], txt_messages))
-    text = ''.join(map(lambda x: x[7], txt_messages))  # 1“我”说的话，0“Ta”说的话
-
-    total_msg_len = len(text)
-    # 使用jieba进行分词，并加入停用词
-    words = jieba.cut(text)
-    # 统计词频
-    word_count = Counter(words)
-    # 过滤停用词
-    stopwords_file = './app/data/stopwords.txt'
-    with open(stopwords_file, "r", encoding="utf-8") as stopword_file:
-        stopwords1 = set(stopword_file.read().splitlines())
-    # 构建 FFmpeg 可执行文件的路径
-    stopwords = set()
-    stopwords_file = './app/resources/data/stopwords.txt'
-    if not os.path.exists(stopwords_file):
-        resource_dir = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
-        stopwords_file = os.path.join(resource_dir, 'app', 'resources', 'data', 'stopwords.txt')
-    with open(stopwords_file, "r", encoding="utf-8") as stopword_file:
-        stopwords = set(stopword_file.read().splitlines())
-        stopwords = stopwords.union(stopwords1)
-    filtered_word_count = {word: count for word, count in word_count.items() if len(word) > 1 and word not in stopwords}
-
-    # 转换为词云数据格式
-    data = [(word, count) for word, count in filtered_word_count.items()]
-    # text_data = data
-    data.sort(key=lambda x: x[1], reverse=True)
-
-    text_data = data[:100] if len(data) > 100 else data
     # 创建词云图
     keyword, max_num = text_data[0]
     w = (
@@ -70,34 +38,10 @@ def wordcloud_(wxid, time_range=None):
     }
 
 
-def get_wordcloud(text):
-    total_msg_len = len(text)
-    jieba.load_userdict('./app/data/new_words.txt')
-    # 使用jieba进行分词，并加入停用词
-    words = jieba.cut(text)
-    # 统计词频
-    word_count = Counter(words)
-    # 过滤停用词
-    stopwords_file = './app/data/stopwords.txt'
-    with open(stopwords_file, "r", encoding="utf-8") as stopword_file:
-        stopwords1 = set(stopword_file.read().splitlines())
-    # 构建 FFmpeg 可执行文件的路径
-    stopwords = set()
-    stopwords_file = './app/resources/data/stopwords.txt'
-    if not os.path.exists(stopwords_file):
-        resource_dir = getattr(sys, '_MEIPASS', os.path.abspath(os.path.dirname(__file__)))
-        stopwords_file = os.path.join(resource_dir, 'app', 'resources', 'data', 'stopwords.txt')
-    with open(stopwords_file, "r", encoding="utf-8") as stopword_file:
-        stopwords = set(stopword_file.read().splitlines())
-        stopwords = stopwords.union(stopwords1)
-
-    filtered_word_count = {word: count for word, count in word_count.items() if len(word) > 1 and word not in stopwords}
-    # 转换为词云数据格式
-    data = [(word, count) for word, count in filtered_word_count.items()]
-    # text_data = data
-    data.sort(key=lambda x: x[1], reverse=True)
-
-    text_data = data[:100] if len(data) > 100 else data
+def get_wordcloud(text_data):
+    """
+    @param text_data: MsgWords.get_top_words 的结果 [(word, num), ...]
+    """
     # 创建词云图
     if text_data:
         keyword, max_num = text_data[0]
@@ -115,10 +59,9 @@ def get_wordcloud(text):
 
 
 def wordcloud_christmas(wxid,time_range=None, year='2023'):
-    import jieba
-
-    txt_messages = msg_db.get_messages_by_type(wxid, MsgType.TEXT, time_range=time_range)
-    if not txt_messages:
+    total_msg_len = msg_stats_db.get_text_length(wxid, time_range=time_range, contain_reply=False)
+    text_data = msg_words_db.get_top_words(wxid, time_range=time_range, top_n=100)
+    if not text_data:
         return {
             'wordcloud_chart_data': None,
             'keyword': "没有聊天你想分析啥",
@@ -126,9 +69,7 @@ def wordcloud_christmas(wxid,time_range=None, year='2023'):
             'dialogs': [],
             'total_num': 0,
         }
-    text = ''.join(map(lambda x: x[7], txt_messages))
-    total_msg_len = len(text)
-    wordcloud_data = get_wordcloud(text)
+    wordcloud_data = get_wordcloud(text_data)
     # return w.render_embed()
     keyword = wordcloud_data.get('keyword')
     max_num = wordcloud_data.get('keyword_max_num')
@@ -144,7 +85,7 @@ def wordcloud_christmas(wxid,time_range=None, year='2023'):
 
 
 def calendar_chart(wxid, time_range=None):
-    calendar_data = msg_db.get_messages_by_days(wxid, time_range)
+    calendar_data = msg_stats_db.get_messages_by_days(wxid, time_range)
     if not calendar_data:
         return {
             'chart_data': None,
@@ -189,7 +130,7 @@ def month_count(wxid, time_range=None):
     """
     每月聊天条数
     """
-    msg_data = msg_db.get_messages_by_month(wxid, time_range)
+    msg_data = msg_stats_db.get_messages_by_month(wxid, time_range)
     y_data = list(map(lambda x: x[1], msg_data))
     x_axis = list(map(lambda x: x[0], msg_data))
     m = (
@@ -446,35 +387,18 @@ def contacts_analysis(contacts):
 
 
 def my_message_counter(time_range, my_name=''):
-    msg_data = msg_db.get_messages_all(time_range=time_range)
+    # 条数、字数和词频都直接查预先统计好的表
     types_count = {}
-    send_num = 0  # 发送消息的数量
-    weekday_count = {}
-    str_content = ''
-    total_text_num = 0
-    for message in msg_data:
-        type_ = message[2]
-        is_sender = message[4]
-        subType = message[3]
-        timestamp = message[5]
-        weekday = get_weekday(timestamp)
-        str_time = message[8]
-        send_num += is_sender
+    msg_num = 0
+    for type_, subType, num in msg_stats_db.get_messages_type_number(time_range):
+        msg_num += num
         type_ = f'{type_}{subType:0>2d}' if subType != 0 else type_
         type_ = int(type_)
-        if type_ in types_count:
-            types_count[type_] += 1
-        else:
-            types_count[type_] = 1
-        if weekday in weekday_count:
-            weekday_count[weekday] += 1
-        else:
-            weekday_count[weekday] = 1
-        if type_ == 1:
-            total_text_num += len(message[7])
-            if is_sender == 1:
-                str_content += message[7]
-    receive_num = len(msg_data) - send_num
+        types_count[type_] = types_count.get(type_, 0) + num
+    send_num = msg_stats_db.get_send_messages_number_sum(time_range)  # 发送消息的数量
+    total_text_num = msg_stats_db.get_text_length(time_range=time_range, contain_reply=False)
+    send_words = msg_words_db.get_top_words(time_range=time_range, is_sender=1, top_n=100)
+    receive_num = msg_num - send_num
     data = [[types_.get(key), value] for key, value in types_count.items() if key in types_]
     if not data:
         return {
@@ -509,7 +433,7 @@ def my_message_counter(time_range, my_name=''):
         .set_series_opts(label_opts=opts.LabelOpts(formatter="{b}: {c}\n{d}%", position='inside'))
         # .render("./data/聊天统计/pie_scroll_legend.html")
     )
-    w = get_wordcloud(str_content)
+    w = get_wordcloud(send_words)
     return {
         'chart_data_sender': p2.dump_options_with_quotes(),
         'chart_data_types': p1.dump_options_with_quotes(),
@@ -0,0 +1,93 @@
+import threading
+from collections import deque
+
+from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtWidgets import QListWidget
+
+from app.DataBase import misc_db
+from app.util.avatar import get_avatar_path
+
+
+class AvatarLoadThread(QThread):
+    """
+    后台逐个读取联系人头像
+    联系人列表先只显示名字，头像按行号顺序在这里加载；
+    prioritize() 传入当前可见的行，这些行会插队先加载。
+    解码和写磁盘缓存在后台线程完成，UI 线程收到 avatarLoaded 后只需要从缓存取出 QPixmap
+    """
+    avatarLoaded = pyqtSignal(int, bytes)
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.wxids = []
+        self.queue = deque()
+        self.urgent = deque()
+        self.done = set()
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def add(self, wxid) -> int:
+        """
+        添加一个联系人，返回它的行号
+        """
+        with self.cond:
+            row = len(self.wxids)
+            self.wxids.append(wxid)
+            self.queue.append(row)
+            self.cond.notify()
+        return row
+
+    def prioritize(self, rows):
+        with self.cond:
+            self.urgent.extendleft(reversed([row for row in rows if row not in self.done]))
+            self.cond.notify()
+
+    def prioritize_visible(self, list_widget: QListWidget, offset=0):
+        """
+        优先加载列表里当前可见的行
+        @param list_widget:
+        @param offset: 列表前面不需要加载头像的行数，比如聊天界面的 AI 小助手
+        """
+        viewport = list_widget.viewport().rect()
+        first = list_widget.indexAt(viewport.topLeft()).row()
+        if first < 0:
+            return
+        last = list_widget.indexAt(viewport.bottomLeft()).row()
+        if last < 0:
+            last = list_widget.count() - 1
+        self.prioritize([row - offset for row in range(first, last + 1) if row >= offset])
+
+    def finish(self):
+        """
+        所有联系人都已添加，队列取空后线程退出
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def stop(self):
+        self.requestInterruption()
+        self.finish()
+
+    def _next(self):
+        for queue in (self.urgent, self.queue):
+            while queue:
+                row = queue.popleft()
+                if row not in self.done:
+                    self.done.add(row)
+                    return row
+        return None
+
+    def run(self) -> None:
+        while not self.isInterruptionRequested():
+            with self.cond:
+                row = self._next()
+                while row is None:
+                    if self.closed:
+                        return
+                    self.cond.wait()
+                    row = self._next()
+                wxid = self.wxids[row]
+            img_bytes = misc_db.get_avatar_buffer(wxid) or b''
+            get_avatar_path(img_bytes)
+            self.avatarLoaded.emit(row, img_bytes)
@@ -14,6 +14,7 @@ from app.components.scroll_bar import ScrollBar
 class MessageType:
     Text = 1
     Image = 3
+    Notice = 10000
 
 
 class TextMessage(QLabel):
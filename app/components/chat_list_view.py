@@ -0,0 +1,346 @@
+import os.path
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QRect, QObject, QRunnable, QThreadPool, \
+    pyqtSignal
+from PyQt5.QtGui import QPainter, QFont, QColor, QPixmap, QImage, QPolygon, QFontMetrics
+from PyQt5.QtWidgets import QListView, QStyledItemDelegate, QAbstractItemView, QMenu, QApplication
+
+from app.components.bubble_message import MessageType, OpenImageThread
+from app.components.scroll_bar import ScrollBar
+
+AVATAR_SIZE = 45
+MARGIN = 5
+TRIANGLE_WIDTH = 6
+PADDING = 10
+NAME_HEIGHT = 20
+MAX_TEXT_WIDTH = 800
+IMAGE_SIZE = QSize(480, 240)
+PLACEHOLDER_SIZE = QSize(120, 90)
+SEND_COLOR = QColor('#b2e281')
+RECEIVE_COLOR = QColor('white')
+
+
+class ImageLoadTask(QRunnable):
+    """
+    在线程池里读取并缩放图片，QImage 可以在非 UI 线程使用，转换成 QPixmap 放到 UI 线程里做
+    """
+
+    def __init__(self, cache, path, size):
+        super().__init__()
+        self.cache = cache
+        self.path = path
+        self.size = size
+
+    def run(self):
+        image = QImage(self.path) if os.path.exists(self.path) else QImage()
+        if not image.isNull() and (image.width() > self.size.width() or image.height() > self.size.height()):
+            image = image.scaled(self.size, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.cache.imageLoaded.emit(self.path, self.size, image)
+
+
+class PixmapCache(QObject):
+    """
+    聊天界面的图片缓存
+    只有绘制到的消息才会加载图片，解码和缩放在后台线程完成；
+    按最近绘制的顺序淘汰，滚出屏幕很久的图片会被释放，内存占用有上限
+    """
+    imageLoaded = pyqtSignal(str, QSize, QImage)
+    pixmapReady = pyqtSignal(str)
+
+    def __init__(self, maxsize=256, parent=None):
+        super().__init__(parent)
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._pending = set()
+        # 解码后的尺寸，图片被淘汰后仍保留，重新加载前也能算出消息高度
+        self.image_sizes = {}
+        self.imageLoaded.connect(self._on_loaded)
+
+    def get(self, path, size: QSize):
+        """
+        获取缩放后的图片，没有加载过时返回 None 并在后台加载，加载完成后发出 pixmapReady
+        """
+        if not path:
+            return None
+        key = (path, size.width(), size.height())
+        pixmap = self._cache.get(key)
+        if pixmap is not None:
+            self._cache.move_to_end(key)
+            return pixmap
+        if key not in self._pending:
+            self._pending.add(key)
+            QThreadPool.globalInstance().start(ImageLoadTask(self, path, size))
+        return None
+
+    def _on_loaded(self, path, size, image):
+        key = (path, size.width(), size.height())
+        self._pending.discard(key)
+        pixmap = QPixmap.fromImage(image)
+        self._cache[key] = pixmap
+        if len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+        self.image_sizes[key] = pixmap.size()
+        self.pixmapReady.emit(path)
+
+    def clear(self):
+        self._cache.clear()
+
+
+_pixmap_cache = None
+
+
+def get_pixmap_cache() -> PixmapCache:
+    global _pixmap_cache
+    if _pixmap_cache is None:
+        _pixmap_cache = PixmapCache()
+    return _pixmap_cache
+
+
+class ChatListModel(QAbstractListModel):
+    """
+    聊天记录模型，每一行是一个 dict：
+        type: MessageType.Text / MessageType.Image / MessageType.Notice
+        content: 文本内容或图片路径
+        avatar: 头像路径、QPixmap 或联系人（绘制时才取联系人的 avatar，头像后台加载完成后重绘即可显示）
+        is_send: 是否自己发送
+        display_name: 群聊里显示的发送人名字
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.items = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.items)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        item = self.items[index.row()]
+        if role == Qt.UserRole:
+            return item
+        if role == Qt.DisplayRole and item['type'] != MessageType.Image:
+            return item['content']
+        return None
+
+    def prepend(self, items):
+        """
+        在顶部插入更早的消息
+        """
+        if not items:
+            return
+        self.beginInsertRows(QModelIndex(), 0, len(items) - 1)
+        self.items[0:0] = items
+        self.endInsertRows()
+
+    def clear(self):
+        self.beginResetModel()
+        self.items = []
+        self.endResetModel()
+
+
+class ChatItemDelegate(QStyledItemDelegate):
+    """
+    直接绘制头像、气泡、文字和图片，不为每条消息创建控件
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.font = QFont('微软雅黑', 12)
+        self.name_font = QFont('微软雅黑', 10)
+        self.notice_font = QFont('微软雅黑', 10)
+        self.metrics = QFontMetrics(self.font)
+        self.notice_metrics = QFontMetrics(self.notice_font)
+
+    def view_width(self):
+        return self.parent().viewport().width()
+
+    def text_rect(self, item, width) -> QSize:
+        """
+        文本气泡的大小，按视图宽度缓存在消息里
+        """
+        cached = item.get('_size')
+        if cached and cached[0] == width:
+            return cached[1]
+        max_width = min(MAX_TEXT_WIDTH, width - 2 * (MARGIN + AVATAR_SIZE + TRIANGLE_WIDTH) - AVATAR_SIZE)
+        max_width = max(max_width - 2 * PADDING, 50)
+        rect = self.metrics.boundingRect(QRect(0, 0, max_width, 0), Qt.TextWordWrap, item['content'])
+        size = QSize(rect.width() + 2 * PADDING, max(rect.height() + 2 * PADDING, AVATAR_SIZE))
+        item['_size'] = (width, size)
+        return size
+
+    def image_size(self, item) -> QSize:
+        cache = get_pixmap_cache()
+        key = (item['content'], IMAGE_SIZE.width(), IMAGE_SIZE.height())
+        return cache.image_sizes.get(key, PLACEHOLDER_SIZE)
+
+    def content_size(self, item, width) -> QSize:
+        if item['type'] == MessageType.Text:
+            return self.text_rect(item, width)
+        return self.image_size(item)
+
+    def sizeHint(self, option, index):
+        item = index.data(Qt.UserRole)
+        width = self.view_width()
+        if item['type'] == MessageType.Notice:
+            rect = self.notice_metrics.boundingRect(QRect(0, 0, width, 0), Qt.AlignCenter | Qt.TextWordWrap,
+                                                    item['content'])
+            return QSize(width, rect.height() + 2 * MARGIN)
+        height = self.content_size(item, width).height() + (NAME_HEIGHT if item.get('display_name') else 0)
+        return QSize(width, max(height, AVATAR_SIZE) + 2 * MARGIN)
+
+    def content_rect(self, item, rect: QRect) -> QRect:
+        """
+        气泡或图片在视图里的位置，绘制和点击判断共用
+        """
+        size = self.content_size(item, rect.width())
+        top = rect.top() + MARGIN + (NAME_HEIGHT if item.get('display_name') else 0)
+        if item['is_send']:
+            left = rect.right() - MARGIN - AVATAR_SIZE - TRIANGLE_WIDTH - size.width()
+        else:
+            left = rect.left() + MARGIN + AVATAR_SIZE + TRIANGLE_WIDTH
+        return QRect(left, top, size.width(), size.height())
+
+    @staticmethod
+    def avatar_pixmap(avatar):
+        """
+        联系人的头像已经是解码好的 QPixmap，直接绘制；图片路径交给图片缓存在后台解码
+        @return: 还没加载好或者是空图片时返回 None，绘制占位色块
+        """
+        if not isinstance(avatar, (QPixmap, str)):
+            # 联系人对象，取当前的头像
+            avatar = getattr(avatar, 'avatar', None)
+        if isinstance(avatar, QPixmap):
+            return None if avatar.isNull() else avatar
+        if not isinstance(avatar, str):
+            return None
+        return get_pixmap_cache().get(avatar, QSize(AVATAR_SIZE, AVATAR_SIZE))
+
+    def paint(self, painter: QPainter, option, index):
+        item = index.data(Qt.UserRole)
+        rect = option.rect
+        painter.save()
+        painter.setRenderHint(QPainter.Antialiasing)
+        if item['type'] == MessageType.Notice:
+            painter.setFont(self.notice_font)
+            painter.drawText(rect, Qt.AlignCenter | Qt.TextWordWrap, item['content'])
+            painter.restore()
+            return
+        cache = get_pixmap_cache()
+        is_send = item['is_send']
+        avatar_left = rect.right() - MARGIN - AVATAR_SIZE if is_send else rect.left() + MARGIN
+        avatar_rect = QRect(avatar_left, rect.top() + MARGIN, AVATAR_SIZE, AVATAR_SIZE)
+        avatar = self.avatar_pixmap(item['avatar'])
+        if avatar is not None:
+            painter.drawPixmap(avatar_rect, avatar)
+        else:
+            painter.fillRect(avatar_rect, QColor('#dddddd'))
+
+        content_rect = self.content_rect(item, rect)
+        if item.get('display_name'):
+            painter.setFont(self.name_font)
+            name_rect = QRect(rect.left() + MARGIN + AVATAR_SIZE + TRIANGLE_WIDTH, rect.top() + MARGIN,
+                              rect.width() - 2 * (MARGIN + AVATAR_SIZE + TRIANGLE_WIDTH), NAME_HEIGHT)
+            painter.drawText(name_rect, (Qt.AlignRight if is_send else Qt.AlignLeft) | Qt.AlignVCenter,
+                             item['display_name'])
+
+        if item['type'] == MessageType.Text:
+            color = SEND_COLOR if is_send else RECEIVE_COLOR
+            painter.setPen(color)
+            painter.setBrush(color)
+            painter.drawRoundedRect(content_rect, 10, 10)
+            y = content_rect.top()
+            triangle = QPolygon()
+            if is_send:
+                x = content_rect.right() + 1
+                triangle.setPoints(x, 20 + y, x, 34 + y, x + TRIANGLE_WIDTH, 27 + y)
+            else:
+                x = content_rect.left()
+                triangle.setPoints(x, 20 + y, x, 34 + y, x - TRIANGLE_WIDTH, 27 + y)
+            painter.drawPolygon(triangle)
+            painter.setPen(QColor('black'))
+            painter.setFont(self.font)
+            painter.drawText(content_rect.adjusted(PADDING, PADDING, -PADDING, -PADDING), Qt.TextWordWrap,
+                             item['content'])
+        else:
+            pixmap = cache.get(item['content'], IMAGE_SIZE)
+            if pixmap is not None and not pixmap.isNull():
+                painter.drawPixmap(content_rect.topLeft(), pixmap)
+            else:
+                painter.fillRect(content_rect, QColor('#eeeeee'))
+        painter.restore()
+
+
+class ChatListView(QListView):
+    """
+    聊天记录列表，只绘制可见的消息，图片在后台线程按需解码
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.chat_model = ChatListModel(self)
+        self.delegate = ChatItemDelegate(self)
+        self.setModel(self.chat_model)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollBar(ScrollBar())
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setSelectionMode(QAbstractItemView.NoSelection)
+        self.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.setResizeMode(QListView.Adjust)
+        self.setLayoutMode(QListView.Batched)
+        self.setStyleSheet(
+            '''
+            border:none;
+            '''
+        )
+        self.open_image_thread = None
+        get_pixmap_cache().pixmapReady.connect(self.on_pixmap_ready)
+
+    def prepend_messages(self, items):
+        self.chat_model.prepend(items)
+
+    def on_pixmap_ready(self, path):
+        # 图片解码后尺寸可能和占位图不同，重新计算布局
+        if any(item['type'] == MessageType.Image and item['content'] == path for item in self.visible_items()):
+            self.scheduleDelayedItemsLayout()
+        self.viewport().update()
+
+    def visible_items(self):
+        first = self.indexAt(self.viewport().rect().topLeft())
+        last = self.indexAt(self.viewport().rect().bottomLeft())
+        if not first.isValid():
+            return []
+        end = last.row() if last.isValid() else self.chat_model.rowCount() - 1
+        return self.chat_model.items[first.row():end + 1]
+
+    def set_scroll_bar_value(self, val):
+        self.doItemsLayout()
+        self.verticalScrollBar().setValue(val)
+
+    def mousePressEvent(self, event):
+        super().mousePressEvent(event)
+        if event.button() != Qt.LeftButton:
+            return
+        index = self.indexAt(event.pos())
+        if not index.isValid():
+            return
+        item = index.data(Qt.UserRole)
+        if item['type'] == MessageType.Image and \
+                self.delegate.content_rect(item, self.visualRect(index)).contains(event.pos()):
+            print('打开图像', item['content'])
+            self.open_image_thread = OpenImageThread(item['content'])
+            self.open_image_thread.start()
+
+    def contextMenuEvent(self, event):
+        index = self.indexAt(event.pos())
+        if not index.isValid():
+            return
+        item = index.data(Qt.UserRole)
+        if item['type'] == MessageType.Image:
+            return
+        menu = QMenu(self)
+        copy_action = menu.addAction('复制')
+        if menu.exec_(event.globalPos()) == copy_action:
+            QApplication.clipboard().setText(item['content'])
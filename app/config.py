@@ -33,6 +33,7 @@ os.makedirs(OUTPUT_DIR, exist_ok=True)
 # 全局参数
 SEND_LOG_FLAG = False  # 是否发送错误日志
 SERVER_API_URL = None   #'http://api.lc044.love'  # api接口
+CHAT_PAGE_SIZE = 50  # 聊天界面每次向上滚动加载的消息条数
 
 # 硅基流动API配置
 import json
@@ -16,7 +16,11 @@
 import argparse
 import hmac
 import hashlib
+import mmap
 import os
+import struct
+from concurrent.futures import Executor, ProcessPoolExecutor
+from functools import lru_cache
 from typing import Union, List
 from Cryptodome.Cipher import AES
 
@@ -29,15 +33,164 @@ DEFAULT_PAGESIZE = 4096
 DEFAULT_ITER = 64000
 
 
-# 通过密钥解密数据库
-def decrypt(key: str, db_path, out_path):
+# 每个子任务解密的页数（16MB），决定并行粒度和单个子进程的内存占用
+PAGES_PER_TASK = 4096
+
+# 增量解密的页清单，保存在解密后的数据库旁边
+# 文件头：魔数、盐值、密钥指纹、解密后文件的大小和修改时间；之后是每一页末尾的 20 字节 HMAC
+MANIFEST_SUFFIX = '.pages'
+MANIFEST_HEADER = struct.Struct('<5s16s20sQQ')
+MANIFEST_MAGIC = b'WXPM\x01'
+HMAC_SIZE = 20
+
+
+@lru_cache(maxsize=1024)
+def derive_keys(password: bytes, salt: bytes):
     """
-    通过密钥解密数据库
-    :param key: 密钥 64位16进制字符串
-    :param db_path:  待解密的数据库路径(必须是文件)
-    :param out_path:  解密后的数据库输出路径(必须是文件)
+    由主密钥和盐值计算页解密密钥和 HMAC 密钥
+    结果按 (主密钥, 盐值) 缓存，同一个数据库重复解密、校验时不再做 64000 次迭代
+    :param password: 主密钥
+    :param salt: 数据库前 16 字节
+    :return: (byteKey, mac_key)
+    """
+    byteKey = hashlib.pbkdf2_hmac("sha1", password, salt, DEFAULT_ITER, KEY_SIZE)
+    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
+    mac_key = hashlib.pbkdf2_hmac("sha1", byteKey, mac_salt, 2, KEY_SIZE)
+    return byteKey, mac_key
+
+
+def decrypt_pages(byteKey: bytes, db_path, out_path, start: int, end: int):
+    """
+    解密第 [start, end) 页并写入输出文件的对应位置
+    输入文件通过 mmap 读取，输出文件需要提前分配好大小，多个进程可以同时写同一个文件的不同区间
+    :param byteKey: 页解密密钥
+    :param db_path: 待解密的数据库路径
+    :param out_path: 解密后的数据库路径
+    :param start: 起始页
+    :param end: 结束页（不包含）
+    :return: 解密的页数
+    """
+    with open(db_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as blist:
+        decrypted = bytearray()
+        for i in range(start, end):
+            page = blist[i * DEFAULT_PAGESIZE:(i + 1) * DEFAULT_PAGESIZE]
+            if i == 0:
+                # 第一页前 16 字节是盐值，解密后替换成 SQLite 文件头
+                page = page[16:]
+                decrypted += SQLITE_FILE_HEADER.encode()
+            t = AES.new(byteKey, AES.MODE_CBC, page[-48:-32])
+            decrypted += t.decrypt(page[:-48])
+            decrypted += page[-48:]
+    with open(out_path, "r+b") as deFile:
+        deFile.seek(start * DEFAULT_PAGESIZE)
+        deFile.write(decrypted)
+    return end - start
+
+
+def check_first_page(first_page: bytes, password: bytes):
+    """
+    用第一页的 HMAC 校验密钥
+    :param first_page: 加密数据库的第一页
+    :param password: 主密钥
+    :return: 密钥正确返回 byteKey，否则返回 None
+    """
+    salt = first_page[:16]
+    if len(salt) != 16:
+        return None
+    byteKey, mac_key = derive_keys(password, salt)
+    first = first_page[16:DEFAULT_PAGESIZE]
+
+    hash_mac = hmac.new(mac_key, first[:-32], hashlib.sha1)
+    hash_mac.update(b'\x01\x00\x00\x00')
+
+    if hash_mac.digest() != first[-32:-12]:
+        return None
+    return byteKey
+
+
+def verify_key(password: bytes, db_path) -> bool:
+    """
+    只读取数据库第一页校验密钥
+    :param password: 主密钥（32 字节）
+    :param db_path: 加密的数据库路径
     :return:
     """
+    with open(db_path, "rb") as file:
+        first_page = file.read(DEFAULT_PAGESIZE)
+    return check_first_page(first_page, password) is not None
+
+
+def page_digests(blist, page_num) -> bytes:
+    """
+    取出每一页末尾保存的 HMAC，页密文有任何改动 HMAC 都会不同，不需要再自己计算摘要
+    """
+    digests = bytearray()
+    for i in range(page_num):
+        end = min((i + 1) * DEFAULT_PAGESIZE, len(blist))
+        digests += blist[end - 32:end - 12].ljust(HMAC_SIZE, b'\x00')
+    return bytes(digests)
+
+
+def read_manifest(out_path, salt: bytes, byteKey: bytes):
+    """
+    读取上次解密留下的页清单
+    盐值、密钥或解密后的文件对不上时返回 None，需要全量解密
+    :return: 每一页的 HMAC 拼接成的 bytes
+    """
+    manifest_path = out_path + MANIFEST_SUFFIX
+    if not os.path.exists(manifest_path) or not os.path.exists(out_path):
+        return None
+    with open(manifest_path, "rb") as file:
+        data = file.read()
+    if len(data) < MANIFEST_HEADER.size:
+        return None
+    magic, old_salt, key_digest, out_size, out_mtime = MANIFEST_HEADER.unpack_from(data)
+    stat = os.stat(out_path)
+    if (magic != MANIFEST_MAGIC or old_salt != salt or key_digest != hashlib.sha1(byteKey).digest()
+            or out_size != stat.st_size or out_mtime != stat.st_mtime_ns):
+        return None
+    return data[MANIFEST_HEADER.size:]
+
+
+def write_manifest(out_path, manifest):
+    """
+    解密完成后写入页清单，记录此时解密后文件的大小和修改时间
+    :param manifest: prepare_decrypt 返回的 (盐值, 密钥指纹, 每页 HMAC)，为 None 时不写
+    """
+    if manifest is None:
+        return
+    salt, key_digest, digests = manifest
+    stat = os.stat(out_path)
+    with open(out_path + MANIFEST_SUFFIX, "wb") as file:
+        file.write(MANIFEST_HEADER.pack(MANIFEST_MAGIC, salt, key_digest, stat.st_size, stat.st_mtime_ns))
+        file.write(digests)
+
+
+def changed_ranges(old_digests: bytes, digests: bytes, pages_per_task=PAGES_PER_TASK):
+    """
+    对比新旧页清单，把变化的页合并成连续区间，每个区间不超过 pages_per_task 页
+    """
+    ranges = []
+    start = None
+    for i in range(len(digests) // HMAC_SIZE):
+        offset = i * HMAC_SIZE
+        changed = old_digests[offset:offset + HMAC_SIZE] != digests[offset:offset + HMAC_SIZE]
+        if changed and start is None:
+            start = i
+        elif start is not None and (not changed or i - start >= pages_per_task):
+            ranges.append((start, i))
+            start = i if changed else None
+    if start is not None:
+        ranges.append((start, len(digests) // HMAC_SIZE))
+    return ranges
+
+
+def prepare_decrypt(key: str, db_path, out_path, incremental=False):
+    """
+    校验密钥并为输出文件预分配空间
+    增量模式下对比上次的页清单，只返回密文有变化的页区间，输出文件原地修补
+    :return: (True, (byteKey, 待解密的页区间, 页清单)) 或 (False, 错误信息)，非增量模式页清单为 None
+    """
     if not os.path.exists(db_path) or not os.path.isfile(db_path):
         return False, f"[-] db_path:'{db_path}' File not found!"
     if not os.path.exists(os.path.dirname(out_path)):
@@ -47,40 +200,111 @@ def decrypt(key: str, db_path, out_path):
         return False, f"[-] key:'{key}' Len Error!"
 
     password = bytes.fromhex(key.strip())
+    file_size = os.path.getsize(db_path)
     with open(db_path, "rb") as file:
-        blist = file.read()
+        first_page = file.read(DEFAULT_PAGESIZE)
 
-    salt = blist[:16]
-    byteKey = hashlib.pbkdf2_hmac("sha1", password, salt, DEFAULT_ITER, KEY_SIZE)
-    first = blist[16:DEFAULT_PAGESIZE]
-    if len(salt) != 16:
+    if len(first_page) < 16:
         return False, f"[-] db_path:'{db_path}' File Error!"
-
-    mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
-    mac_key = hashlib.pbkdf2_hmac("sha1", byteKey, mac_salt, 2, KEY_SIZE)
-    hash_mac = hmac.new(mac_key, first[:-32], hashlib.sha1)
-    hash_mac.update(b'\x01\x00\x00\x00')
-
-    if hash_mac.digest() != first[-32:-12]:
+    byteKey = check_first_page(first_page, password)
+    if byteKey is None:
         return False, f"[-] Key Error! (key:'{key}'; db_path:'{db_path}'; out_path:'{out_path}' )"
 
-    newblist = [blist[i:i + DEFAULT_PAGESIZE] for i in range(DEFAULT_PAGESIZE, len(blist), DEFAULT_PAGESIZE)]
+    page_num = (file_size + DEFAULT_PAGESIZE - 1) // DEFAULT_PAGESIZE
+    salt = first_page[:16]
+    manifest = old_digests = None
+    if incremental:
+        # 只有增量模式才需要读取每一页的 HMAC，全量解密不额外读一遍密文
+        with open(db_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as blist:
+            digests = page_digests(blist, page_num)
+        manifest = (salt, hashlib.sha1(byteKey).digest(), digests)
+        old_digests = read_manifest(out_path, salt, byteKey)
+    # 先删掉旧清单，解密中途失败时下次会全量解密
+    if os.path.exists(out_path + MANIFEST_SUFFIX):
+        os.remove(out_path + MANIFEST_SUFFIX)
+    if old_digests is None:
+        with open(out_path, "wb") as deFile:
+            deFile.truncate(file_size)
+        return True, (byteKey, page_ranges(page_num), manifest)
+    ranges = changed_ranges(old_digests, digests)
+    if os.path.getsize(out_path) != file_size:
+        with open(out_path, "r+b") as deFile:
+            deFile.truncate(file_size)
+    return True, (byteKey, ranges, manifest)
+
+
+def page_ranges(page_num, pages_per_task=PAGES_PER_TASK):
+    return [(start, min(start + pages_per_task, page_num)) for start in range(0, page_num, pages_per_task)]
 
-    with open(out_path, "wb") as deFile:
-        deFile.write(SQLITE_FILE_HEADER.encode())
-        t = AES.new(byteKey, AES.MODE_CBC, first[-48:-32])
-        decrypted = t.decrypt(first[:-48])
-        deFile.write(decrypted)
-        deFile.write(first[-48:])
 
-        for i in newblist:
-            t = AES.new(byteKey, AES.MODE_CBC, i[-48:-32])
-            decrypted = t.decrypt(i[:-48])
-            deFile.write(decrypted)
-            deFile.write(i[-48:])
+# 通过密钥解密数据库
+def decrypt(key: str, db_path, out_path, executor: Executor = None, incremental=False):
+    """
+    通过密钥解密数据库
+    :param key: 密钥 64位16进制字符串
+    :param db_path:  待解密的数据库路径(必须是文件)
+    :param out_path:  解密后的数据库输出路径(必须是文件)
+    :param executor: 进程池，传入时按页区间并行解密
+    :param incremental: 只解密上次解密之后有变化的页
+    :return:
+    """
+    code, ret = prepare_decrypt(key, db_path, out_path, incremental)
+    if not code:
+        return False, ret
+    byteKey, ranges, manifest = ret
+    if executor is None:
+        for start, end in ranges:
+            decrypt_pages(byteKey, db_path, out_path, start, end)
+    else:
+        futures = [executor.submit(decrypt_pages, byteKey, db_path, out_path, start, end)
+                   for start, end in ranges]
+        for future in futures:
+            future.result()
+    write_manifest(out_path, manifest)
     return True, [db_path, out_path, key]
 
 
+def decrypt_files(tasks, max_workers=None, callback=None, incremental=False, executor: Executor = None):
+    """
+    用进程池同时解密多个数据库，所有文件的页区间共用一个进程池
+    :param tasks: [[key, db_path, out_path], ...]
+    :param max_workers: 进程数，默认 CPU 核数，传入 executor 时不用
+    :param callback: 每个文件完成后调用 callback(index, result)
+    :param incremental: 只解密上次解密之后有变化的页
+    :param executor: 进程池，不传时临时创建一个，用完关闭
+    :return: 与 tasks 一一对应的 [(code, ret), ...]
+    """
+    if executor is None:
+        max_workers = min(max_workers or os.cpu_count() or 1, 61)  # Windows 下进程池最多 61 个进程
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            return decrypt_files(tasks, callback=callback, incremental=incremental, executor=executor)
+    results = [None] * len(tasks)
+    submitted = []
+    for index, (key, db_path, out_path) in enumerate(tasks):
+        code, ret = prepare_decrypt(key, db_path, out_path, incremental)
+        if not code:
+            results[index] = (False, ret)
+            if callback:
+                callback(index, results[index])
+            continue
+        byteKey, ranges, manifest = ret
+        futures = [executor.submit(decrypt_pages, byteKey, db_path, out_path, start, end)
+                   for start, end in ranges]
+        submitted.append((index, futures, manifest))
+    for index, futures, manifest in submitted:
+        key, db_path, out_path = tasks[index]
+        try:
+            for future in futures:
+                future.result()
+            write_manifest(out_path, manifest)
+            results[index] = (True, [db_path, out_path, key])
+        except Exception as e:
+            results[index] = (False, f"[-] db_path:'{db_path}' Decrypt Error! {e}")
+        if callback:
+            callback(index, results[index])
+    return results
+
+
 def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_logging: bool = False):
     if not isinstance(key, str) or not isinstance(out_path, str) or not os.path.exists(out_path) or len(key) != 64:
         error = f"[-] (key:'{key}' or out_path:'{out_path}') Error!"
@@ -137,9 +361,7 @@ def batch_decrypt(key: str, db_path: Union[str, List[str]], out_path: str, is_lo
         if is_logging: print(error)
         return False, error
 
-    result = []
-    for i in process_list:
-        result.append(decrypt(*i))  # 解密
+    result = decrypt_files(process_list)  # 解密
 
     # 删除空文件夹
     for root, dirs, files in os.walk(out_path, topdown=False):
@@ -21,6 +21,8 @@ from pymem import Pymem
 import pymem
 import hmac
 
+from app.decrypt import decrypt
+
 ReadProcessMemory = ctypes.windll.kernel32.ReadProcessMemory
 void_p = ctypes.c_void_p
 KEY_SIZE = 32
@@ -191,23 +193,7 @@ class BiasAddr:
             return key_bytes
 
         def verify_key(key, wx_db_path):
-            KEY_SIZE = 32
-            DEFAULT_PAGESIZE = 4096
-            DEFAULT_ITER = 64000
-            with open(wx_db_path, "rb") as file:
-                blist = file.read(5000)
-            salt = blist[:16]
-            byteKey = hashlib.pbkdf2_hmac("sha1", key, salt, DEFAULT_ITER, KEY_SIZE)
-            first = blist[16:DEFAULT_PAGESIZE]
-
-            mac_salt = bytes([(salt[i] ^ 58) for i in range(16)])
-            mac_key = hashlib.pbkdf2_hmac("sha1", byteKey, mac_salt, 2, KEY_SIZE)
-            hash_mac = hmac.new(mac_key, first[:-32], hashlib.sha1)
-            hash_mac.update(b'\x01\x00\x00\x00')
-
-            if hash_mac.digest() != first[-32:-12]:
-                return False
-            return True
+            return decrypt.verify_key(key, wx_db_path)
 
         phone_type1 = "iphone\x00"
         phone_type2 = "android\x00"
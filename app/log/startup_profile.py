@@ -0,0 +1,227 @@
+"""
+启动耗时分析
+
+设置环境变量 MEMOTRACE_PROFILE_STARTUP=1 后运行 main.py，会记录：
+    * 每个模块的导入耗时（累计耗时和去掉子模块后的自身耗时）
+    * 主界面第一次绘制完成的时间
+结果写到 ./app/log/logs/startup-profile.json，并在日志里打印最慢的模块。
+
+回归测试：
+    python -m app.log.startup_profile            # 冷启动 N 次，和基准比较，变慢超过阈值时返回非 0
+    python -m app.log.startup_profile --update   # 用本次结果更新基准
+"""
+import json
+import os
+import sys
+import time
+
+ENV_ENABLE = 'MEMOTRACE_PROFILE_STARTUP'
+ENV_QUIT = 'MEMOTRACE_PROFILE_QUIT'  # 第一次绘制后直接退出，基准测试用
+ENV_OUTPUT = 'MEMOTRACE_PROFILE_OUTPUT'
+REPORT_PATH = './app/log/logs/startup-profile.json'
+BASELINE_PATH = './app/log/startup-baseline.json'
+
+
+class StartupProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.imports = {}  # 模块名 -> [累计耗时, 自身耗时]
+        self.marks = {}
+        self._stack = []
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self, name):
+        _, start, children = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self.imports[name] = [elapsed, elapsed - children]
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def mark(self, name):
+        """
+        记录一个时间点，相对于开始记录的时间
+        """
+        self.marks.setdefault(name, time.perf_counter() - self.start)
+
+    def report(self):
+        imports = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'marks_ms': {name: round(value * 1000, 2) for name, value in self.marks.items()},
+            'imports': [
+                {'module': name, 'cumulative_ms': round(total * 1000, 2), 'self_ms': round(self_ * 1000, 2)}
+                for name, (total, self_) in imports
+            ],
+        }
+
+    def dump(self, path=None):
+        path = path or os.environ.get(ENV_OUTPUT) or REPORT_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        report = self.report()
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return report
+
+
+class _TimingLoader:
+    """
+    包装原来的 loader，只在 exec_module 前后计时，其它属性原样转发
+    """
+
+    def __init__(self, loader, profile):
+        self._loader = loader
+        self._profile = profile
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profile.enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profile.exit(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class _TimingFinder:
+    def __init__(self, profile):
+        self.profile = profile
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                spec.loader = _TimingLoader(spec.loader, self.profile)
+            return spec
+        return None
+
+
+profile: StartupProfile = None
+
+
+def enabled() -> bool:
+    return os.environ.get(ENV_ENABLE, '') not in ('', '0')
+
+
+def install():
+    """
+    开始记录导入耗时，要在 main.py 导入其它模块之前调用；没有开启时什么也不做
+    """
+    global profile
+    if profile is not None or not enabled():
+        return
+    profile = StartupProfile()
+    sys.meta_path.insert(0, _TimingFinder(profile))
+
+
+def mark(name):
+    if profile is not None:
+        profile.mark(name)
+
+
+def watch_first_paint(widget):
+    """
+    主界面第一次绘制时记录时间并写出报告
+    """
+    if profile is None:
+        return
+    from PyQt5.QtCore import QObject, QEvent, QTimer
+    from PyQt5.QtWidgets import QApplication
+
+    class FirstPaintFilter(QObject):
+        def eventFilter(self, obj, event):
+            if event.type() == QEvent.Paint:
+                obj.removeEventFilter(self)
+                # 等这一次绘制结束再记录
+                QTimer.singleShot(0, self.finish)
+            return False
+
+        def finish(self):
+            mark('first_paint')
+            finish()
+            if os.environ.get(ENV_QUIT):
+                QApplication.quit()
+
+    widget._first_paint_filter = FirstPaintFilter(widget)
+    widget.installEventFilter(widget._first_paint_filter)
+
+
+def finish(top_n=20):
+    global profile
+    if profile is None:
+        return None
+    for finder in list(sys.meta_path):
+        if isinstance(finder, _TimingFinder):
+            sys.meta_path.remove(finder)
+    report = profile.dump()
+    profile = None
+    from app.log import logger
+    lines = [f"{item['module']:<60}{item['self_ms']:>10.1f}{item['cumulative_ms']:>12.1f}"
+             for item in report['imports'][:top_n]]
+    logger.info(f"启动耗时(ms): {report['marks_ms']}\n"
+                f"{'模块':<58}{'自身':>8}{'累计':>10}\n" + '\n'.join(lines))
+    return report
+
+
+def measure(runs=5, timeout=120):
+    """
+    冷启动 runs 次，每次一个新进程，返回各时间点的最小值
+    """
+    import subprocess
+    import tempfile
+    results = {}
+    for i in range(runs):
+        output = os.path.join(tempfile.gettempdir(), f'startup-profile-{os.getpid()}-{i}.json')
+        env = dict(os.environ, **{ENV_ENABLE: '1', ENV_QUIT: '1', ENV_OUTPUT: output})
+        subprocess.run([sys.executable, 'main.py'], env=env, timeout=timeout, check=True)
+        with open(output, encoding='utf-8') as f:
+            marks = json.load(f)['marks_ms']
+        os.remove(output)
+        for name, value in marks.items():
+            results[name] = min(results.get(name, value), value)
+    return results
+
+
+def check(runs=5, tolerance=0.2, update=False):
+    """
+    和基准比较，任何一个时间点比基准慢 tolerance 以上就失败
+    @return: 是否通过
+    """
+    results = measure(runs)
+    print('本次启动耗时(ms):', results)
+    if update or not os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print('已更新基准', BASELINE_PATH)
+        return True
+    with open(BASELINE_PATH, encoding='utf-8') as f:
+        baseline = json.load(f)
+    ok = True
+    for name, base in baseline.items():
+        value = results.get(name)
+        if value is None:
+            print(f'{name}: 本次没有记录')
+            ok = False
+        elif value > base * (1 + tolerance):
+            print(f'{name}: {value:.1f}ms，比基准 {base:.1f}ms 慢了 {(value / base - 1) * 100:.0f}%')
+            ok = False
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='冷启动耗时回归测试，在项目根目录下运行')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--tolerance', type=float, default=0.2, help='允许变慢的比例')
+    parser.add_argument('--update', action='store_true', help='用本次结果更新基准')
+    args = parser.parse_args()
+    sys.exit(0 if check(args.runs, args.tolerance, args.update) else 1)
@@ -9,6 +9,7 @@ from PyQt5.QtGui import QPixmap
 
 from app.config import INFO_FILE_PATH
 from app.ui.Icon import Icon
+from app.util.avatar import avatar_cache, export_avatar
 
 
 def singleton(cls):
@@ -26,17 +27,18 @@ class Person:
     def __init__(self):
         self.avatar_path = None
         self.avatar = None
+        self.avatar_bytes = b''
         self.avatar_path_qt = Icon.Default_avatar_path
         self.detail = {}
 
     def set_avatar(self, img_bytes):
-        if not img_bytes:
-            self.avatar.load(Icon.Default_avatar_path)
+        self.avatar_bytes = img_bytes
+        # 同样的头像数据共用一个解码后的 QPixmap
+        pixmap = avatar_cache.get(img_bytes)
+        if pixmap is None:
+            self.avatar = QPixmap(Icon.Default_avatar_path)
             return
-        if img_bytes[:4] == b'\x89PNG':
-            self.avatar.loadFromData(img_bytes, format='PNG')
-        else:
-            self.avatar.loadFromData(img_bytes, format='jfif')
+        self.avatar = pixmap
 
     def save_avatar(self, path=None):
         if not self.avatar:
@@ -51,7 +53,9 @@ class Person:
             save_path = os.path.join(f'data/avatar/', self.wxid + '.png')
         self.avatar_path = save_path
         if not os.path.exists(save_path):
-            self.avatar.save(save_path)
+            # 从头像缓存硬链接或复制，默认头像没有数据才重新编码
+            if not export_avatar(self.avatar_bytes, save_path):
+                self.avatar.save(save_path)
             print('保存头像', save_path)
 
 
@@ -1,13 +1,16 @@
 import traceback
 
 from PyQt5.QtCore import QThread, pyqtSignal
-from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QHBoxLayout
+from PyQt5.QtWidgets import QWidget, QVBoxLayout, QLabel, QHBoxLayout, QLineEdit
 
-from app.DataBase import msg_db, hard_link_db
-from app.components.bubble_message import BubbleMessage, ChatWidget, Notice
+from app.DataBase import hard_link_db
+from app.DataBase.msg_pager import MessagePager
+from app.components.bubble_message import MessageType
+from app.components.chat_list_view import ChatListView
+from app.config import CHAT_PAGE_SIZE
 from app.person import Me
 from app.util import get_abs_path
-from app.util.emoji import get_emoji
+from .chat_search import ChatSearchDialog
 
 
 class ChatInfo(QWidget):
@@ -16,25 +19,46 @@ class ChatInfo(QWidget):
         self.last_timestamp = 0
         self.last_str_time = ''
         self.last_pos = 0
+        # 一页消息先按显示顺序收集起来，加载完后一次性插入模型
+        self.pending_items = []
         self.contact = contact
+        self.search_dialog = None
         self.init_ui()
         self.show_chats()
 
     def init_ui(self):
         self.label_reamrk = QLabel(self.contact.remark)
 
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText('搜索聊天记录')
+        self.search_edit.setMaximumWidth(200)
+        self.search_edit.returnPressed.connect(self.search_messages)
+
         self.hBoxLayout = QHBoxLayout()
         self.hBoxLayout.addWidget(self.label_reamrk)
+        self.hBoxLayout.addStretch(1)
+        self.hBoxLayout.addWidget(self.search_edit)
 
         self.vBoxLayout = QVBoxLayout()
         self.vBoxLayout.setSpacing(0)
         self.vBoxLayout.addLayout(self.hBoxLayout)
 
-        self.chat_window = ChatWidget()
-        self.chat_window.scrollArea.verticalScrollBar().valueChanged.connect(self.verticalScrollBar)
+        self.chat_window = ChatListView()
+        self.chat_window.verticalScrollBar().valueChanged.connect(self.verticalScrollBar)
         self.vBoxLayout.addWidget(self.chat_window)
         self.setLayout(self.vBoxLayout)
 
+    def search_messages(self):
+        keyword = self.search_edit.text().strip()
+        if not keyword:
+            return
+        # 同一个聊天共用一个搜索窗口
+        if self.search_dialog is None:
+            self.search_dialog = ChatSearchDialog(self.contact, parent=self)
+        self.search_dialog.set_keyword(keyword)
+        self.search_dialog.show()
+        self.search_dialog.raise_()
+
     def show_chats(self):
         # Me().save_avatar()
         # self.contact.save_avatar()
@@ -44,6 +68,8 @@ class ChatInfo(QWidget):
         # self.show_chat_thread.start()
 
     def show_finish(self, ok):
+        self.chat_window.prepend_messages(self.pending_items)
+        self.pending_items = []
         self.setScrollBarPos()
         self.show_chat_thread.quit()
 
@@ -70,8 +96,7 @@ class ChatInfo(QWidget):
         :param pos:
         :return:
         """
-        self.chat_window.update()
-        self.chat_window.show()
+        self.chat_window.doItemsLayout()
         pos = self.chat_window.verticalScrollBar().maximum() - self.last_pos
         self.chat_window.set_scroll_bar_value(pos)
 
@@ -94,6 +119,20 @@ class ChatInfo(QWidget):
                 avatar = Me().avatar if is_send else self.contact.avatar
         return avatar
 
+    def get_avatar_person(self, is_send, message):
+        """
+        显示头像的联系人，消息里保存联系人本身而不是头像，头像在后台加载完成之后绘制时就是新的
+        """
+        if self.contact.is_chatroom:
+            return message[13]
+        return Me() if is_send else self.contact
+
+    def update_avatar(self):
+        """
+        联系人头像加载完成后重绘可见的消息
+        """
+        self.chat_window.viewport().update()
+
     def get_display_name(self, is_send, message) -> str:
         if self.contact.is_chatroom:
             if is_send:
@@ -104,6 +143,21 @@ class ChatInfo(QWidget):
             display_name = None
         return display_name
 
+    def add_notice(self, text):
+        self.pending_items.insert(0, {
+            'type': MessageType.Notice,
+            'content': text,
+        })
+
+    def add_bubble(self, content, avatar, type_, is_send, display_name=None):
+        self.pending_items.insert(0, {
+            'type': type_,
+            'content': content,
+            'avatar': avatar,
+            'is_send': is_send,
+            'display_name': display_name,
+        })
+
     def add_message(self, message):
         try:
             type_ = message[2]
@@ -111,77 +165,50 @@ class ChatInfo(QWidget):
             str_time = message[8]
             # print(type_, type(type_))
             is_send = message[4]
-            avatar = self.get_avatar_path(is_send, message,True)
+            avatar = self.get_avatar_person(is_send, message)
             display_name = self.get_display_name(is_send, message)
             timestamp = message[5]
             BytesExtra = message[10]
             if type_ == 1:
                 if self.is_5_min(timestamp):
-                    time_message = Notice(self.last_str_time)
+                    self.add_notice(self.last_str_time)
                     self.last_str_time = str_time
-                    self.chat_window.add_message_item(time_message, 0)
-                bubble_message = BubbleMessage(
-                    str_content,
-                    avatar,
-                    type_,
-                    is_send,
-                    display_name=display_name
-                )
-                self.chat_window.add_message_item(bubble_message, 0)
+                if isinstance(str_content, bytes):
+                    str_content = str_content.decode('utf-8')
+                self.add_bubble(str_content, avatar, MessageType.Text, is_send, display_name)
             elif type_ == 3:
                 # return
                 if self.is_5_min(timestamp):
-                    time_message = Notice(self.last_str_time)
+                    self.add_notice(self.last_str_time)
                     self.last_str_time = str_time
-                    self.chat_window.add_message_item(time_message, 0)
+                # 这里只解析路径，图片绘制到时才在后台线程解码
                 image_path = hard_link_db.get_image(content=str_content, bytesExtra=BytesExtra, up_dir=Me().wx_dir,thumb=False)
                 image_path = get_abs_path(image_path)
-                bubble_message = BubbleMessage(
-                    image_path,
-                    avatar,
-                    type_,
-                    is_send
-                )
-                self.chat_window.add_message_item(bubble_message, 0)
+                self.add_bubble(image_path, avatar, MessageType.Image, is_send)
             elif type_ == 47:
                 return
-                if self.is_5_min(timestamp):
-                    time_message = Notice(self.last_str_time)
-                    self.last_str_time = str_time
-                    self.chat_window.add_message_item(time_message, 0)
-                image_path = get_emoji(str_content, thumb=True)
-                bubble_message = BubbleMessage(
-                    image_path,
-                    avatar,
-                    3,
-                    is_send
-                )
-                self.chat_window.add_message_item(bubble_message, 0)
             elif type_ == 10000:
                 str_content = str_content.lstrip('<revokemsg>').rstrip('</revokemsg>')
-                message = Notice(str_content)
-                self.chat_window.add_message_item(message, 0)
+                self.add_notice(str_content)
         except:
             print(message)
             traceback.print_exc()
 
 
-
 class ShowChatThread(QThread):
     showSingal = pyqtSignal(tuple)
     finishSingal = pyqtSignal(int)
     msg_id = 0
 
     # heightSingal = pyqtSignal(int)
-    def __init__(self, contact):
+    def __init__(self, contact, page_size=CHAT_PAGE_SIZE):
         super().__init__()
-        self.last_message_id = 9999999999
         self.wxid = contact.wxid
+        # 下一页在后台预取，滚动时直接拿到已经解析好发送人的消息
+        self.pager = MessagePager(self.wxid, page_size=page_size)
 
     def run(self) -> None:
-        messages = msg_db.get_message_by_num(self.wxid, self.last_message_id)
-        if messages:
-            self.last_message_id = messages[-1][0]
+        messages = self.pager.next_page()
         for message in messages:
             self.showSingal.emit(message)
         self.msg_id += 1
@@ -0,0 +1,119 @@
+from PyQt5.QtCore import QThread, pyqtSignal, Qt
+from PyQt5.QtWidgets import QDialog, QVBoxLayout, QHBoxLayout, QLineEdit, QPushButton, QListWidget, \
+    QListWidgetItem, QLabel
+
+from app.DataBase import msg_search_db
+
+PAGE_SIZE = 50
+
+
+class SearchThread(QThread):
+    """
+    在后台线程里查询全文索引，不阻塞界面
+    """
+    resultSignal = pyqtSignal(list, int)
+    notReadySignal = pyqtSignal()
+
+    def __init__(self, keyword, wxid, page):
+        super().__init__()
+        self.keyword = keyword
+        self.wxid = wxid
+        self.page = page
+
+    def run(self):
+        if not msg_search_db.is_ready():
+            self.notReadySignal.emit()
+            return
+        result = msg_search_db.search(self.keyword, self.wxid, page=self.page, page_size=PAGE_SIZE)
+        total = msg_search_db.count(self.keyword, self.wxid) if self.page == 0 else -1
+        self.resultSignal.emit(result, total)
+
+
+class ChatSearchDialog(QDialog):
+    """
+    搜索当前聊天的聊天记录，结果按相关度排序，每次加载一页
+    """
+
+    def __init__(self, contact, keyword='', parent=None):
+        super().__init__(parent)
+        self.contact = contact
+        self.page = 0
+        self.total = 0
+        self.search_thread = None
+        self.setWindowTitle(f'搜索聊天记录 - {contact.remark}')
+        self.resize(600, 500)
+        self.init_ui()
+        if keyword:
+            self.set_keyword(keyword)
+
+    def set_keyword(self, keyword):
+        self.lineEdit.setText(keyword)
+        self.search()
+
+    def init_ui(self):
+        self.lineEdit = QLineEdit()
+        self.lineEdit.setPlaceholderText('搜索聊天记录')
+        self.lineEdit.returnPressed.connect(self.search)
+        self.btn_search = QPushButton('搜索')
+        self.btn_search.clicked.connect(self.search)
+        hBoxLayout = QHBoxLayout()
+        hBoxLayout.addWidget(self.lineEdit)
+        hBoxLayout.addWidget(self.btn_search)
+
+        self.label_info = QLabel()
+        self.listWidget = QListWidget()
+        self.listWidget.setWordWrap(True)
+        self.btn_more = QPushButton('加载更多')
+        self.btn_more.setVisible(False)
+        self.btn_more.clicked.connect(self.load_more)
+
+        vBoxLayout = QVBoxLayout()
+        vBoxLayout.addLayout(hBoxLayout)
+        vBoxLayout.addWidget(self.label_info)
+        vBoxLayout.addWidget(self.listWidget)
+        vBoxLayout.addWidget(self.btn_more)
+        self.setLayout(vBoxLayout)
+
+    def search(self):
+        keyword = self.lineEdit.text().strip()
+        if not keyword:
+            return
+        self.listWidget.clear()
+        self.page = 0
+        self.total = 0
+        self.start_search(keyword)
+
+    def load_more(self):
+        self.page += 1
+        self.start_search(self.lineEdit.text().strip())
+
+    def start_search(self, keyword):
+        if self.search_thread is not None and self.search_thread.isRunning():
+            return
+        self.label_info.setText('正在搜索...')
+        self.btn_more.setVisible(False)
+        self.search_thread = SearchThread(keyword, self.contact.wxid, self.page)
+        self.search_thread.resultSignal.connect(self.show_result)
+        self.search_thread.notReadySignal.connect(self.show_not_ready)
+        self.search_thread.start()
+
+    def show_result(self, result, total):
+        if total >= 0:
+            self.total = total
+        for local_id, str_talker, type_, is_sender, create_time, str_time, content in result:
+            # 索引里没有群聊的发送人，群聊只区分是不是自己发的
+            sender = '我' if is_sender else ('' if self.contact.is_chatroom else self.contact.remark)
+            item = QListWidgetItem(f'{str_time}  {sender}\n{content}')
+            item.setData(Qt.UserRole, local_id)
+            self.listWidget.addItem(item)
+        self.label_info.setText(f'共{self.total}条结果')
+        self.btn_more.setVisible(self.listWidget.count() < self.total)
+
+    def show_not_ready(self):
+        # 全文索引在解密合并数据库时建立，这里不临时建立
+        self.label_info.setText('全文索引还没有建立或正在更新，请稍后再试（重新解密数据库后会自动建立）')
+
+    def closeEvent(self, event):
+        if self.search_thread is not None:
+            self.search_thread.wait()
+        super().closeEvent(event)
@@ -4,8 +4,9 @@ from PyQt5.QtCore import QThread, pyqtSignal
 from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QWidget, QMessageBox, QAction, QLineEdit
 
-from app.DataBase import micro_msg_db, misc_db, msg_db, close_db
+from app.DataBase import micro_msg_db, msg_db, close_db
 from app.components import ContactQListWidgetItem, ScrollBar
+from app.components.avatar_loader import AvatarLoadThread
 from app.person import Contact, Me
 from app.ui.Icon import Icon
 from app.util import search
@@ -50,10 +51,16 @@ class ChatWindow(QWidget, Ui_Form):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.show_thread = None
+        self.avatar_thread = AvatarLoadThread()
+        self.avatar_thread.avatarLoaded.connect(self.set_avatar)
+        self.default_avatar = QPixmap(Icon.Default_avatar_path)
         self.setupUi(self)
         self.ok_flag = False
         self.setStyleSheet(Stylesheet)
         self.contacts = [[], []]
+        self.contacts_list = []
+        # 行号 -> ChatInfo，第一次打开某个聊天时才创建
+        self.chat_info_windows = {}
         self.init_ui()
         self.show_chats()
         self.visited = set()
@@ -66,6 +73,9 @@ class ChatWindow(QWidget, Ui_Form):
         self.lineEdit.returnPressed.connect(self.search_contact)
         self.listWidget.clear()
         self.listWidget.setVerticalScrollBar(ScrollBar())
+        self.listWidget.verticalScrollBar().valueChanged.connect(
+            lambda value: self.avatar_thread.prioritize_visible(self.listWidget, offset=1)
+        )
         self.listWidget.currentRowChanged.connect(self.setCurrentIndex)
         self.listWidget.setCurrentRow(0)
         self.stackedWidget.setCurrentIndex(0)
@@ -75,6 +85,7 @@ class ChatWindow(QWidget, Ui_Form):
         self.listWidget.setItemWidget(contact_item, contact_item.widget)
         chat_info_window = AIChat(Me())
         self.stackedWidget.addWidget(chat_info_window)
+        self.chat_info_windows[0] = chat_info_window
 
     def show_chats(self):
         # return
@@ -92,6 +103,7 @@ class ChatWindow(QWidget, Ui_Form):
         self.show_thread.showSingal.connect(self.show_chat)
         self.show_thread.load_finish_signal.connect(self.stop_loading)
         self.show_thread.start()
+        self.avatar_thread.start()
         self.ok_flag = True
 
     def search_contact(self):
@@ -105,34 +117,60 @@ class ChatWindow(QWidget, Ui_Form):
         return search.search_by_content(content, self.contacts)
 
     def select_contact_by_index(self, index):
-        self.stackedWidget.setCurrentIndex(index)
         self.listWidget.setCurrentRow(index)
 
     def show_chat(self, contact):
         # return
         self.contacts[0].append(contact.remark)
         self.contacts[1].append(contact.nickName)
-        contact_item = ContactQListWidgetItem(contact.remark, contact.smallHeadImgUrl, contact.smallHeadImgBLOG)
+        contact_item = ContactQListWidgetItem(contact.remark, contact.smallHeadImgUrl, self.default_avatar)
         self.listWidget.addItem(contact_item)
         self.listWidget.setItemWidget(contact_item, contact_item.widget)
-        chat_info_window = ChatInfo(contact)
-        self.stackedWidget.addWidget(chat_info_window)
+        self.contacts_list.append(contact)
+        self.avatar_thread.add(contact.wxid)
+
+    def set_avatar(self, row, img_bytes):
+        """
+        后台加载完头像后更新联系人和列表项，第 0 行是 AI 小助手
+        @param row: 联系人在 contacts_list 里的下标
+        @param img_bytes: 头像数据
+        @return:
+        """
+        contact = self.contacts_list[row]
+        contact.smallHeadImgBLOG = img_bytes
+        contact.set_avatar(img_bytes)
+        self.listWidget.item(row + 1).avatorLabel.setBytes(contact.avatar)
+        # 消息里的头像在绘制时读取，重绘当前显示的聊天（也可能是群聊里的成员头像），其它聊天切换过去时会重绘
+        chat_info_window = self.stackedWidget.currentWidget()
+        if isinstance(chat_info_window, ChatInfo):
+            chat_info_window.update_avatar()
+
+    def get_chat_info_window(self, row):
+        chat_info_window = self.chat_info_windows.get(row)
+        if chat_info_window is None:
+            self.avatar_thread.prioritize([row - 1])
+            chat_info_window = ChatInfo(self.contacts_list[row - 1])
+            self.stackedWidget.addWidget(chat_info_window)
+            self.chat_info_windows[row] = chat_info_window
+        return chat_info_window
 
     def setCurrentIndex(self, row):
         # print(row)
         item = self.listWidget.item(self.now_index)
         item.dis_select()
-        self.stackedWidget.setCurrentIndex(row)
+        chat_info_window = self.get_chat_info_window(row)
+        self.stackedWidget.setCurrentWidget(chat_info_window)
         item = self.listWidget.item(row)
         item.select()
         self.now_index = row
         if row not in self.visited:
-            chat_info_window = self.stackedWidget.currentWidget()
             chat_info_window.update_history_messages()
             self.visited.add(row)
 
     def stop_loading(self, a0):
         # self.label.setVisible(False)
+        self.avatar_thread.prioritize_visible(self.listWidget, offset=1)
+        self.avatar_thread.finish()
         self.load_finish_signal.emit(True)
 
 
@@ -165,9 +203,8 @@ class ShowContactThread(QThread):
                 'NickName': contact_info_list[4],
                 'smallHeadImgUrl': contact_info_list[7]
             }
+            # 头像由 AvatarLoadThread 在后台加载，这里只读联系人信息，列表能马上显示
             contact = Contact(contact_info)
-            contact.smallHeadImgBLOG = misc_db.get_avatar_buffer(contact.wxid)
-            contact.set_avatar(contact.smallHeadImgBLOG)
             self.showSingal.emit(contact)
             # pprint(contact.__dict__)
         self.load_finish_signal.emit(True)
@@ -1,10 +1,12 @@
 from typing import List
 
 from PyQt5.QtCore import QThread, pyqtSignal
+from PyQt5.QtGui import QPixmap
 from PyQt5.QtWidgets import QWidget, QMessageBox, QAction, QLineEdit, QLabel
 
-from app.DataBase import micro_msg_db, misc_db, close_db
+from app.DataBase import micro_msg_db, close_db
 from app.components import ContactQListWidgetItem, ScrollBar
+from app.components.avatar_loader import AvatarLoadThread
 from app.person import Contact
 from app.ui.Icon import Icon
 from .contactInfo import ContactInfo
@@ -59,6 +61,9 @@ class ContactWindow(QWidget, Ui_Form):
         super().__init__(parent)
         self.now_index = 0
         self.show_thread = None
+        self.avatar_thread = AvatarLoadThread()
+        self.avatar_thread.avatarLoaded.connect(self.set_avatar)
+        self.default_avatar = QPixmap(Icon.Default_avatar_path)
         self.setupUi(self)
         self.ok_flag = False
         self.setStyleSheet(Stylesheet)
@@ -75,6 +80,9 @@ class ContactWindow(QWidget, Ui_Form):
         self.lineEdit.returnPressed.connect(self.search_contact)
         self.listWidget.clear()
         self.listWidget.setVerticalScrollBar(ScrollBar())
+        self.listWidget.verticalScrollBar().valueChanged.connect(
+            lambda value: self.avatar_thread.prioritize_visible(self.listWidget)
+        )
         self.listWidget.currentRowChanged.connect(self.setCurrentIndex)
         self.listWidget.setCurrentRow(0)
         self.stackedWidget.setCurrentIndex(0)
@@ -98,10 +106,16 @@ class ContactWindow(QWidget, Ui_Form):
 
         self.show_thread = ShowContactThread()
         self.show_thread.showSingal.connect(self.show_contact)
-        self.show_thread.load_finish_signal.connect(self.load_finish_signal)
+        self.show_thread.load_finish_signal.connect(self.show_finish)
         self.show_thread.start()
+        self.avatar_thread.start()
         self.ok_flag = True
 
+    def show_finish(self, ok):
+        self.avatar_thread.prioritize_visible(self.listWidget)
+        self.avatar_thread.finish()
+        self.load_finish_signal.emit(ok)
+
     def search_contact(self):
         """
         搜索联系人
@@ -122,14 +136,27 @@ class ContactWindow(QWidget, Ui_Form):
         # return
         self.contacts[0].append(contact.remark)
         self.contacts[1].append(contact.nickName)
-        contact_item = ContactQListWidgetItem(contact.remark, contact.smallHeadImgUrl, contact.smallHeadImgBLOG)
+        contact_item = ContactQListWidgetItem(contact.remark, contact.smallHeadImgUrl, self.default_avatar)
         self.listWidget.addItem(contact_item)
         self.listWidget.setItemWidget(contact_item, contact_item.widget)
         self.contacts_list.append(contact)
+        self.avatar_thread.add(contact.wxid)
         if self.contact_info_window is None:
             self.contact_info_window = ContactInfo(contact)
             self.stackedWidget.addWidget(self.contact_info_window)
 
+    def set_avatar(self, row, img_bytes):
+        """
+        后台加载完头像后更新联系人和列表项
+        @param row: 联系人所在的行
+        @param img_bytes: 头像数据
+        @return:
+        """
+        contact = self.contacts_list[row]
+        contact.smallHeadImgBLOG = img_bytes
+        contact.set_avatar(img_bytes)
+        self.listWidget.item(row).avatorLabel.setBytes(contact.avatar)
+
     def setCurrentIndex(self, row):
         # print(row)
         item = self.listWidget.item(self.now_index)
@@ -175,9 +202,8 @@ class ShowContactThread(QThread):
                 'detail': detail,
                 'label_name': contact_info_list[10],
             }
+            # 头像由 AvatarLoadThread 在后台加载，这里只读联系人信息，列表能马上显示
             contact = Contact(contact_info)
-            contact.smallHeadImgBLOG = misc_db.get_avatar_buffer(contact.wxid)
-            contact.set_avatar(contact.smallHeadImgBLOG)
             self.showSingal.emit(contact)
             # pprint(contact.__dict__)
         self.load_finish_signal.emit(True)
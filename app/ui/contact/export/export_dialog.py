@@ -82,6 +82,11 @@ class ExportDialog(QDialog, Ui_Dialog):
             checkbox = QCheckBox(export_type)
             checkbox.setChecked(default_state)
             self.verticalLayout_2.addWidget(checkbox)
+        self.checkbox_offline = None
+        if file_type in {'html', 'docx'}:
+            # 不参与全选，勾选后音乐地址和网站名称只用本地缓存
+            self.checkbox_offline = QCheckBox('离线导出（不联网获取音乐和网站信息）')
+            self.verticalLayout_2.addWidget(self.checkbox_offline)
 
         self.btn_select_all.clicked.connect(self.select_all)
         self.btn_start.clicked.connect(self.export_data)
@@ -99,12 +104,13 @@ class ExportDialog(QDialog, Ui_Dialog):
         self.btn_cancel.setEnabled(False)
         # 在这里获取用户选择的导出数据类型
         selected_types = {types[export_type]: checkbox.isChecked() for export_type, checkbox in
-                          zip(self.export_choices.keys(), self.findChildren(QCheckBox))}
+                          zip(self.export_choices.keys(), self.type_checkboxes())}
+        offline = self.checkbox_offline is not None and self.checkbox_offline.isChecked()
 
         # 在这里根据用户选择的数据类型执行导出操作
         print("选择的数据类型:", selected_types)
         self.worker = Output(self.contact, type_=self.export_type, message_types=selected_types,
-                             time_range=self.time_range)
+                             time_range=self.time_range, offline=offline)
         self.worker.progressSignal.connect(self.update_progress)
         self.worker.okSignal.connect(self.export_finished)
         self.worker.rangeSignal.connect(self.set_total_msg_num)
@@ -188,15 +194,18 @@ class ExportDialog(QDialog, Ui_Dialog):
         sys.stdout = sys.__stdout__
         self.accept()
 
+    def type_checkboxes(self):
+        return [checkbox for checkbox in self.findChildren(QCheckBox) if checkbox is not self.checkbox_offline]
+
     def select_all(self):
         self.select_all_flag = not self.select_all_flag
         print('全选', self.select_all_flag)
         if self.select_all_flag:
-            for checkbox in self.findChildren(QCheckBox):
+            for checkbox in self.type_checkboxes():
                 checkbox.setChecked(True)
             self.btn_select_all.setText('全不选')
         else:
-            for checkbox in self.findChildren(QCheckBox):
+            for checkbox in self.type_checkboxes():
                 checkbox.setChecked(False)
             self.btn_select_all.setText('全选')
 
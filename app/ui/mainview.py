@@ -30,6 +30,7 @@ from app.ui.tool.tool_window import ToolWindow
 from app.ui.home.home_window import HomeWindow
 from .menu.export import ExportDialog
 from app.util.exporter.output import Output
+from app.util.avatar import avatar_cache
 from ..components.QCursorGif import QCursorGif
 from ..config import INFO_FILE_PATH, DB_DIR, SERVER_API_URL, version
 from ..log import logger
@@ -357,15 +358,10 @@ class MainWinController(QMainWindow, mainwindow.Ui_MainWindow, QCursorGif):
         self.stackedWidget.addWidget(window)
 
     def set_my_info(self, wxid):
-        self.avatar = QPixmap()
         img_bytes = misc_db.get_avatar_buffer(wxid)
         if not img_bytes:
             return
-        if img_bytes[:4] == b'\x89PNG':
-            self.avatar.loadFromData(img_bytes, format='PNG')
-        else:
-            self.avatar.loadFromData(img_bytes, format='jfif')
-        self.avatar.scaled(60, 60)
+        self.avatar = avatar_cache.get(img_bytes) or QPixmap()
         contact_info_list = micro_msg_db.get_contact_by_username(wxid)
         if not contact_info_list:
             close_db()
@@ -11,11 +11,15 @@ from PyQt5.QtWidgets import QWidget, QMessageBox, QFileDialog
 
 from app.DataBase import msg_db, misc_db, close_db
 from app.DataBase.merge import merge_databases, merge_MediaMSG_databases
+from app.DataBase.msg_index import build_indexes
+from app.DataBase.msg_search import update_search_index
+from app.DataBase.msg_stats import update_stats
+from app.DataBase.msg_words import update_word_counts
 from app.components.QCursorGif import QCursorGif
 from app.config import INFO_FILE_PATH, DB_DIR, SERVER_API_URL
 from app.decrypt import get_wx_info, decrypt
 from app.log import logger
-from app.util import path
+from app.util import path, process_pool
 from . import decryptUi
 from ...Icon import Icon
 from ...menu.about_dialog import Decrypt
@@ -249,32 +253,38 @@ class DecryptThread(QThread):
                         except:
                             continue
         self.maxNumSignal.emit(len(tasks))
-        for i, task in enumerate(tasks):
-            if decrypt.decrypt(*task) == -1:
-                self.errorSignal.emit(True)
-            self.signal.emit(str(i))
+        finish_num = 0
+
+        def finish_one(index, result):
+            nonlocal finish_num
+            finish_num += 1
+            self.signal.emit(str(finish_num))
+
+        # 所有数据库的页区间一起交给进程池并行解密，只解密上次解密之后变化的页
+        decrypt.decrypt_files(tasks, callback=finish_one, incremental=True, executor=process_pool.get_executor())
         # print(self.db_path)
         # 目标数据库文件
         target_database = os.path.join(DB_DIR, 'MSG.db')
         # 源数据库文件列表
         source_databases = [os.path.join(DB_DIR, f"MSG{i}.db") for i in range(1, 50)]
-        import shutil
-        if os.path.exists(target_database):
-            os.remove(target_database)
-        shutil.copy2(os.path.join(DB_DIR, 'MSG0.db'), target_database)  # 使用一个数据库文件作为模板
-        # 合并数据库
-        merge_databases(source_databases, target_database)
+        # 增量合并数据库，MSG0.db 作为模板
+        merge_databases(source_databases, target_database, template_path=os.path.join(DB_DIR, 'MSG0.db'))
+        build_indexes(target_database, force=True)
+        # 聊天记录统计只聚合新合并的消息
+        update_stats(target_database)
+        # 全文索引同样只索引新合并的消息
+        update_search_index(target_database)
+        # 词云用的词频表只对新合并的文本分词
+        update_word_counts(target_database)
 
         # 音频数据库文件
         target_database = os.path.join(DB_DIR, 'MediaMSG.db')
         # 源数据库文件列表
-        if os.path.exists(target_database):
-            os.remove(target_database)
         source_databases = [os.path.join(DB_DIR, f"MediaMSG{i}.db") for i in range(1, 50)]
-        shutil.copy2(os.path.join(DB_DIR, 'MediaMSG0.db'), target_database)  # 使用一个数据库文件作为模板
 
-        # 合并数据库
-        merge_MediaMSG_databases(source_databases, target_database)
+        # 增量合并数据库，MediaMSG0.db 作为模板
+        merge_MediaMSG_databases(source_databases, target_database,
+                                 template_path=os.path.join(DB_DIR, 'MediaMSG0.db'))
         self.okSignal.emit('ok')
         # self.signal.emit('100')
 
@@ -1 +1,7 @@
-from .path import get_abs_path
+# path 会导入 PyQt 等界面相关的模块，用到时才导入，
+# 进程池的子进程只导入 app.util.voice 等模块时不用加载界面
+def __getattr__(name):
+    if name == 'get_abs_path':
+        from .path import get_abs_path
+        return get_abs_path
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,197 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from app.log import logger
+from app.util.link_meta import link_meta_cache, HEADERS
+
+# 下载的表情包、音乐等文件按内容 md5 保存在这里，所有联系人、所有导出共用
+ASSET_DIR = './data/assets'
+TIMEOUT = (5, 30)  # 连接超时、读取超时（秒）
+MAX_WORKERS = 8  # 同时进行的下载数
+RETRIES = 3  # 连接失败或服务器 5xx 时的重试次数
+
+ASSET = 'asset'  # 下载地址 -> 文件 md5，记录在链接信息缓存里，同一个地址只下载一次
+
+MAGIC_NUMBERS = {
+    b"\xFF\xD8\xFF": ".jpeg",
+    b"\x89\x50\x4E\x47\x0D\x0A\x1A\x0A": ".png",
+    b"\x47\x49\x46": ".gif",
+    b"\x42\x4D": ".bmp",
+    b"ID3": ".mp3",
+    b"\xFF\xFB": ".mp3",
+}
+
+
+def content_md5(data: bytes) -> str:
+    return hashlib.md5(data).hexdigest()
+
+
+def guess_ext(data: bytes) -> str:
+    for magic_number, ext in MAGIC_NUMBERS.items():
+        if data.startswith(magic_number):
+            return ext
+    if data[4:8] == b'ftyp':
+        return '.m4a'
+    return ''
+
+
+def link_file(src, dst):
+    """
+    把仓库里的文件放到导出目录，优先建立硬链接，不在同一个磁盘时复制
+    """
+    if os.path.exists(dst):
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class AssetStore:
+    """
+    按内容 md5 寻址的文件仓库
+    同一个表情包、同一首歌不管出现在多少个聊天里，只下载和保存一次，
+    导出时通过 link_file 硬链接到各自的导出目录
+    """
+
+    def __init__(self, root=ASSET_DIR, max_workers=MAX_WORKERS):
+        self.root = root
+        self.max_workers = max_workers
+        self._paths = {}  # md5 -> 文件路径
+        self._lock = threading.Lock()
+        self._url_locks = defaultdict(threading.Lock)
+        self._session = None
+
+    def get_session(self) -> requests.Session:
+        """
+        所有下载共用一个 Session，复用连接，失败时自动重试
+        """
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                retry = Retry(total=RETRIES, backoff_factor=0.5, status_forcelist=(500, 502, 503, 504))
+                adapter = HTTPAdapter(pool_connections=self.max_workers, pool_maxsize=self.max_workers,
+                                      max_retries=retry)
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers.update(HEADERS)
+                self._session = session
+        return self._session
+
+    def find(self, md5) -> str | None:
+        """
+        @return: 仓库里没有时返回 None
+        """
+        if not md5:
+            return None
+        path = self._paths.get(md5)
+        if path:
+            return path
+        folder = os.path.join(self.root, md5[:2])
+        if not os.path.isdir(folder):
+            return None
+        for name in os.listdir(folder):
+            if os.path.splitext(name)[0] == md5:
+                path = os.path.join(folder, name)
+                self._paths[md5] = path
+                return path
+        return None
+
+    def put(self, data: bytes, md5=None, ext=None) -> str:
+        """
+        保存文件内容
+        @param data:
+        @param md5: 已知的内容 md5（比如表情包 XML 里的 md5），为空时计算
+        @param ext: 扩展名，为空时按文件头判断
+        @return: 仓库里的文件路径
+        """
+        md5 = md5 or content_md5(data)
+        path = self.find(md5)
+        if path:
+            return path
+        folder = os.path.join(self.root, md5[:2])
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, md5 + (ext if ext is not None else guess_ext(data)))
+        # 先写临时文件再改名，多个线程同时保存同一个文件也不会读到写了一半的内容
+        tmp_path = f'{path}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._paths[md5] = path
+        return path
+
+    def download(self, url, verify=True) -> bytes | None:
+        """
+        @return: 失败时返回 None
+        """
+        try:
+            response = self.get_session().get(url, timeout=TIMEOUT, verify=verify)
+            if response.status_code == 200:
+                return response.content
+            print(f"下载失败：状态码{response.status_code}，请求地址：{url}")
+        except requests.RequestException as e:
+            print(f"下载失败：{e}，请求地址：{url}")
+        return None
+
+    def fetch(self, url, md5=None, ext=None, offline=False, verify=True) -> str | None:
+        """
+        获取下载地址对应的文件，仓库里已有时不再下载
+        @param url: 下载地址
+        @param md5: 已知的内容 md5，为空时按下载地址查找之前下载过的文件
+        @param ext: 扩展名，为空时按文件头判断
+        @param offline: 离线模式只查仓库，不联网
+        @param verify: 是否校验证书
+        @return: 仓库里的文件路径，获取不到时返回 None
+        """
+        path = self.find(md5 or link_meta_cache.get(ASSET, url))
+        if path or offline or not url:
+            return path
+        with self._lock:
+            url_lock = self._url_locks[url]
+        with url_lock:
+            # 同一个地址同时只下载一次，等前一个下载完成后直接用它的结果
+            path = self.find(md5 or link_meta_cache.get(ASSET, url))
+            if path:
+                return path
+            data = self.download(url, verify)
+            if data is None:
+                return None
+            path = self.put(data, md5, ext)
+            if not md5:
+                link_meta_cache.set(ASSET, url, os.path.splitext(os.path.basename(path))[0])
+            return path
+
+    def prefetch(self, items, max_workers=None, verify=True):
+        """
+        并发下载还没有保存过的文件，之后 fetch 直接命中仓库
+        @param items: [(url, md5, ext), ...]，md5 和 ext 可以为 None
+        @param max_workers: 最大并发数
+        @param verify: 是否校验证书
+        @return: 需要下载的文件数
+        """
+        tasks = {}
+        for url, md5, ext in items:
+            if url and url not in tasks and not self.find(md5 or link_meta_cache.get(ASSET, url)):
+                tasks[url] = (md5, ext)
+        if not tasks:
+            return 0
+        with ThreadPoolExecutor(max_workers=max_workers or self.max_workers,
+                                thread_name_prefix='asset_store') as executor:
+            futures = [executor.submit(self.fetch, url, md5, ext, False, verify) for url, (md5, ext) in tasks.items()]
+            for future in futures:
+                exc = future.exception()
+                if exc:
+                    logger.error(f'下载文件失败: {exc}')
+        return len(tasks)
+
+
+asset_store = AssetStore()
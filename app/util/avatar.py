@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtGui import QImage, QPixmap
+
+# 解码后的头像按内容哈希保存在这里，所有联系人、所有导出共用
+AVATAR_CACHE_DIR = './data/avatar/cache'
+AVATAR_SIZE = 132  # 微信小头像的边长，更大的图片缩小后再缓存
+
+
+def avatar_key(img_bytes: bytes) -> str:
+    return hashlib.sha1(img_bytes).hexdigest()
+
+
+def decode_avatar(img_bytes: bytes) -> QImage:
+    image = QImage()
+    if img_bytes[:4] == b'\x89PNG':
+        image.loadFromData(img_bytes, 'PNG')
+    else:
+        image.loadFromData(img_bytes, 'jfif')
+    if not image.isNull() and (image.width() > AVATAR_SIZE or image.height() > AVATAR_SIZE):
+        image = image.scaled(AVATAR_SIZE, AVATAR_SIZE, Qt.KeepAspectRatio, Qt.SmoothTransformation)
+    return image
+
+
+def get_avatar_path(img_bytes: bytes):
+    """
+    头像在磁盘缓存里的 PNG 路径，第一次用到时解码保存，之后直接复用
+    @param img_bytes: Misc.get_avatar_buffer 返回的头像数据
+    @return: 没有头像或无法解码时返回 None
+    """
+    if not img_bytes:
+        return None
+    path = os.path.join(AVATAR_CACHE_DIR, avatar_key(img_bytes) + '.png')
+    if os.path.exists(path):
+        return path
+    image = decode_avatar(img_bytes)
+    if image.isNull():
+        return None
+    os.makedirs(AVATAR_CACHE_DIR, exist_ok=True)
+    # 先写临时文件再改名，多个线程同时保存同一个头像也不会读到写了一半的文件
+    tmp_path = f'{path}.{threading.get_ident()}.tmp'
+    image.save(tmp_path, 'PNG')
+    os.replace(tmp_path, path)
+    return path
+
+
+def export_avatar(img_bytes: bytes, dst: str) -> bool:
+    """
+    把缓存里的头像放到导出目录，优先建立硬链接，不在同一个磁盘时复制，不再重新编码
+    @param img_bytes: 头像数据
+    @param dst: 目标文件路径
+    @return: 没有可用的头像时返回 False
+    """
+    src = get_avatar_path(img_bytes)
+    if not src:
+        return False
+    if os.path.exists(dst):
+        return True
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+    return True
+
+
+class AvatarCache:
+    """
+    头像 QPixmap 的 LRU 缓存，按头像内容哈希索引
+    同一个头像（比如同一个人出现在多个群里）只解码一次
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, img_bytes: bytes):
+        """
+        @param img_bytes: 头像数据
+        @return: QPixmap，没有头像或无法解码时返回 None
+        """
+        if not img_bytes:
+            return None
+        key = avatar_key(img_bytes)
+        with self._lock:
+            pixmap = self._cache.get(key)
+            if pixmap is not None:
+                self._cache.move_to_end(key)
+                return pixmap
+        path = get_avatar_path(img_bytes)
+        if not path:
+            return None
+        pixmap = QPixmap(path)
+        with self._lock:
+            self._cache[key] = pixmap
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return pixmap
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+avatar_cache = AvatarCache()
@@ -1,17 +1,37 @@
 import html
+import threading
 import xml.etree.ElementTree as ET
+from collections import OrderedDict
 
 import lz4.block
 
-import requests
 import re
-from urllib.parse import urlparse
-from bs4 import BeautifulSoup
 
-from app.util.protocbuf.msg_pb2 import MessageBytesExtra
+from app.util import link_meta
+from app.util.message_extra import get_message_extra, strip_wxid_dir
 from ..util.file import get_file
 
 
+# 解压缓冲区的初始倍数和上限倍数，XML 的压缩比一般在 2~6 倍
+INITIAL_RATIO = 8
+MAX_RATIO = 1 << 10
+
+
+def lz4_decompress(data: bytes) -> bytes:
+    """
+    按需扩大缓冲区解压 LZ4 块：先按 INITIAL_RATIO 倍分配，不够时翻倍重试，最多 MAX_RATIO 倍
+    """
+    size = max(len(data) * INITIAL_RATIO, 4096)
+    max_size = len(data) * MAX_RATIO
+    while True:
+        try:
+            return lz4.block.decompress(data, uncompressed_size=size)
+        except lz4.block.LZ4BlockError:
+            if size >= max_size:
+                raise
+            size = min(size << 1, max_size)
+
+
 def decompress_CompressContent(data):
     """
     解压缩Msg：CompressContent内容
@@ -21,7 +41,7 @@ def decompress_CompressContent(data):
     if data is None or not isinstance(data, bytes):
         return ""
     try:
-        dst = lz4.block.decompress(data, uncompressed_size=len(data) << 10)
+        dst = lz4_decompress(data)
         decoded_string = dst.decode().replace("\x00", "")  # Remove any null characters
     except:
         print(
@@ -31,6 +51,52 @@ def decompress_CompressContent(data):
     return decoded_string
 
 
+class AppMsgCache:
+    """
+    解析后的 appmsg XML 的 LRU 缓存，以 MsgSvrID 为键
+    同一条引用、文件、分享、转账消息在聊天界面、统计、各格式导出中会被多次解析，只解压解析一次。
+    缓存的 Element 只读，不要修改
+    """
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, msg_svr_id, data):
+        """
+        @param msg_svr_id: 为空时不缓存
+        @param data: CompressContent
+        @return: XML 根节点，解压或解析失败时返回 None
+        """
+        if msg_svr_id:
+            with self._lock:
+                root = self._cache.get(msg_svr_id)
+                if root is not None:
+                    self._cache.move_to_end(msg_svr_id)
+                    return root
+        xml_content = decompress_CompressContent(data)
+        if not xml_content:
+            return None
+        try:
+            root = ET.XML(xml_content)
+        except ET.ParseError:
+            return None
+        if msg_svr_id:
+            with self._lock:
+                self._cache[msg_svr_id] = root
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+        return root
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+appmsg_cache = AppMsgCache()
+
+
 def escape_js_and_html(input_str):
     if not input_str:
         return ""
@@ -50,9 +116,9 @@ def escape_js_and_html(input_str):
     return js_escaped
 
 
-def parser_reply(data: bytes):
-    xml_content = decompress_CompressContent(data)
-    if not xml_content:
+def parser_reply(data: bytes, msg_svr_id=None):
+    root = appmsg_cache.get(msg_svr_id, data)
+    if root is None:
         return {
             "type": 57,
             "title": "发生错误",
@@ -64,7 +130,6 @@ def parser_reply(data: bytes):
             "is_error": True,
         }
     try:
-        root = ET.XML(xml_content)
         appmsg = root.find("appmsg")
         msg_type = int(appmsg.find("type").text)
         title = appmsg.find("title").text
@@ -96,12 +161,16 @@ def parser_reply(data: bytes):
         }
 
 
-def music_share(data: bytes):
-    xml_content = decompress_CompressContent(data)
-    if not xml_content:
+def music_share(data: bytes, msg_svr_id=None, offline=False):
+    """
+    @param data: CompressContent
+    @param msg_svr_id:
+    @param offline: 离线模式下网站名称和播放地址只从本地缓存读取
+    """
+    root = appmsg_cache.get(msg_svr_id, data)
+    if root is None:
         return {"type": 3, "title": "发生错误", "is_error": True}
     try:
-        root = ET.XML(xml_content)
         appmsg = root.find("appmsg")
         msg_type = int(appmsg.find("type").text)
         title = appmsg.find("title").text
@@ -109,8 +178,8 @@ def music_share(data: bytes):
             title = title[:38] + "..."
         artist = appmsg.find("des").text
         link_url = appmsg.find("url").text  # 链接地址
-        audio_url = get_audio_url(appmsg.find("dataurl").text)  # 播放地址
-        website_name = get_website_name(link_url)
+        audio_url = link_meta.get_audio_url(appmsg.find("dataurl").text, offline)  # 播放地址
+        website_name = link_meta.get_website_name(link_url, offline)
         return {
             "type": msg_type,
             "title": escape_js_and_html(title),
@@ -125,11 +194,33 @@ def music_share(data: bytes):
         return {"type": 3, "title": "发生错误", "is_error": True}
 
 
-def share_card(bytesExtra, compress_content_):
+def prefetch_music_share(messages, max_workers=link_meta.MAX_WORKERS):
+    """
+    导出前并发获取音乐分享消息的网站名称和播放地址，之后 music_share 直接命中缓存
+    @param messages: 消息，message[9] 为 MsgSvrID，message[11] 为 CompressContent
+    @param max_workers: 最大并发数
+    @return: 获取到的实际播放地址，可以接着用来下载音乐文件
+    """
+    site_urls, audio_urls = [], []
+    for message in messages:
+        root = appmsg_cache.get(message[9], message[11])
+        appmsg = root.find("appmsg") if root is not None else None
+        if appmsg is None:
+            continue
+        url, data_url = appmsg.find("url"), appmsg.find("dataurl")
+        if url is not None and url.text:
+            site_urls.append(url.text)
+        if data_url is not None and data_url.text:
+            audio_urls.append(data_url.text)
+    link_meta.prefetch(site_urls, audio_urls, max_workers)
+    audio_urls = (link_meta.get_audio_url(url, offline=True) for url in audio_urls)
+    return list(dict.fromkeys(url for url in audio_urls if url))
+
+
+def share_card(bytesExtra, compress_content_, msg_svr_id=None):
     title, des, url, show_display_name, thumbnail, app_logo = "", "", "", "", "", ""
     try:
-        xml = decompress_CompressContent(compress_content_)
-        root = ET.XML(xml)
+        root = appmsg_cache.get(msg_svr_id, compress_content_)
         appmsg = root.find("appmsg")
         title = appmsg.find("title").text
         try:
@@ -145,17 +236,13 @@ def share_card(bytesExtra, compress_content_):
         else:
             if appinfo is not None:
                 show_display_name = appinfo.find("appname").text
-        msg_bytes = MessageBytesExtra()
-        msg_bytes.ParseFromString(bytesExtra)
         app_logo = ""
         thumbnail = ""
-        for tmp in msg_bytes.message2:
-            if tmp.field1 == 3:
-                thumbnail = tmp.field2
-                thumbnail = "\\".join(thumbnail.split("\\")[1:])
-            if tmp.field2 == 4:
-                app_logo = tmp.field2
-                app_logo = "\\".join(app_logo.split("\\")[1:])
+        for field1, field2 in get_message_extra(bytesExtra).fields:
+            if field1 == 3:
+                thumbnail = strip_wxid_dir(field2)
+            if field2 == 4:
+                app_logo = strip_wxid_dir(field2)
         if sourceusername is not None:
             from app.DataBase import micro_msg_db  # 放上面会导致循环依赖
 
@@ -173,7 +260,7 @@ def share_card(bytesExtra, compress_content_):
         }
 
 
-def transfer_decompress(compress_content_):
+def transfer_decompress(compress_content_, msg_svr_id=None):
     """
     return dict
         feedesc: 钱数，str类型，包含一个前缀币种符号（除人民币￥之外未测试）;
@@ -183,8 +270,7 @@ def transfer_decompress(compress_content_):
     """
     feedesc, pay_memo, receiver_username, paysubtype = "", "", "", ""
     try:
-        xml = decompress_CompressContent(compress_content_)
-        root = ET.XML(xml)
+        root = appmsg_cache.get(msg_svr_id, compress_content_)
         appmsg = root.find("appmsg")
         wcpayinfo = appmsg.find("wcpayinfo")
         paysubtype = int(wcpayinfo.find("paysubtype").text)
@@ -208,14 +294,12 @@ def call_decompress(is_send, bytes_extra, display_content, str_content):  # 音
     """
     call_type = 2
     call_length = 0
-    msg_bytes = MessageBytesExtra()
-    msg_bytes.ParseFromString(bytes_extra)
     # message2 字段 1: 发送人wxid; 字段 3: "1"是语音，"0"是视频; 字段 4: 通话时长
-    for i in msg_bytes.message2:
-        if i.field1 == 3:
-            call_type = int(i.field2)
-        elif i.field1 == 4:
-            call_length = int(i.field2)
+    for field1, field2 in get_message_extra(bytes_extra).fields:
+        if field1 == 3:
+            call_type = int(field2)
+        elif field1 == 4:
+            call_length = int(field2)
 
     try:
         if display_content == "":
@@ -242,55 +326,11 @@ def call_decompress(is_send, bytes_extra, display_content, str_content):  # 音
     }
 
 
-def get_website_name(url):
-    parsed_url = urlparse(url)
-    domain = f"{parsed_url.scheme}://{parsed_url.netloc}"
-    website_name = ""
-    try:
-        response = requests.get(domain, allow_redirects=False)
-        if response.status_code == 200:
-            soup = BeautifulSoup(response.content, "html.parser")
-            website_name = soup.title.string.strip()
-        elif response.status_code == 302:
-            domain = response.headers["Location"]
-            response = requests.get(domain, allow_redirects=False)
-            soup = BeautifulSoup(response.content, "html.parser")
-            website_name = soup.title.string.strip()
-        else:
-            response = requests.get(url, allow_redirects=False)
-            if response.status_code == 200:
-                soup = BeautifulSoup(response.content, "html.parser")
-                website_name = soup.title.string.strip()
-                index = website_name.find("-")
-                if index != -1:  # 如果找到了 "-"
-                    website_name = website_name[index + 1 :].strip()
-    except Exception as e:
-        print(f"Get Website Info Error: {e}")
-    return website_name
-
-
-def get_audio_url(url):
-    path = ""
-    try:
-        response = requests.get(url, allow_redirects=False)
-        # 检查响应状态码
-        if response.status_code == 302:
-            path = response.headers["Location"]
-        elif response.status_code == 200:
-            print("音乐文件已失效,url:" + url)
-        else:
-            print("音乐文件地址获取失败,url:" + url + ",状态码" + str(response.status_code))
-    except Exception as e:
-        print(f"Get Audio Url Error: {e}")
-    return path
-
-
-def file(bytes_extra, compress_content, output_path):
-    xml_content = decompress_CompressContent(compress_content)
-    if not xml_content:
+def file(bytes_extra, compress_content, output_path, msg_svr_id=None):
+    root = appmsg_cache.get(msg_svr_id, compress_content)
+    if root is None:
         return {"type": 6, "title": "发生错误", "is_error": True}
     try:
-        root = ET.XML(xml_content)
         appmsg = root.find("appmsg")
         msg_type = int(appmsg.find("type").text)
         file_name = appmsg.find("title").text
@@ -14,10 +14,11 @@ import traceback
 import xml.etree.ElementTree as ET
 import sqlite3
 import threading
+from collections import Counter
 from PyQt5.QtGui import QPixmap
-import requests
 
 from app.log import log, logger
+from app.util.asset_store import asset_store, link_file
 
 lock = threading.Lock()
 db_path = "./app/Database/Msg/Emotion.db"
@@ -183,44 +184,57 @@ class Emotion:
         self.close()
 
 
+def export_asset(asset_path, output_dir, name, thumb=False):
+    """
+    把表情包仓库里的文件链接到导出目录，文件名和原来一样是 [th_]md5.格式
+    """
+    with open(asset_path, "rb") as f:
+        image_format = get_image_format(f.read(8))
+    prefix = "th_" if thumb else ""
+    output_path = os.path.join(output_dir, prefix + name + ("." + image_format if image_format else ""))
+    link_file(asset_path, output_path)
+    return output_path
+
+
 @log
 def download(url, output_dir, name, thumb=False):
-    resp = requests.get(url)
-    byte = resp.content
-    image_format = get_image_format(byte[:8])
-    if image_format:
-        if thumb:
-            output_path = os.path.join(output_dir, "th_" + name + "." + image_format)
-        else:
-            output_path = os.path.join(output_dir, name + "." + image_format)
-    else:
-        output_path = os.path.join(output_dir, name)
-    with open(output_path, "wb") as f:
-        f.write(resp.content)
-    return output_path
+    # 原图的 md5 就是 XML 里的 md5，缩略图只能按下载地址去重
+    asset_path = asset_store.fetch(url, md5=None if thumb else name)
+    if asset_path is None:
+        raise IOError(f"表情包下载失败：{url}")
+    return export_asset(asset_path, output_dir, name, thumb)
+
+
+MD5_RE = re.compile(r'\bmd5\s*=\s*"([0-9a-fA-F]*)"')
+ANDROID_MD5_RE = re.compile(r'\bandroidmd5\s*=\s*"([0-9a-fA-F]*)"')
+
+
+def get_xml_md5(xml_string):
+    """
+    直接从 XML 文本里取出 md5，不解析整个 XML
+    """
+    for pattern in (MD5_RE, ANDROID_MD5_RE):
+        res = pattern.search(xml_string)
+        if res and res.group(1):
+            return res.group(1).lower()
+    return ""
 
 
 def get_most_emoji(messages):
-    dic = {}
+    # 只用正则统计 md5，最后只解析出现次数最多的那一条
+    counter = Counter()
+    first = {}
     for msg in messages:
         str_content = msg[7]
-        emoji_info = parser_xml(str_content)
-        if emoji_info is None:
-            continue
-        md5 = emoji_info["md5"]
+        md5 = get_xml_md5(str_content)
         if not md5:
             continue
-        try:
-            dic[md5][0] += 1
-        except:
-            dic[md5] = [1, emoji_info]
-    md5_nums = [(num[0], key, num[1]) for key, num in dic.items()]
-    md5_nums.sort(key=lambda x: x[0], reverse=True)
-    if not md5_nums:
+        counter[md5] += 1
+        first.setdefault(md5, str_content)
+    if not counter:
         return "", 0
-    md5 = md5_nums[0][1]
-    num = md5_nums[0][0]
-    emoji_info = md5_nums[0][2]
+    md5, num = counter.most_common(1)[0]
+    emoji_info = parser_xml(first[md5])
     url = emoji_info["cdnurl"]
     if not url or url == "":
         url = Emotion().get_emoji_url(md5, False)
@@ -246,18 +260,8 @@ def get_emoji(xml_string, thumb=True, output_path=root_path) -> str:
             emoji_path = download(url, output_path, md5, thumb)
             return emoji_path
         elif type(url) == bytes:
-            image_format = get_image_format(url[:8])
-            if image_format:
-                if thumb:
-                    output_path = os.path.join(
-                        output_path, "th_" + md5 + "." + image_format
-                    )
-                else:
-                    output_path = os.path.join(output_path, md5 + "." + image_format)
-            else:
-                output_path = os.path.join(output_path, md5)
-            with open(output_path, "wb") as f:
-                f.write(url)
+            asset_path = asset_store.put(url, md5=None if thumb else md5)
+            output_path = export_asset(asset_path, output_path, md5, thumb)
             print("表情包数据库加载", output_path)
             return output_path
         else:
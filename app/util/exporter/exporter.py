@@ -93,8 +93,10 @@ class ExporterBase(QThread):
     CONTACT_CSV = 4
     TXT = 5
 
-    def __init__(self, contact, type_=DOCX, message_types={}, time_range=None, messages=None,index=0, parent=None):
+    def __init__(self, contact, type_=DOCX, message_types={}, time_range=None, messages=None,index=0, offline=False,
+                 parent=None):
         super().__init__(parent)
+        self.offline = offline  # 离线导出，音乐地址和网站名称只从本地缓存读取
         self.message_types = message_types  # 导出的消息类型
         self.contact: Contact = contact  # 联系人
         self.output_type = type_  # 导出文件类型
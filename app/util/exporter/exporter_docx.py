@@ -150,7 +150,7 @@ class DocxExporter(ExporterBase):
         """
         str_time = message[8]
         is_send = message[4]
-        content = parser_reply(message[11])
+        content = parser_reply(message[11], message[9])
         refer_msg = content.get('refer')
         timestamp = message[5]
         is_chatroom = 1 if self.contact.is_chatroom else 0
@@ -242,10 +242,10 @@ class DocxExporter(ExporterBase):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
         is_send = message[4]
         timestamp = message[5]
-        content = music_share(message[11])
+        content = music_share(message[11], message[9], offline=self.offline)
         music_path = ''
         if content.get('audio_url') != '':
-            music_path = get_music_path(content.get('audio_url'), content.get('title'),
+            music_path = get_music_path(content.get('audio_url'), content.get('title'), offline=self.offline,
                                         output_path=origin_path + '/music')
             if music_path != '':
                 music_path = f'./music/{os.path.basename(music_path)}'
@@ -260,7 +260,7 @@ class DocxExporter(ExporterBase):
         timestamp = message[5]
         bytesExtra = message[10]
         compress_content_ = message[11]
-        card_data = share_card(bytesExtra, compress_content_)
+        card_data = share_card(bytesExtra, compress_content_, message[9])
         is_chatroom = 1 if self.contact.is_chatroom else 0
         avatar = self.get_avatar_path(is_send, message)
         display_name = self.get_display_name(is_send, message)
@@ -306,21 +306,12 @@ class DocxExporter(ExporterBase):
     def export(self):
         print(f"【开始导出 DOCX {self.contact.remark}】")
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages(self.contact.wxid, time_range=self.time_range)
+        total_num = msg_db.get_messages_number(self.contact.wxid, time_range=self.time_range)
+        messages = msg_db.iter_messages(self.contact.wxid, time_range=self.time_range)
         Me().save_avatar(os.path.join(origin_path, 'avatar', f'{Me().wxid}.png'))
-        if self.contact.is_chatroom:
-            for message in messages:
-                if message[4]:  # is_send
-                    continue
-                try:
-                    chatroom_avatar_path =os.path.join(origin_path, 'avatar', f'{message[13].wxid}.png')
-                    message[13].save_avatar(chatroom_avatar_path)
-                except:
-                    print(message)
-                    pass
-        else:
+        if not self.contact.is_chatroom:
             self.contact.save_avatar(os.path.join(origin_path, 'avatar', f'{self.contact.wxid}.png'))
-        self.rangeSignal.emit(len(messages))
+        self.rangeSignal.emit(total_num)
 
         def newdoc():
             nonlocal n, doc
@@ -340,6 +331,13 @@ class DocxExporter(ExporterBase):
                 self.okSignal.emit(n)
                 newdoc()
 
+            if self.contact.is_chatroom and not message[4]:
+                # 群成员头像在第一次遇到时保存
+                try:
+                    chatroom_avatar_path = os.path.join(origin_path, 'avatar', f'{message[13].wxid}.png')
+                    message[13].save_avatar(chatroom_avatar_path)
+                except:
+                    print(message)
             type_ = message[2]
             sub_type = message[3]
             timestamp = message[5]
@@ -364,9 +362,9 @@ class DocxExporter(ExporterBase):
             elif type_ == 49 and sub_type == 6 and self.message_types.get(4906):
                 self.file(doc, message)
             if index % 25 == 0:
-                print(f"【导出 DOCX {self.contact.remark}】{index}/{len(messages)}")
+                print(f"【导出 DOCX {self.contact.remark}】{index}/{total_num}")
         if index % 25:
-            print(f"【导出 DOCX {self.contact.remark}】{index + 1}/{len(messages)}")
+            print(f"【导出 DOCX {self.contact.remark}】{index + 1}/{total_num}")
         filename = os.path.join(origin_path, f"{self.contact.remark}_{n}.docx")
         try:
             # document.save(filename)
@@ -1,5 +1,4 @@
 import os
-import shutil
 import sys
 import traceback
 from re import findall
@@ -8,14 +7,16 @@ from PyQt5.QtCore import pyqtSignal, QThread
 
 from app.DataBase import msg_db, hard_link_db, media_msg_db
 from app.util.exporter.exporter import ExporterBase, escape_js_and_html
+from app.util.exporter.media_pool import MediaTaskPool, copy_media
 from app.config import OUTPUT_DIR
 from app.log import logger
 from app.person import Me
 from app.util import path
-from app.util.compress_content import parser_reply, share_card, music_share, file, transfer_decompress, call_decompress
+from app.util.compress_content import parser_reply, share_card, music_share, file, transfer_decompress, call_decompress, \
+    prefetch_music_share
 from app.util.emoji import get_emoji_url
 from app.util.image import get_image_path, get_image
-from app.util.music import get_music_path
+from app.util.music import get_music_path, prefetch_music
 
 icon_files = {
     './icon/word.png': ['doc', 'docx'],
@@ -108,7 +109,7 @@ class HtmlExporter(ExporterBase):
         is_chatroom = 1 if self.contact.is_chatroom else 0
         avatar = self.get_avatar_path(is_send, message)
         display_name = self.get_display_name(is_send, message)
-        file_info = file(bytesExtra, compress_content, output_path=origin_path + '/file')
+        file_info = file(bytesExtra, compress_content, output_path=origin_path + '/file', msg_svr_id=message[9])
         if file_info.get('is_error') == False:
             icon_path = None
             for icon, extensions in icon_files.items():
@@ -135,7 +136,7 @@ class HtmlExporter(ExporterBase):
         """
         str_time = message[8]
         is_send = message[4]
-        content = parser_reply(message[11])
+        content = parser_reply(message[11], message[9])
         refer_msg = content.get('refer')
         timestamp = message[5]
         is_chatroom = 1 if self.contact.is_chatroom else 0
@@ -202,9 +203,7 @@ class HtmlExporter(ExporterBase):
         video_path = video_path.replace('\\', '/')
         if os.path.exists(video_path):
             new_path = origin_path + '/video/' + os.path.basename(video_path)
-            if not os.path.exists(new_path):
-                shutil.copy(video_path, os.path.join(origin_path, 'video'))
-            os.utime(new_path, (timestamp, timestamp))
+            self.media_pool.submit(copy_media, video_path, new_path, timestamp)
             video_path = f'./video/{os.path.basename(video_path)}'
         doc.write(
             f'''{{ type:{type_}, text: '{video_path}',is_send:{is_send},avatar_path:'{avatar}',timestamp:{timestamp},is_chatroom:{is_chatroom},displayname:'{display_name}'}},'''
@@ -214,11 +213,11 @@ class HtmlExporter(ExporterBase):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
         is_send = message[4]
         timestamp = message[5]
-        content = music_share(message[11])
+        content = music_share(message[11], message[9], offline=self.offline)
         music_path = ''
         if content.get('is_error') == False:
             if content.get('audio_url') != '':
-                music_path = get_music_path(content.get('audio_url'), content.get('title'),
+                music_path = get_music_path(content.get('audio_url'), content.get('title'), offline=self.offline,
                                             output_path=origin_path + '/music')
                 if music_path != '':
                     music_path = f'./music/{os.path.basename(music_path)}'
@@ -237,7 +236,7 @@ class HtmlExporter(ExporterBase):
         timestamp = message[5]
         bytesExtra = message[10]
         compress_content_ = message[11]
-        card_data = share_card(bytesExtra, compress_content_)
+        card_data = share_card(bytesExtra, compress_content_, message[9])
         is_chatroom = 1 if self.contact.is_chatroom else 0
         avatar = self.get_avatar_path(is_send, message)
         display_name = self.get_display_name(is_send, message)
@@ -245,7 +244,8 @@ class HtmlExporter(ExporterBase):
         if card_data.get('thumbnail'):
             thumbnail = os.path.join(Me().wx_dir, card_data.get('thumbnail'))
             if os.path.exists(thumbnail):
-                shutil.copy(thumbnail, os.path.join(origin_path, 'image', os.path.basename(thumbnail)))
+                self.media_pool.submit(copy_media, thumbnail,
+                                       os.path.join(origin_path, 'image', os.path.basename(thumbnail)))
                 thumbnail = './image/' + os.path.basename(thumbnail)
             else:
                 thumbnail = ''
@@ -253,7 +253,8 @@ class HtmlExporter(ExporterBase):
         if card_data.get('app_logo'):
             app_logo = os.path.join(Me().wx_dir, card_data.get('app_logo'))
             if os.path.exists(app_logo):
-                shutil.copy(app_logo, os.path.join(origin_path, 'image', os.path.basename(app_logo)))
+                self.media_pool.submit(copy_media, app_logo,
+                                       os.path.join(origin_path, 'image', os.path.basename(app_logo)))
                 app_logo = './image/' + os.path.basename(app_logo)
             else:
                 app_logo = card_data.get('app_logo')
@@ -266,7 +267,7 @@ class HtmlExporter(ExporterBase):
         timestamp = message[5]
         compress_content_ = message[11]
         # open("test.bin", "wb").write(compress_content_)
-        transfer_detail = transfer_decompress(compress_content_)
+        transfer_detail = transfer_decompress(compress_content_, message[9])
         is_chatroom = 1 if self.contact.is_chatroom else 0
         avatar = self.get_avatar_path(is_send, message)
         display_name = self.get_display_name(is_send, message)
@@ -301,7 +302,8 @@ class HtmlExporter(ExporterBase):
 
     def export(self):
         print(f"【开始导出 HTML {self.contact.remark}】")
-        messages = msg_db.get_messages(self.contact.wxid, time_range=self.time_range)
+        total_num = msg_db.get_messages_number(self.contact.wxid, time_range=self.time_range)
+        messages = msg_db.iter_messages(self.contact.wxid, time_range=self.time_range)
         filename = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark,
                                 f'{self.contact.remark}.html')
         file_path = './app/resources/data/template.html'
@@ -316,46 +318,60 @@ class HtmlExporter(ExporterBase):
         html_head = html_head.replace("<title>出错了</title>", f"<title>{self.contact.remark}</title>")
         html_head = html_head.replace("<p id=\"title\">出错了</p>", f"<p id=\"title\">{self.contact.remark}</p>")
         f.write(html_head)
-        self.rangeSignal.emit(len(messages))
-        for index, message in enumerate(messages):
-            type_ = message[2]
-            sub_type = message[3]
-            timestamp = message[5]
-            if (type_ == 3 and self.message_types.get(3)) or (type_ == 34 and self.message_types.get(34)) or (
-                    type_ == 47 and self.message_types.get(47)):
-                pass
-            else:
-                self.progressSignal.emit(1)
-
-            if type_ == 1 and self.message_types.get(type_):
-                self.text(f, message)
-            elif type_ == 3 and self.message_types.get(type_):
-                self.image(f, message)
-            elif type_ == 34 and self.message_types.get(type_):
-                self.audio(f, message)
-            elif type_ == 43 and self.message_types.get(type_):
-                self.video(f, message)
-            elif type_ == 47 and self.message_types.get(type_):
-                self.emoji(f, message)
-            elif type_ == 10000 and self.message_types.get(type_):
-                self.system_msg(f, message)
-            elif type_ == 49 and sub_type == 57 and self.message_types.get(1):
-                self.refermsg(f, message)
-            elif type_ == 49 and sub_type == 6 and self.message_types.get(4906):
-                self.file(f, message)
-            elif type_ == 49 and sub_type == 3 and self.message_types.get(4903):
-                self.music_share(f, message)
-            elif type_ == 49 and sub_type == 5 and self.message_types.get(4905):
-                self.share_card(f, message)
-            elif type_ == 49 and sub_type == 2000 and self.message_types.get(492000):
-                self.transfer(f, message)
-            elif type_ == 50 and self.message_types.get(50):
-                self.call(f, message)
-            if index % 2000 == 0:
-                print(f"【导出 HTML {self.contact.remark}】{index}/{len(messages)}")
+        self.rangeSignal.emit(total_num)
+        if self.message_types.get(4903) and not self.offline:
+            # 音乐分享的播放地址、网站名称和音乐文件先并发获取，写 HTML 时直接查缓存
+            audio_urls = prefetch_music_share(
+                message for message in msg_db.iter_messages_by_type(self.contact.wxid, 49, time_range=self.time_range)
+                if message[3] == 3
+            )
+            prefetch_music(audio_urls)
+        # 视频、缩略图的拷贝交给线程池，和写 HTML 并行
+        self.media_pool = MediaTaskPool()
+        try:
+            for index, message in enumerate(messages):
+                if self.isInterruptionRequested():
+                    break
+                type_ = message[2]
+                sub_type = message[3]
+                timestamp = message[5]
+                if (type_ == 3 and self.message_types.get(3)) or (type_ == 34 and self.message_types.get(34)) or (
+                        type_ == 47 and self.message_types.get(47)):
+                    pass
+                else:
+                    self.progressSignal.emit(1)
+
+                if type_ == 1 and self.message_types.get(type_):
+                    self.text(f, message)
+                elif type_ == 3 and self.message_types.get(type_):
+                    self.image(f, message)
+                elif type_ == 34 and self.message_types.get(type_):
+                    self.audio(f, message)
+                elif type_ == 43 and self.message_types.get(type_):
+                    self.video(f, message)
+                elif type_ == 47 and self.message_types.get(type_):
+                    self.emoji(f, message)
+                elif type_ == 10000 and self.message_types.get(type_):
+                    self.system_msg(f, message)
+                elif type_ == 49 and sub_type == 57 and self.message_types.get(1):
+                    self.refermsg(f, message)
+                elif type_ == 49 and sub_type == 6 and self.message_types.get(4906):
+                    self.file(f, message)
+                elif type_ == 49 and sub_type == 3 and self.message_types.get(4903):
+                    self.music_share(f, message)
+                elif type_ == 49 and sub_type == 5 and self.message_types.get(4905):
+                    self.share_card(f, message)
+                elif type_ == 49 and sub_type == 2000 and self.message_types.get(492000):
+                    self.transfer(f, message)
+                elif type_ == 50 and self.message_types.get(50):
+                    self.call(f, message)
+                if index % 2000 == 0:
+                    print(f"【导出 HTML {self.contact.remark}】{index}/{total_num}")
+        finally:
+            self.media_pool.close()
         f.write(html_end)
         f.close()
-        print(f"【完成导出 HTML {self.contact.remark}】{len(messages)}")
+        print(f"【完成导出 HTML {self.contact.remark}】{total_num}")
         self.count_finish_num(1)
 
     def count_finish_num(self, num):
@@ -385,18 +401,15 @@ class OutputMedia(QThread):
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 34)
-        for message in messages:
-            is_send = message[4]
-            msgSvrId = message[9]
-            try:
-                audio_path = media_msg_db.get_audio(
-                    msgSvrId, output_path=origin_path + "/voice"
-                )
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 34)
+        try:
+            media_msg_db.export_audios(
+                (message[9] for message in messages), origin_path + "/voice",
+                callback=lambda reserved0, mp3_path: self.progressSignal.emit(1),
+                is_cancelled=self.isInterruptionRequested
+            )
+        except:
+            logger.error(traceback.format_exc())
         self.okSingal.emit(34)
 
 
@@ -414,7 +427,7 @@ class OutputEmoji(QThread):
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 47)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 47)
         for message in messages:
             str_content = message[7]
             try:
@@ -438,86 +451,30 @@ class OutputImage(QThread):
     def __init__(self, contact):
         super().__init__()
         self.contact = contact
-        self.child_thread_num = 2
-        self.child_threads = [0] * (self.child_thread_num + 1)
-        self.num = 0
 
-    def count1(self, num):
-        self.num += 1
-        print("图片导出完成一个")
-        if self.num == self.child_thread_num:
-            self.okSingal.emit(47)
-            print("图片导出完成")
+    def export_image(self, message, origin_path, base_path):
+        str_content = message[7]
+        BytesExtra = message[10]
+        timestamp = message[5]
+        image_path = hard_link_db.get_image(
+            str_content, BytesExtra, up_dir=Me().wx_dir, thumb=False
+        )
+        image_path = get_image(
+            image_path, base_path=base_path
+        )
+        try:
+            os.utime(origin_path + image_path[1:], (timestamp, timestamp))
+        except:
+            pass
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 3)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 3)
         base_path = os.path.join(OUTPUT_DIR, '聊天记录', self.contact.remark, 'image')
-        for message in messages:
-            str_content = message[7]
-            BytesExtra = message[10]
-            timestamp = message[5]
-            try:
-                image_path = hard_link_db.get_image(
-                    str_content, BytesExtra, thumb=False
-                )
-                if not os.path.exists(os.path.join(Me().wx_dir, image_path)):
-                    image_thumb_path = hard_link_db.get_image(
-                        str_content, BytesExtra, thumb=True
-                    )
-                    if not os.path.exists(os.path.join(Me().wx_dir, image_thumb_path)):
-                        continue
-                    image_path = image_thumb_path
-                image_path = get_image(
-                    image_path, base_path=base_path
-                )
-                try:
-                    os.utime(origin_path + image_path[1:], (timestamp, timestamp))
-                except:
-                    pass
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
-        self.okSingal.emit(47)
-
-
-class OutputImageChild(QThread):
-    okSingal = pyqtSignal(int)
-    progressSignal = pyqtSignal(int)
-
-    def __init__(self, contact, messages):
-        super().__init__()
-        self.contact = contact
-        self.messages = messages
-
-    def run(self):
-        origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        for message in self.messages:
-            str_content = message[7]
-            BytesExtra = message[10]
-            timestamp = message[5]
-            try:
-                image_path = hard_link_db.get_image(
-                    str_content, BytesExtra, thumb=False
-                )
-                if not os.path.exists(os.path.join(Me().wx_dir, image_path)):
-                    image_thumb_path = hard_link_db.get_image(
-                        str_content, BytesExtra, thumb=True
-                    )
-                    if not os.path.exists(os.path.join(Me().wx_dir, image_thumb_path)):
-                        continue
-                    image_path = image_thumb_path
-                image_path = get_image(
-                    image_path, base_path=f"/data/聊天记录/{self.contact.remark}/image"
-                )
-                try:
-                    os.utime(origin_path + image_path[1:], (timestamp, timestamp))
-                except:
-                    pass
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
+        with MediaTaskPool(on_done=lambda future: self.progressSignal.emit(1)) as pool:
+            pool.map(
+                lambda message: self.export_image(message, origin_path, base_path),
+                messages,
+                is_cancelled=self.isInterruptionRequested
+            )
         self.okSingal.emit(47)
-        print("图片子线程完成")
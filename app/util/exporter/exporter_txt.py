@@ -57,7 +57,7 @@ class TxtExporter(ExporterBase):
         """
         str_time = message[8]
         is_send = message[4]
-        content = parser_reply(message[11])
+        content = parser_reply(message[11], message[9])
         refer_msg = content.get('refer')
         display_name = self.get_display_name(is_send, message)
         if refer_msg:
@@ -98,7 +98,7 @@ class TxtExporter(ExporterBase):
         bytesExtra = message[10]
         compress_content_ = message[11]
         str_time = message[8]
-        card_data = share_card(bytesExtra, compress_content_)
+        card_data = share_card(bytesExtra, compress_content_, message[9])
         display_name = self.get_display_name(is_send, message)
         doc.write(
             f'''{str_time} {display_name}
@@ -115,8 +115,8 @@ class TxtExporter(ExporterBase):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
         os.makedirs(origin_path, exist_ok=True)
         filename = os.path.join(origin_path, self.contact.remark+'.txt')
-        messages = msg_db.get_messages(self.contact.wxid, time_range=self.time_range)
-        total_steps = len(messages)
+        total_steps = msg_db.get_messages_number(self.contact.wxid, time_range=self.time_range) or 1
+        messages = msg_db.iter_messages(self.contact.wxid, time_range=self.time_range)
         with open(filename, mode='w', newline='', encoding='utf-8') as f:
             for index, message in enumerate(messages):
                 type_ = message[2]
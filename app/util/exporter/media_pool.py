@@ -0,0 +1,101 @@
+import os
+import shutil
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED, ALL_COMPLETED
+
+from app.log import logger
+
+
+def copy_media(src, dst, timestamp=None):
+    """
+    拷贝媒体文件，目标已存在时跳过，并把修改时间设为消息时间
+    先拷贝到临时文件再改名，并行拷贝同一个文件或者导出中途取消都不会留下不完整的文件
+    @param src: 源文件
+    @param dst: 目标文件
+    @param timestamp: 消息时间戳
+    @return:
+    """
+    if not os.path.exists(dst):
+        tmp_path = f'{dst}.{threading.get_ident()}.tmp'
+        try:
+            shutil.copy(src, tmp_path)
+            os.replace(tmp_path, dst)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    if timestamp:
+        os.utime(dst, (timestamp, timestamp))
+
+
+class MediaTaskPool:
+    """
+    导出图片、视频、文件用的有界线程池
+    排队任务达到 max_pending 时 submit 会等待已有任务完成（背压），
+    所以可以边遍历数据库边提交，不会把整段聊天记录的任务一次性堆进内存。
+    on_done 在提交任务的线程里按完成顺序回调，QThread 可以在这里统一发进度信号
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, on_done=None):
+        self.max_workers = max_workers or min(32, (os.cpu_count() or 1) + 4)
+        self.max_pending = max_pending or self.max_workers * 4
+        self.on_done = on_done
+        self.done_num = 0
+        self.error_num = 0
+        self.pending = set()
+        self.executor = ThreadPoolExecutor(self.max_workers, thread_name_prefix='media')
+
+    def submit(self, fn, *args):
+        if len(self.pending) >= self.max_pending:
+            self._wait(FIRST_COMPLETED)
+        self.pending.add(self.executor.submit(fn, *args))
+
+    def map(self, fn, tasks, is_cancelled=None):
+        """
+        对 tasks 里的每一项执行 fn，is_cancelled() 返回 True 时停止提交并取消未开始的任务
+        @param fn:
+        @param tasks: 可迭代对象，可以是数据库游标生成器
+        @param is_cancelled: 比如 QThread.isInterruptionRequested
+        @return: 完成的任务数
+        """
+        for task in tasks:
+            if is_cancelled and is_cancelled():
+                self.cancel()
+                break
+            self.submit(fn, task)
+        self.join()
+        return self.done_num
+
+    def cancel(self):
+        for future in self.pending:
+            future.cancel()
+
+    def join(self):
+        self._wait(ALL_COMPLETED)
+
+    def close(self):
+        self.join()
+        self.executor.shutdown(wait=True)
+
+    def _wait(self, return_when):
+        if not self.pending:
+            return
+        done, self.pending = wait(self.pending, return_when=return_when)
+        for future in done:
+            if future.cancelled():
+                continue
+            exc = future.exception()
+            if exc:
+                self.error_num += 1
+                logger.error(''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)))
+            self.done_num += 1
+            if self.on_done:
+                self.on_done(future)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type:
+            self.cancel()
+        self.close()
@@ -4,18 +4,15 @@ import time
 import traceback
 from typing import List
 
-import docx
 from PyQt5.QtCore import pyqtSignal, QThread
 from PyQt5.QtWidgets import QFileDialog
-from docx.oxml.ns import qn
-from docxcompose.composer import Composer
 
 from app.util.exporter.exporter_ai_txt import AiTxtExporter
 from app.util.exporter.exporter_csv import CSVExporter
-from app.util.exporter.exporter_docx import DocxExporter
 from app.util.exporter.exporter_html import HtmlExporter
 from app.util.exporter.exporter_json import JsonExporter
 from app.util.exporter.exporter_txt import TxtExporter
+from app.util.exporter.media_pool import MediaTaskPool
 from app.DataBase.hard_link import decodeExtraBuf
 from app.config import OUTPUT_DIR
 from app.DataBase.package_msg import PackageMsg
@@ -48,9 +45,11 @@ class Output(QThread):
     AI_TXT = 7
     Batch = 10086
 
-    def __init__(self, contact, type_=DOCX, message_types={}, sub_type=[], time_range=None, parent=None):
+    def __init__(self, contact, type_=DOCX, message_types={}, sub_type=[], time_range=None, offline=False,
+                 parent=None):
         super().__init__(parent)
         self.children = []
+        self.offline = offline  # 离线导出，不联网获取音乐地址和网站名称
         self.last_timestamp = 0
         self.sub_type = sub_type
         self.time_range = time_range
@@ -99,7 +98,7 @@ class Output(QThread):
                    'StrTime', 'Remark', 'NickName', 'Sender']
 
         packagemsg = PackageMsg()
-        messages = packagemsg.get_package_message_all()
+        messages = packagemsg.iter_package_message_all()
         # 写入CSV文件
         with open(filename, mode='w', newline='', encoding='utf-8-sig') as file:
             writer = csv.writer(file)
@@ -190,6 +189,10 @@ class Output(QThread):
                 self.document.save(file)
             self.okSignal.emit(1)
             return
+        # python-docx 导入很慢，只在导出 docx 时加载
+        import docx
+        from docx.oxml.ns import qn
+        from docxcompose.composer import Composer
         doc = docx.Document(filename)
         self.document.append(doc)
         os.remove(filename)
@@ -207,11 +210,16 @@ class Output(QThread):
             self.document = Composer(doc)
 
     def to_docx(self, contact, message_types, is_batch=False):
+        import docx
+        from docx.oxml.ns import qn
+        from docxcompose.composer import Composer
+        from app.util.exporter.exporter_docx import DocxExporter
         doc = docx.Document()
         doc.styles["Normal"].font.name = "Cambria"
         doc.styles["Normal"]._element.rPr.rFonts.set(qn("w:eastAsia"), "宋体")
         self.document = Composer(doc)
-        Child = DocxExporter(contact, type_=self.DOCX, message_types=message_types, time_range=self.time_range)
+        Child = DocxExporter(contact, type_=self.DOCX, message_types=message_types, time_range=self.time_range,
+                             offline=self.offline)
         self.children.append(Child)
         Child.progressSignal.connect(self.progress)
         if not is_batch:
@@ -247,7 +255,8 @@ class Output(QThread):
         Child.start()
 
     def to_html(self, contact, message_types, is_batch=False):
-        Child = HtmlExporter(contact, type_=self.output_type, message_types=message_types, time_range=self.time_range)
+        Child = HtmlExporter(contact, type_=self.output_type, message_types=message_types, time_range=self.time_range,
+                             offline=self.offline)
         self.children.append(Child)
         Child.progressSignal.connect(self.progress)
         if not is_batch:
@@ -326,6 +335,8 @@ class Output(QThread):
 
     def cancel(self):
         self.requestInterruption()
+        for child in self.children:
+            child.requestInterruption()
 
 
 class OutputMedia(QThread):
@@ -342,16 +353,15 @@ class OutputMedia(QThread):
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 34, time_range=self.time_range)
-        for message in messages:
-            is_send = message[4]
-            msgSvrId = message[9]
-            try:
-                audio_path = media_msg_db.get_audio(msgSvrId, output_path=origin_path + "/voice")
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 34, time_range=self.time_range)
+        try:
+            media_msg_db.export_audios(
+                (message[9] for message in messages), origin_path + "/voice",
+                callback=lambda reserved0, mp3_path: self.progressSignal.emit(1),
+                is_cancelled=self.isInterruptionRequested
+            )
+        except:
+            logger.error(traceback.format_exc())
         self.okSingal.emit(34)
 
 
@@ -369,7 +379,7 @@ class OutputEmoji(QThread):
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 47, time_range=self.time_range)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 47, time_range=self.time_range)
         for message in messages:
             str_content = message[7]
             try:
@@ -392,74 +402,31 @@ class OutputImage(QThread):
     def __init__(self, contact, time_range):
         super().__init__()
         self.contact = contact
-        self.child_thread_num = 2
         self.time_range = time_range
-        self.child_threads = [0] * (self.child_thread_num + 1)
-        self.num = 0
 
-    def count1(self, num):
-        self.num += 1
-        print('图片导出完成一个')
-        if self.num == self.child_thread_num:
-            self.okSingal.emit(47)
-            print('图片导出完成')
+    def export_image(self, message, origin_path, base_path):
+        str_content = message[7]
+        BytesExtra = message[10]
+        timestamp = message[5]
+        image_path = hard_link_db.get_image(str_content, BytesExtra, up_dir=Me().wx_dir, thumb=False)
+        image_path = get_image(image_path, base_path=base_path)
+        try:
+            os.utime(origin_path + image_path[1:], (timestamp, timestamp))
+        except:
+            pass
 
     def run(self):
         origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        messages = msg_db.get_messages_by_type(self.contact.wxid, 3, time_range=self.time_range)
+        messages = msg_db.iter_messages_by_type(self.contact.wxid, 3, time_range=self.time_range)
         base_path = os.path.join(OUTPUT_DIR, '聊天记录', self.contact.remark, 'image')
-        for message in messages:
-            str_content = message[7]
-            BytesExtra = message[10]
-            timestamp = message[5]
-            try:
-                image_path = hard_link_db.get_image(str_content, BytesExtra, up_dir=Me().wx_dir, thumb=False)
-                image_path = get_image(image_path, base_path=base_path)
-                try:
-                    os.utime(origin_path + image_path[1:], (timestamp, timestamp))
-                except:
-                    pass
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
-        self.okSingal.emit(47)
-
-
-class OutputImageChild(QThread):
-    okSingal = pyqtSignal(int)
-    progressSignal = pyqtSignal(int)
-
-    def __init__(self, contact, messages, time_range):
-        super().__init__()
-        self.contact = contact
-        self.messages = messages
-        self.time_range = time_range
-
-    def run(self):
-        origin_path = os.path.join(os.getcwd(), OUTPUT_DIR, '聊天记录', self.contact.remark)
-        for message in self.messages:
-            str_content = message[7]
-            BytesExtra = message[10]
-            timestamp = message[5]
-            try:
-                image_path = hard_link_db.get_image(str_content, BytesExtra, thumb=False)
-                if not os.path.exists(os.path.join(Me().wx_dir, image_path)):
-                    image_thumb_path = hard_link_db.get_image(str_content, BytesExtra, thumb=True)
-                    if not os.path.exists(os.path.join(Me().wx_dir, image_thumb_path)):
-                        continue
-                    image_path = image_thumb_path
-                image_path = get_image(image_path, base_path=f'/data/聊天记录/{self.contact.remark}/image')
-                try:
-                    os.utime(origin_path + image_path[1:], (timestamp, timestamp))
-                except:
-                    pass
-            except:
-                logger.error(traceback.format_exc())
-            finally:
-                self.progressSignal.emit(1)
+        # 查找、解密、写入在线程池里并行，进度统一由当前线程发出
+        with MediaTaskPool(on_done=lambda future: self.progressSignal.emit(1)) as pool:
+            pool.map(
+                lambda message: self.export_image(message, origin_path, base_path),
+                messages,
+                is_cancelled=self.isInterruptionRequested
+            )
         self.okSingal.emit(47)
-        print('图片子线程完成')
 
 
 if __name__ == "__main__":
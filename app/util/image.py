@@ -1,5 +1,7 @@
 import os
+import threading
 import traceback
+from functools import lru_cache
 
 from app.log import logger
 from app.person import Me
@@ -11,6 +13,18 @@ from app.person import Me
 pic_head = [0xff, 0xd8, 0x89, 0x50, 0x47, 0x49]
 # 解密码
 decode_code = 0
+# 流式解密时每次读取的字节数
+CHUNK_SIZE = 1 << 20
+
+
+@lru_cache(maxsize=256)
+def get_xor_table(code) -> bytes:
+    """
+    生成异或解密用的 256 字节转换表，配合 bytes.translate 整块解密
+    :param code: 解密码
+    :return: table[i] = i ^ code
+    """
+    return bytes(i ^ code for i in range(256))
 
 
 def get_code(dat_read) -> tuple[int, int]:
@@ -48,9 +62,9 @@ def decode_dat(file_path, out_path) -> str:
     if not os.path.exists(file_path):
         return None
     with open(file_path, 'rb') as file_in:
-        data = file_in.read()
+        data = file_in.read(2)
 
-    file_type, decode_code = get_code(data[:2])
+    file_type, decode_code = get_code(data)
     if decode_code == -1:
         return ''
 
@@ -67,9 +81,21 @@ def decode_dat(file_path, out_path) -> str:
     if os.path.exists(file_outpath):
         return file_outpath
 
-    # 对数据进行异或加密/解密
-    with open(file_outpath, 'wb') as file_out:
-        file_out.write(bytes([byte ^ decode_code for byte in data]))
+    # 对数据进行异或加密/解密，按块查表转换，内存占用与图片大小无关
+    # 先写临时文件再改名，多个线程同时导出同一张图片、或者导出中途取消，都不会留下不完整的图片
+    table = get_xor_table(decode_code)
+    tmp_path = f'{file_outpath}.{threading.get_ident()}.tmp'
+    try:
+        with open(file_path, 'rb') as file_in, open(tmp_path, 'wb') as file_out:
+            while True:
+                chunk = file_in.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                file_out.write(chunk.translate(table))
+        os.replace(tmp_path, file_outpath)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     print(file_path, '->', file_outpath)
     return file_outpath
 
@@ -132,4 +158,14 @@ def get_image_path(path, base_path) -> str:
 
 
 if __name__ == "__main__":
-    pass
+    # 解密速度对比：逐字节异或 vs 查表转换
+    import timeit
+
+    data = os.urandom(4 * 1024 * 1024)
+    code = 0x5a
+    table = get_xor_table(code)
+    assert bytes([byte ^ code for byte in data]) == data.translate(table)
+    loop_time = timeit.timeit(lambda: bytes([byte ^ code for byte in data]), number=3) / 3
+    table_time = timeit.timeit(lambda: data.translate(table), number=3) / 3
+    print(f'4MB 逐字节异或: {loop_time * 1000:.1f}ms')
+    print(f'4MB 查表转换: {table_time * 1000:.1f}ms ({loop_time / table_time:.0f}x)')
@@ -0,0 +1,222 @@
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from app.log import logger
+
+# 网站名称和音乐播放地址的本地缓存，导出过一次之后离线也能用
+CACHE_PATH = './data/link_meta.db'
+TIMEOUT = (3, 5)  # 连接超时、读取超时（秒）
+MAX_WORKERS = 8  # 同时进行的请求数
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/87.0.4280.40 Safari/537.36 Edg/87.0.664.24'
+}
+
+SITE = 'site'  # 域名 -> 网站名称
+AUDIO = 'audio'  # 分享链接 -> 实际播放地址
+
+
+class LinkMetaCache:
+    """
+    持久化的链接信息缓存
+    只缓存请求成功得到的结果（包括空结果），网络错误不缓存，下次导出时会重试
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS LinkMeta(
+                    Kind TEXT,
+                    Key TEXT,
+                    Value TEXT,
+                    FetchTime INTEGER,
+                    PRIMARY KEY (Kind, Key)
+                ) WITHOUT ROWID;
+            ''')
+        return self._conn
+
+    def get(self, kind, key):
+        """
+        @return: 没有缓存时返回 None
+        """
+        with self._lock:
+            row = self._connect().execute(
+                'SELECT Value FROM LinkMeta WHERE Kind=? AND Key=?;', (kind, key)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set(self, kind, key, value):
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute(
+                    'INSERT OR REPLACE INTO LinkMeta (Kind,Key,Value,FetchTime) VALUES(?,?,?,?);',
+                    (kind, key, value, int(time.time()))
+                )
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+link_meta_cache = LinkMetaCache()
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """
+    所有请求共用一个 Session，复用 TCP/TLS 连接
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=MAX_WORKERS)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update(HEADERS)
+            _session = session
+    return _session
+
+
+def get_domain(url):
+    parsed_url = urlparse(url)
+    return f"{parsed_url.scheme}://{parsed_url.netloc}"
+
+
+def parse_title(content) -> str:
+    from bs4 import BeautifulSoup  # 只有这里用到，启动时不加载
+    soup = BeautifulSoup(content, "html.parser")
+    if soup.title is None or soup.title.string is None:
+        return ''
+    return soup.title.string.strip()
+
+
+def fetch_website_name(url):
+    """
+    请求网站首页读取 <title>
+    @return: 网络错误时返回 None
+    """
+    session = get_session()
+    domain = get_domain(url)
+    try:
+        response = session.get(domain, allow_redirects=False, timeout=TIMEOUT)
+        if response.status_code == 200:
+            return parse_title(response.content)
+        if response.status_code == 302:
+            response = session.get(response.headers["Location"], allow_redirects=False, timeout=TIMEOUT)
+            return parse_title(response.content)
+        response = session.get(url, allow_redirects=False, timeout=TIMEOUT)
+        if response.status_code != 200:
+            return ''
+        website_name = parse_title(response.content)
+        index = website_name.find("-")
+        if index != -1:  # 如果找到了 "-"
+            website_name = website_name[index + 1:].strip()
+        return website_name
+    except Exception as e:
+        print(f"Get Website Info Error: {e}")
+        return None
+
+
+def fetch_audio_url(url):
+    """
+    分享链接会 302 跳转到实际的播放地址
+    @return: 网络错误时返回 None
+    """
+    try:
+        response = get_session().get(url, allow_redirects=False, timeout=TIMEOUT)
+        # 检查响应状态码
+        if response.status_code == 302:
+            return response.headers["Location"]
+        if response.status_code == 200:
+            print("音乐文件已失效,url:" + url)
+        else:
+            print("音乐文件地址获取失败,url:" + url + ",状态码" + str(response.status_code))
+        return ''
+    except Exception as e:
+        print(f"Get Audio Url Error: {e}")
+        return None
+
+
+def get_website_name(url, offline=False) -> str:
+    """
+    @param url:
+    @param offline: 离线模式只查本地缓存，不联网
+    @return: 网站名称，获取不到时返回空字符串
+    """
+    if not url:
+        return ''
+    domain = get_domain(url)
+    website_name = link_meta_cache.get(SITE, domain)
+    if website_name is not None or offline:
+        return website_name or ''
+    website_name = fetch_website_name(url)
+    if website_name is None:
+        return ''
+    link_meta_cache.set(SITE, domain, website_name)
+    return website_name
+
+
+def get_audio_url(url, offline=False) -> str:
+    """
+    @param url:
+    @param offline: 离线模式只查本地缓存，不联网
+    @return: 实际播放地址，获取不到时返回空字符串
+    """
+    if not url:
+        return ''
+    audio_url = link_meta_cache.get(AUDIO, url)
+    if audio_url is not None or offline:
+        return audio_url or ''
+    audio_url = fetch_audio_url(url)
+    if audio_url is None:
+        return ''
+    link_meta_cache.set(AUDIO, url, audio_url)
+    return audio_url
+
+
+def prefetch(site_urls=(), audio_urls=(), max_workers=MAX_WORKERS):
+    """
+    并发获取还没有缓存的网站名称和播放地址，之后导出时直接命中缓存
+    @param site_urls: 需要网站名称的链接
+    @param audio_urls: 需要解析播放地址的链接
+    @param max_workers: 最大并发数
+    @return: 实际发出请求的链接数
+    """
+    tasks = {}
+    for url in site_urls:
+        key = (SITE, get_domain(url)) if url else None
+        if key and key not in tasks and link_meta_cache.get(*key) is None:
+            tasks[key] = (get_website_name, url)
+    for url in audio_urls:
+        key = (AUDIO, url) if url else None
+        if key and key not in tasks and link_meta_cache.get(*key) is None:
+            tasks[key] = (get_audio_url, url)
+    if not tasks:
+        return 0
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='link_meta') as executor:
+        futures = [executor.submit(fn, url) for fn, url in tasks.values()]
+        for future in futures:
+            exc = future.exception()
+            if exc:
+                logger.error(f'获取链接信息失败: {exc}')
+    return len(tasks)
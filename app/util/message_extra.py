@@ -0,0 +1,108 @@
+import threading
+import xml.etree.ElementTree as ET
+from collections import OrderedDict
+from functools import lru_cache
+
+from app.util.protocbuf.msg_pb2 import MessageBytesExtra
+
+# BytesExtra 里 message2 的字段编号
+SENDER = 1  # 群聊里的发送人 wxid
+THUMB = 3  # 缩略图路径（通话消息里是通话类型）
+ORIGINAL = 4  # 原图、视频、文件路径（通话消息里是通话时长）
+
+
+def strip_wxid_dir(path) -> str:
+    """
+    wxid\\FileStorage\\... -> FileStorage\\...
+    """
+    return "\\".join(path.split("\\")[1:])
+
+
+class MessageExtra:
+    """
+    一条消息的 BytesExtra 解析一次之后的结果
+    群聊发送人、图片和视频的路径都从这里取，不用每个地方各自解析一遍。
+    同样的 BytesExtra 共用一个对象，构造之后只读
+    """
+    __slots__ = ('sender', 'thumb', 'original', 'fields')
+
+    def __init__(self, bytes_extra: bytes = None):
+        self.sender = ''
+        self.thumb = ''
+        self.original = ''
+        self.fields = ()  # message2 的全部 (field1, field2)，其它用法自己遍历
+        if not bytes_extra:
+            return
+        msg_bytes = MessageBytesExtra()
+        msg_bytes.ParseFromString(bytes_extra)
+        self.fields = tuple((tmp.field1, tmp.field2) for tmp in msg_bytes.message2)
+        thumb = original = None
+        for field1, field2 in self.fields:
+            if field1 == SENDER:
+                self.sender = field2
+            elif field1 == THUMB and thumb is None:
+                thumb = field2
+            elif field1 == ORIGINAL and original is None:
+                original = field2
+        self.thumb = strip_wxid_dir(thumb) if thumb else ''
+        self.original = strip_wxid_dir(original) if original else ''
+
+
+@lru_cache(maxsize=1024)
+def parse_media_md5(content):
+    """
+    解析消息 XML 里图片和视频的 md5，结果只和 content 有关，按 content 缓存
+    @param content: StrContent
+    @return: (image_md5, video_md5)
+    """
+    image_md5, video_md5 = '', ''
+    try:
+        root = ET.fromstring(content)
+        img = root.find(".//img")
+        if img is not None:
+            image_md5 = img.get("md5") or ''
+        video = root.find(".//videomsg")
+        if video is not None:
+            video_md5 = video.get("md5") or ''
+    except (ET.ParseError, TypeError):
+        pass
+    return image_md5, video_md5
+
+
+class MessageExtraCache:
+    """
+    MessageExtra 的 LRU 缓存，以 BytesExtra 本身为键
+    同一条消息在群聊发送人解析、导出图片视频、通话消息里会被多次用到，只解析一次。
+    缓存的对象被多条消息、多个线程共用，只读，不要修改
+    """
+
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, bytes_extra: bytes) -> MessageExtra:
+        if not bytes_extra:
+            return MessageExtra()
+        with self._lock:
+            extra = self._cache.get(bytes_extra)
+            if extra is not None:
+                self._cache.move_to_end(bytes_extra)
+                return extra
+        extra = MessageExtra(bytes_extra)
+        with self._lock:
+            self._cache[bytes_extra] = extra
+            if len(self._cache) > self.maxsize:
+                self._cache.popitem(last=False)
+        return extra
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+message_extra_cache = MessageExtraCache()
+
+
+def get_message_extra(bytes_extra: bytes) -> MessageExtra:
+    return message_extra_cache.get(bytes_extra)
@@ -3,6 +3,7 @@ import traceback
 import shutil
 
 from app.log import log, logger
+from app.util.asset_store import asset_store, link_file
 from app.util.protocbuf.msg_pb2 import MessageBytesExtra
 import requests
 from urllib.parse import urlparse, parse_qs
@@ -20,7 +21,7 @@ class File:
         self.open_flag = False
 
 
-def get_music_path(url, file_title, output_path=root_path) -> str:
+def get_music_path(url, file_title, output_path=root_path, offline=False) -> str:
     try:
         parsed_url = urlparse(url)
         if '.' in parsed_url.path:
@@ -34,17 +35,15 @@ def get_music_path(url, file_title, output_path=root_path) -> str:
             if os.path.exists(music_path):
                 # print('文件' + music_path + '已存在')
                 return music_path
-            header = {
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.40 Safari/537.36 Edg/87.0.664.24'
-            }
+            # 同一首歌只下载一次，各个导出目录里都是仓库文件的硬链接
             requests.packages.urllib3.disable_warnings()
-            response = requests.get(url,headers=header,verify=False)
-            if response.status_code == 200:
-                with open(music_path, 'wb') as f:
-                    f.write(response.content)
+            asset_path = asset_store.fetch(url, ext='.' + file_extension, offline=offline, verify=False)
+            if asset_path:
+                link_file(asset_path, music_path)
             else:
                 music_path = ''
-                print("音乐" + file_name + "获取失败：请求地址：" + url)
+                if not offline:
+                    print("音乐" + file_name + "获取失败：请求地址：" + url)
         else:
             music_path = ''
             print('音乐文件已失效，url：' + url)
@@ -53,3 +52,19 @@ def get_music_path(url, file_title, output_path=root_path) -> str:
         print(f"Get Music Path Error: {e}")
         logger.error(traceback.format_exc())
         return ""
+
+
+def prefetch_music(urls, max_workers=None):
+    """
+    导出前并发下载音乐文件，之后 get_music_path 直接从仓库链接
+    @param urls: 实际播放地址
+    @param max_workers: 最大并发数
+    @return: 需要下载的文件数
+    """
+    items = []
+    for url in urls:
+        path = urlparse(url).path if url else ''
+        if '.' in path:
+            items.append((url, None, '.' + path.split('.')[-1]))
+    requests.packages.urllib3.disable_warnings()
+    return asset_store.prefetch(items, max_workers, verify=False)
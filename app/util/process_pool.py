@@ -0,0 +1,36 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Windows 下进程池最多 61 个进程
+MAX_WORKERS = min(os.cpu_count() or 1, 61)
+
+_executor = None
+_lock = threading.Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    """
+    程序里共用的进程池，第一次用到时才创建
+    语音转换、解密数据库和词频统计都交给它，子进程启动一次之后一直复用，
+    不用每次导出一个联系人就重新启动一批进程、重新导入一遍模块
+    @return:
+    """
+    global _executor
+    with _lock:
+        # 子进程异常退出后进程池就不能再用了，重新创建一个
+        if _executor is None or getattr(_executor, '_broken', False):
+            _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+        return _executor
+
+
+def shutdown():
+    """
+    程序退出时关闭进程池，取消还没开始的任务
+    @return:
+    """
+    global _executor
+    with _lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
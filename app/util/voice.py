@@ -0,0 +1,228 @@
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import wait, FIRST_COMPLETED
+
+from app.log import logger
+from app.util import process_pool
+
+SAMPLE_RATE = 44100  # 解码和输出的采样率，和原来用 pilk 转换的结果一致
+MANIFEST_NAME = '.voice_manifest.json'  # 记录已经转换完成的语音，重复导出时直接跳过
+SILK_HEADER = b'#!SILK_V3'
+
+
+def get_ffmpeg_path():
+    """
+    依次查找打包后的资源目录、源码目录下的 ffmpeg.exe，最后查找系统 PATH 里的 ffmpeg
+    """
+    candidates = []
+    if hasattr(sys, '_MEIPASS'):
+        candidates.append(os.path.join(sys._MEIPASS, 'app', 'resources', 'data', 'ffmpeg.exe'))
+    candidates.append(os.path.join(os.getcwd(), 'app', 'resources', 'data', 'ffmpeg.exe'))
+    for path in candidates:
+        if os.path.exists(path):
+            return path
+    return shutil.which('ffmpeg') or candidates[-1]
+
+
+def decode_silk(buf: bytes, sample_rate=SAMPLE_RATE) -> bytes:
+    """
+    在内存里把语音解码成 16 位单声道 PCM，不写临时文件
+    微信的 silk 数据开头多一个 0x02，去掉之后就是标准的 silk
+    """
+    import pysilk
+    if buf[:1] == b'\x02' and buf[1:1 + len(SILK_HEADER)] == SILK_HEADER:
+        buf = buf[1:]
+    pcm = io.BytesIO()
+    pysilk.decode(io.BytesIO(buf), pcm, sample_rate)
+    return pcm.getvalue()
+
+
+def transcode(buf: bytes, mp3_path, sample_rate=SAMPLE_RATE, ffmpeg_path=None) -> float:
+    """
+    语音转成 mp3，PCM 通过管道交给 ffmpeg，不经过 shell
+    在进程池里执行，先写临时文件再改名，中途退出不会留下不完整的 mp3
+    @param buf: MediaMSG 里的语音数据
+    @param mp3_path: 输出路径
+    @param sample_rate:
+    @param ffmpeg_path:
+    @return: 语音时长（秒）
+    """
+    pcm = decode_silk(buf, sample_rate)
+    tmp_path = f'{mp3_path}.{os.getpid()}.tmp'
+    cmd = [
+        ffmpeg_path or get_ffmpeg_path(), '-loglevel', 'quiet', '-y',
+        '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0',
+        '-ar', str(SAMPLE_RATE), '-ac', '1', '-f', 'mp3', tmp_path
+    ]
+    try:
+        subprocess.run(
+            cmd, input=pcm, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+            creationflags=getattr(subprocess, 'CREATE_NO_WINDOW', 0)  # 不弹出控制台窗口
+        )
+        os.replace(tmp_path, mp3_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return len(pcm) / 2 / sample_rate
+
+
+class Manifest:
+    """
+    输出目录里已经转换好的语音，记录 mp3 的大小
+    mp3 存在且大小一致才算转换完成
+    """
+
+    def __init__(self, output_path):
+        self.path = os.path.join(output_path, MANIFEST_NAME)
+        self.output_path = output_path
+        self.items = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    self.items = json.load(f)
+            except (OSError, ValueError):
+                self.items = {}
+
+    def mp3_path(self, reserved0):
+        return os.path.join(self.output_path, f'{reserved0}.mp3')
+
+    def is_done(self, reserved0) -> bool:
+        size = self.items.get(str(reserved0))
+        if size is None:
+            return False
+        try:
+            return os.path.getsize(self.mp3_path(reserved0)) == size
+        except OSError:
+            return False
+
+    def add(self, reserved0):
+        self.items[str(reserved0)] = os.path.getsize(self.mp3_path(reserved0))
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.items, f)
+        os.replace(tmp_path, self.path)
+
+
+class TranscodeStats:
+    """
+    转换的吞吐量统计
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.elapsed = 0.0
+        self.total = 0  # 处理的语音条数
+        self.converted = 0
+        self.skipped = 0  # 之前已经转换过
+        self.missing = 0  # 数据库里没有语音数据
+        self.failed = 0
+        self.input_bytes = 0
+        self.audio_seconds = 0.0
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.start
+        return self
+
+    @property
+    def items_per_second(self):
+        return self.converted / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def realtime_factor(self):
+        """
+        每秒钟转换的语音时长（秒）
+        """
+        return self.audio_seconds / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'语音转换: 共{self.total}条，转换{self.converted}条，跳过{self.skipped}条，'
+                f'无数据{self.missing}条，失败{self.failed}条，耗时{self.elapsed:.2f}s，'
+                f'{self.items_per_second:.1f}条/s，{self.input_bytes / 1024 / 1024 / (self.elapsed or 1):.2f}MB/s，'
+                f'{self.realtime_factor:.1f}倍速')
+
+
+def transcode_all(items, output_path, get_buffer, max_workers=None, callback=None,
+                  is_cancelled=None) -> TranscodeStats:
+    """
+    批量转换语音
+    已转换过的直接跳过，不读取语音数据；其余的交给共用的进程池解码和编码，
+    同时在途的任务数有上限，语音再多内存占用也不会一直增长
+    @param items: 语音的 MsgSvrID
+    @param output_path: 输出目录
+    @param get_buffer: get_buffer(reserved0) 返回语音数据，在调用线程里执行
+    @param max_workers: 同时转换的条数，默认等于进程池的进程数
+    @param callback: 每处理完一条调用 callback(reserved0, mp3_path)，失败时 mp3_path 为空字符串
+    @param is_cancelled: 比如 QThread.isInterruptionRequested，返回 True 时停止提交并取消还没开始的任务
+    @return: 吞吐量统计
+    """
+    os.makedirs(output_path, exist_ok=True)
+    manifest = Manifest(output_path)
+    stats = TranscodeStats()
+    ffmpeg_path = get_ffmpeg_path()
+    max_workers = max_workers or process_pool.MAX_WORKERS
+    executor = process_pool.get_executor()
+    pending = {}
+
+    def done(future):
+        reserved0 = pending.pop(future)
+        if future.cancelled():
+            return
+        mp3_path = ''
+        try:
+            stats.audio_seconds += future.result()
+            manifest.add(reserved0)
+            stats.converted += 1
+            mp3_path = manifest.mp3_path(reserved0)
+        except Exception as e:
+            stats.failed += 1
+            logger.error(f'语音{reserved0}转换失败: {e}')
+        if callback:
+            callback(reserved0, mp3_path)
+
+    try:
+        for reserved0 in items:
+            if is_cancelled and is_cancelled():
+                # 正在转换的等它完成并记录到清单里，下次导出时跳过
+                for future in pending:
+                    future.cancel()
+                logger.info('语音转换已取消')
+                break
+            stats.total += 1
+            if manifest.is_done(reserved0):
+                stats.skipped += 1
+                if callback:
+                    callback(reserved0, manifest.mp3_path(reserved0))
+                continue
+            buf = get_buffer(reserved0)
+            if not buf:
+                stats.missing += 1
+                if callback:
+                    callback(reserved0, '')
+                continue
+            stats.input_bytes += len(buf)
+            future = executor.submit(transcode, buf, manifest.mp3_path(reserved0), SAMPLE_RATE, ffmpeg_path)
+            pending[future] = reserved0
+            if len(pending) >= max_workers * 4:
+                finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done(future)
+        while pending:
+            finished, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+            for future in finished:
+                done(future)
+    finally:
+        # 进程池是共用的，出错退出时不会随着关闭，还没开始的任务要自己取消
+        for future in pending:
+            future.cancel()
+        # 中途取消时也记录已经完成的部分
+        manifest.save()
+    stats.finish()
+    logger.info(str(stats))
+    return stats
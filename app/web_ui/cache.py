@@ -0,0 +1,66 @@
+import threading
+from collections import OrderedDict
+
+from app.DataBase import db_generation
+
+
+class ResultCache:
+    """
+    报告页面的结果缓存
+    以 (接口, wxid, 时间范围, 数据库代数) 为键，数据库重新合并后代数加一，旧结果不会再被命中，
+    之后按最近使用的顺序被淘汰。
+    同一个键同时只计算一次，多个标签页同时打开同一个报告时其余请求等待第一个的结果
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._computing = {}
+
+    @staticmethod
+    def make_key(endpoint, wxid='', time_range=None):
+        # 时间范围可能来自界面（tuple/date）也可能来自请求的 JSON（list/str），统一成字符串元组
+        time_range = tuple(map(str, time_range)) if time_range else None
+        return endpoint, wxid, time_range, db_generation()
+
+    def get(self, endpoint, wxid, time_range, compute):
+        """
+        @param endpoint: 接口名
+        @param wxid:
+        @param time_range:
+        @param compute: 没有缓存时调用 compute() 计算结果
+        @return:
+        """
+        key = self.make_key(endpoint, wxid, time_range)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        with key_lock:
+            with self._lock:
+                if key in self._cache:
+                    return self._cache[key]
+            try:
+                result = compute()
+            except Exception:
+                with self._lock:
+                    self._computing.pop(key, None)
+                raise
+            with self._lock:
+                self._cache[key] = result
+                if len(self._cache) > self.maxsize:
+                    self._cache.popitem(last=False)
+                self._computing.pop(key, None)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def __len__(self):
+        return len(self._cache)
+
+
+result_cache = ResultCache()
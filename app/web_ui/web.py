@@ -6,14 +6,16 @@ from urllib.parse import urljoin
 import requests
 from flask import Flask, render_template, send_file, jsonify, make_response, request
 from pyecharts.charts import Bar
+from werkzeug.serving import make_server
 
-from app.DataBase import msg_db, micro_msg_db
+from app.DataBase import msg_db, micro_msg_db, msg_stats_db, msg_search_db
 from app.DataBase.hard_link import decodeExtraBuf
 from app.analysis import analysis
 from app.config import SERVER_API_URL
 from app.person import Contact, Me, ContactDefault
 from app.util.emoji import get_most_emoji
 from app.util.region_conversion import conversion_region_to_chinese
+from app.web_ui.cache import result_cache
 
 app = Flask(__name__)
 
@@ -30,6 +32,10 @@ api_url = urljoin(SERVER_API_URL,'upload')
 
 
 def get_contact(wxid) -> ContactDefault | Contact:
+    return result_cache.get('contact', wxid, None, lambda: load_contact(wxid))
+
+
+def load_contact(wxid) -> ContactDefault | Contact:
     contact_info_list = micro_msg_db.get_contact_by_username(wxid)
     if not contact_info_list:
         return ContactDefault('')
@@ -46,7 +52,6 @@ def get_contact(wxid) -> ContactDefault | Contact:
         'detail': detail,
     }
     contact =Contact(contact_info)
-    print(detail)
     # region = contact.detail.get('region')
     # area = conversion_region_to_chinese(region)
     # print(area)
@@ -55,7 +60,11 @@ def get_contact(wxid) -> ContactDefault | Contact:
 
 @app.route("/")
 def index():
-    contact_topN_num = msg_db.get_chatted_top_contacts(time_range=time_range, top_n=9999999, contain_chatroom=True)
+    return result_cache.get('index', '', time_range, render_index)
+
+
+def render_index():
+    contact_topN_num = msg_stats_db.get_chatted_top_contacts(time_range=time_range, top_n=9999999, contain_chatroom=True)
     total_msg_num = sum(list(map(lambda x: x[1], contact_topN_num)))
     contact_topN = []
     for wxid, num in contact_topN_num:
@@ -64,12 +73,12 @@ def index():
         contact_topN.append([contact, num, text_length])
     contacts_data = analysis.contacts_analysis(contact_topN)
     contact_topN = []
-    send_msg_num = msg_db.get_send_messages_number_sum(time_range)
-    contact_topN_num = msg_db.get_chatted_top_contacts(time_range=time_range, top_n=9999999, contain_chatroom=False)
+    send_msg_num = msg_stats_db.get_send_messages_number_sum(time_range)
+    contact_topN_num = msg_stats_db.get_chatted_top_contacts(time_range=time_range, top_n=9999999, contain_chatroom=False)
 
     for wxid, num in contact_topN_num[:6]:
         contact = get_contact(wxid)
-        text_length = msg_db.get_message_length(wxid, time_range)
+        text_length = msg_stats_db.get_message_length(wxid, time_range)
         contact_topN.append([contact, num, text_length])
 
     my_message_counter_data = analysis.my_message_counter(time_range=time_range)
@@ -85,6 +94,12 @@ def index():
 
 @app.route("/christmas/<wxid>")
 def christmas(wxid):
+    global html
+    html = result_cache.get('christmas', wxid, time_range, lambda: render_christmas(wxid))
+    return html
+
+
+def render_christmas(wxid):
     contact = get_contact(wxid)
     # 渲染模板，并传递图表的 HTML 到模板中
     try:
@@ -99,7 +114,7 @@ def christmas(wxid):
         'first_time': first_time,
     }
     wordcloud_cloud_data = analysis.wordcloud_christmas(contact.wxid,time_range=time_range)
-    msg_data = msg_db.get_messages_by_hour(contact.wxid, time_range=time_range)
+    msg_data = msg_stats_db.get_messages_by_hour(contact.wxid, time_range=time_range)
     msg_data.sort(key=lambda x: x[1], reverse=True)
     desc = {
         '夜猫子': {'22:00', '23:00', '00:00', '01:00', '02:00', '03:00', '04:00', '05:00'},
@@ -121,7 +136,7 @@ def christmas(wxid):
         'chat_time': chat_time,
         'chat_time_num': num,
     }
-    month_data = msg_db.get_messages_by_month(contact.wxid, time_range=time_range)
+    month_data = msg_stats_db.get_messages_by_month(contact.wxid, time_range=time_range)
 
     if month_data:
         month_data.sort(key=lambda x: x[1])
@@ -135,7 +150,7 @@ def christmas(wxid):
 
     month_data = {
         'year': '2023',
-        'total_msg_num': msg_db.get_messages_number(contact.wxid, time_range=time_range),
+        'total_msg_num': msg_stats_db.get_messages_number(contact.wxid, time_range=time_range),
         'max_month': max_month,
         'min_month': min_month,
         'max_month_num': max_num,
@@ -150,10 +165,8 @@ def christmas(wxid):
         'emoji_url': url,
         'emoji_num': num,
     }
-    global html
-    html = render_template("christmas.html", **data, **wordcloud_cloud_data, **time_data, **month_data, **calendar_data,
-                           **emoji_data)
-    return html
+    return render_template("christmas.html", **data, **wordcloud_cloud_data, **time_data, **month_data,
+                           **calendar_data, **emoji_data)
 
 
 @app.route('/upload')
@@ -216,15 +229,22 @@ def test():
 
 
 def run(port=21314):
+    """
+    启动报告服务，阻塞直到服务停止
+    多线程处理请求，每个线程从连接池取自己的数据库连接，多个标签页或局域网内同时访问也不会互相阻塞
+    """
     global run_flag
     if not run_flag:
         try:
-            app.run(debug=True, host='0.0.0.0', port=port, use_reloader=False)
-            run_flag = True
-        except:
-            pass
-    else:
-        pass
+            server = make_server('0.0.0.0', int(port), app, threaded=True)
+        except OSError:
+            # 端口已被占用，通常是服务已经在运行
+            return
+        run_flag = True
+        try:
+            server.serve_forever()
+        finally:
+            run_flag = False
 
 
 def resource_path(relative_path):
@@ -246,7 +266,8 @@ def get_image(filename):
 def get_chart_options():
     wxid = request.json.get('wxid')
     time_range = request.json.get('time_range', [])
-    data = analysis.month_count(wxid, time_range=time_range)
+    data = result_cache.get('month_count', wxid, time_range,
+                            lambda: analysis.month_count(wxid, time_range=time_range))
     return jsonify(data)
 
 
@@ -255,12 +276,17 @@ def get_wordcloud():
     wxid = request.json.get('wxid')
     time_range = request.json.get('time_range', [])
 
-    world_cloud_data = analysis.wordcloud_(wxid, time_range=time_range)
+    world_cloud_data = result_cache.get('wordcloud', wxid, time_range,
+                                        lambda: analysis.wordcloud_(wxid, time_range=time_range))
     return jsonify(world_cloud_data)
 
 
 @app.route('/charts/<wxid>')
 def charts(wxid):
+    return result_cache.get('charts', wxid, None, lambda: render_charts(wxid))
+
+
+def render_charts(wxid):
     # 渲染模板，并传递图表的 HTML 到模板中
     contact = get_contact(wxid)
     try:
@@ -280,7 +306,8 @@ def charts(wxid):
 def get_calendar():
     wxid = request.json.get('wxid')
     time_range = request.json.get('time_range', [])
-    world_cloud_data = analysis.calendar_chart(wxid, time_range=time_range)
+    world_cloud_data = result_cache.get('calendar', wxid, time_range,
+                                        lambda: analysis.calendar_chart(wxid, time_range=time_range))
     return jsonify(world_cloud_data)
 
 
@@ -289,7 +316,40 @@ def get_counter():
     wxid = request.json.get('wxid')
     time_range = request.json.get('time_range', [])
     contact = get_contact(wxid)
-    data = analysis.sender(wxid, time_range=time_range, my_name=Me().name, ta_name=contact.remark)
+    data = result_cache.get(
+        'message_counter', wxid, time_range,
+        lambda: analysis.sender(wxid, time_range=time_range, my_name=Me().name, ta_name=contact.remark)
+    )
+    return jsonify(data)
+
+
+@app.route('/search', methods=['POST'])
+def search_messages():
+    keyword = request.json.get('keyword', '')
+    wxid = request.json.get('wxid', '')
+    time_range = request.json.get('time_range', [])
+    page = int(request.json.get('page', 0))
+    page_size = int(request.json.get('page_size', 20))
+    if not msg_search_db.is_ready():
+        # 全文索引在解密合并数据库时建立，还没建好时不在请求里临时建立
+        return jsonify({'error': 'index not ready', 'message': '全文索引还没有建立或正在更新，请稍后再试'}), 503
+    result = msg_search_db.search(keyword, wxid, time_range=time_range, page=page, page_size=page_size)
+    data = {
+        'total': msg_search_db.count(keyword, wxid, time_range=time_range),
+        'page': page,
+        'messages': [
+            {
+                'local_id': local_id,
+                'wxid': str_talker,
+                'type': type_,
+                'is_sender': is_sender,
+                'timestamp': create_time,
+                'str_time': str_time,
+                'content': content,
+            }
+            for local_id, str_talker, type_, is_sender, create_time, str_time, content in result
+        ],
+    }
     return jsonify(data)
 
 
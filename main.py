@@ -1,7 +1,19 @@
 import ctypes
+import multiprocessing
 import sys
 import time
 import traceback
+
+if __name__ == '__main__':
+    # 打包后进程池的子进程也从这里启动，要在导入 PyQt 和界面模块之前交给 multiprocessing，
+    # 子进程只导入自己用到的模块
+    multiprocessing.freeze_support()
+
+from app.log import startup_profile
+
+# 设置 MEMOTRACE_PROFILE_STARTUP=1 时记录启动耗时，必须在导入其它模块之前
+startup_profile.install()
+
 from PyQt5.QtGui import QFont, QPixmap, QIcon
 from PyQt5.QtWidgets import *
 from PyQt5.QtCore import Qt
@@ -9,11 +21,14 @@ from PyQt5.QtCore import Qt
 from app.log.exception_handling import ExceptionHanding, send_error_msg
 from app.ui.Icon import Icon
 from app.DataBase import close_db
+from app.util import process_pool
 from app.log import logger
 from app.ui import mainview
 from app.ui.tool.pc_decrypt import pc_decrypt
 from app.config import version, SEND_LOG_FLAG
 
+startup_profile.mark('imports_done')
+
 widget = None
 
 
@@ -86,6 +101,8 @@ class ViewController(QWidget):
         self.viewMainWindow.exitSignal.connect(self.close)
         try:
             self.viewMainWindow.setWindowTitle(f"留痕-{version}")
+            startup_profile.mark('main_window_created')
+            startup_profile.watch_first_paint(self.viewMainWindow)
             self.viewMainWindow.show()
             end = time.time()
             self.viewMainWindow.init_ui()
@@ -100,6 +117,7 @@ class ViewController(QWidget):
 
     def close(self) -> bool:
         close_db()
+        process_pool.shutdown()
         super().close()
 
 